@@ -1,7 +1,18 @@
 import cv2
+import importlib.util
 import os
 import time
 
+def load_face_tracker():
+    """FaceTracker of the rPPG lab, loaded from its file: one implementation for both labs"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06 - rppg', 'face_tracker.py')
+    spec = importlib.util.spec_from_file_location('rppg_face_tracker', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.FaceTracker
+
+FaceTracker = load_face_tracker()
+
 class EmotionCapture:
     def __init__(self, capture_time=10):
         self.capture_time = capture_time
@@ -16,6 +27,9 @@ class EmotionCapture:
         
         # Load Haar Cascade for face detection
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # the cascade runs on a downscaled frame every 10 frames, faces are tracked in between
+        self.tracker = FaceTracker(self.face_cascade, detect_interval=10, scaleFactor=1.1, minNeighbors=5,
+                                   minSize=(200, 200))
         
         # Start video capture
         self.cap = cv2.VideoCapture(0)
@@ -27,7 +41,7 @@ class EmotionCapture:
         
         frame_visual = frame.copy()
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(200, 200))
+        faces = self.tracker.update(gray)
         
         for (x, y, w, h) in faces:
             cv2.rectangle(frame_visual, (x, y), (x + w, y + h), (255, 0, 0), 2)
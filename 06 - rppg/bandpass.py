@@ -0,0 +1,89 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+from hr_estimator import HR_BAND
+
+
+@lru_cache(maxsize=32)
+def design_bandpass(fs, lowcut=HR_BAND[0], highcut=HR_BAND[1], order=4):
+    """
+    Butterworth bandpass as second-order sections, cached per (fs, band, order)
+    :return: (sos, sosfilt_zi of sos), None when the band does not fit below the Nyquist frequency
+    """
+    nyquist = 0.5 * fs
+    low = lowcut / nyquist
+    high = highcut / nyquist
+    if not (0 < low < high < 1.0):
+        return None
+
+    # shared by all the filters with the same design, do not modify
+    sos = butter(order, [low, high], btype="band", output="sos")
+    return sos, sosfilt_zi(sos)
+
+
+class StreamingBandpass:
+    """
+    Bandpass filter applied chunk by chunk: the sosfilt state is carried between chunks,
+    so each chunk costs O(chunk) and the output is the same as filtering the whole recording
+    at once. The filter is designed again only when the sampling rate given to set_rate
+    drifts more than rate_tolerance (relative) from the one of the current design.
+
+    With lookahead > 0 the output is zero-phase like filtfilt but delayed by lookahead samples:
+    the backward pass runs over the last lookahead samples of the forward output,
+    and only the samples with a full lookahead behind them are returned
+    """
+
+    def __init__(self, fs, lowcut=HR_BAND[0], highcut=HR_BAND[1], order=4, rate_tolerance=0.05, lookahead=0):
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.order = order
+        self.rate_tolerance = rate_tolerance
+        self.lookahead = lookahead
+        self.designs = 0
+        self.pending = np.empty(0)
+        self._design(fs)
+
+    def _design(self, fs):
+        self.fs = fs
+        self.design = design_bandpass(round(fs, 3), self.lowcut, self.highcut, self.order)
+        self.designs += 1
+        if self.design is None:
+            print(f"[WARN] Invalid filter range for fs={fs:.2f} Hz — passing the signal through")
+        # the state of the new filter starts from the next input, see process
+        self.zi = None
+
+    def set_rate(self, fs):
+        """Measured sampling rate, the filter is redesigned only if it drifted beyond the tolerance"""
+        if abs(fs - self.fs) > self.rate_tolerance * self.fs:
+            self._design(fs)
+            return True
+        return False
+
+    def process(self, samples):
+        """
+        Filter the next chunk of samples
+        :return: the filtered samples, lookahead samples behind the input in zero-phase mode
+        """
+        samples = np.atleast_1d(np.asarray(samples, dtype=float))
+        if len(samples) == 0 or self.design is None:
+            return samples
+
+        sos, zi = self.design
+        if self.zi is None:
+            # steady state for a constant input equal to the first sample, as filtfilt does
+            self.zi = zi * samples[0]
+        forward, self.zi = sosfilt(sos, samples, zi=self.zi)
+        if self.lookahead <= 0:
+            return forward
+
+        # backward pass over the forward output not returned yet
+        self.pending = np.concatenate((self.pending, forward))
+        ready = len(self.pending) - self.lookahead
+        if ready <= 0:
+            return np.empty(0)
+        backward, _ = sosfilt(sos, self.pending[::-1], zi=zi * self.pending[-1])
+        output = backward[::-1][:ready]
+        self.pending = self.pending[ready:]
+        return output
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Micro-benchmarks for the PPG and rPPG code of this lab
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from scipy.signal import butter, filtfilt, sosfilt, sosfiltfilt
+
+from bandpass import StreamingBandpass, design_bandpass
+from cms50d import PACKET_SIZE, decode_packets
+from face_tracker import FaceTracker, TRACKING_METHODS, iou
+from hr_estimator import StreamingHR, HR_BAND
+from ring_buffer import SignalWindow
+from rppg_methods import METHODS, PulseExtractor, extract_pulse
+
+# sampling rate of the CMS50D waveform
+CMS50D_RATE = 60
+
+
+def timeit(func, repeat):
+    """
+    Run func repeat times and return the best time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_ppg(duration, rate, hr=72.0, seed=0):
+    """
+    PPG-like waveform in the 0-127 range of the CMS50D, with noise
+    :return: (timestamps in seconds, waveform)
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * rate)) / rate
+    f = hr / 60.0
+    wave = np.sin(2 * np.pi * f * t) + 0.4 * np.sin(4 * np.pi * f * t + 0.8)
+    wave = 64 + 40 * wave / np.max(np.abs(wave)) + rng.normal(0, 2, len(t))
+    return t, np.clip(wave, 0, 127).astype(int)
+
+
+def synthetic_rppg(duration, fps, seed=0):
+    """
+    RGB means of a forehead with a pulse of varying HR (62-82 bpm) under illumination changes
+    and specular reflections at 1.5 Hz, inside the HR band, plus the CMS50D waveform of the same pulse
+    :return: (rgb (n, 3), CMS50D waveform at CMS50D_RATE)
+    """
+    rng = np.random.default_rng(seed)
+
+    def pulse(rate):
+        t = np.arange(int(duration * rate)) / rate
+        hr = 72 + 10 * np.sin(2 * np.pi * t / 60)
+        phase = 2 * np.pi * np.cumsum(hr / 60) / rate
+        return t, np.sin(phase) + 0.4 * np.sin(2 * phase + 0.8)
+
+    t, p = pulse(fps)
+    # skin colour and direction of the blood volume pulse in normalized RGB (de Haan and Jeanne)
+    skin = 200 * np.array([0.77, 0.51, 0.38])
+    signature = np.array([0.33, 0.77, 0.53])
+    intensity = 1 + 0.01 * np.sin(2 * np.pi * 1.5 * t) + 0.05 * np.sin(2 * np.pi * 0.05 * t)
+    specular = 2 * (1 + np.sin(2 * np.pi * 1.5 * t + 1.0)) + 0.5 * rng.normal(0, 1, len(t))
+    rgb = intensity[:, None] * (skin + 0.6 * p[:, None] * signature + specular[:, None])
+    rgb += rng.normal(0, 0.2, rgb.shape)
+
+    _, waveform = pulse(CMS50D_RATE)
+    return rgb, 64 + 40 * waveform / np.abs(waveform).max()
+
+
+def hr_every_second(signal, fs, window):
+    """HR every second over the last window seconds, after the first window"""
+    estimator = StreamingHR(fs, window=window)
+    hop = int(round(fs))
+    hr = []
+    for end in range(hop, len(signal) + 1, hop):
+        estimator.push(signal[end - hop:end])
+        hr.append(estimator.hr())
+    return np.array([value for value in hr if value is not None])
+
+
+def bench_window(args):
+    for window_seconds in args.windows:
+        # a few windows worth of samples, the buffer is full most of the time
+        timestamps, waveform = synthetic_ppg(3 * window_seconds, CMS50D_RATE)
+        start = datetime.datetime(2025, 1, 1)
+        datetimes = [start + datetime.timedelta(seconds=t) for t in timestamps]
+
+        def list_window():
+            # the loop of ppg_hr.py before the ring buffer
+            xdata, ydata = [], []
+            for now, value in zip(datetimes, waveform):
+                xdata.append(now)
+                ydata.append(value)
+                cutoff = now - datetime.timedelta(seconds=window_seconds)
+                xdata = [t for t in xdata if t >= cutoff]
+                ydata = ydata[-len(xdata):]
+                dt = (xdata[-1] - xdata[0]).total_seconds()
+                if dt > 0:
+                    len(xdata) / dt
+
+        def ring_window():
+            window = SignalWindow(duration=window_seconds, max_rate=100)
+            for now, value in zip(timestamps, waveform):
+                window.append(now, value)
+                window.window()
+                window.sampling_rate()
+
+        t_list = timeit(list_window, args.repeat) / len(timestamps)
+        t_ring = timeit(ring_window, args.repeat) / len(timestamps)
+        print("{:>4g} s window at {} Hz: lists {:8.2f} us/sample, ring buffer {:6.2f} us/sample, speedup {:5.1f}x"
+              .format(window_seconds, CMS50D_RATE, t_list * 1e6, t_ring * 1e6, t_list / t_ring))
+
+
+def fft_hr(waveform, fs, zero_padding=4):
+    """
+    Heart rate from the FFT of the whole window, with the same mean removal, Hann window,
+    zero-padding and band as StreamingHR
+    """
+    x = (waveform - waveform.mean()) * np.hanning(len(waveform) + 1)[:-1]
+    power = np.abs(np.fft.rfft(x, zero_padding * len(x))) ** 2
+    freqs = np.fft.rfftfreq(zero_padding * len(x), 1 / fs)
+    in_band = np.flatnonzero((freqs >= HR_BAND[0]) & (freqs <= HR_BAND[1]))
+    return 60 * freqs[in_band[np.argmax(power[in_band])]]
+
+
+def bench_hr(args):
+    for window_seconds in args.windows:
+        hr = 72.0
+        _, waveform = synthetic_ppg(3 * window_seconds, CMS50D_RATE, hr=hr)
+        waveform = waveform.astype(float)
+        n = int(window_seconds * CMS50D_RATE)
+
+        def full_fft():
+            for i in range(n, len(waveform)):
+                fft_hr(waveform[i - n:i], CMS50D_RATE)
+
+        estimator = StreamingHR(CMS50D_RATE, window=window_seconds)
+
+        def sliding_dft():
+            estimator.push(waveform[:n])
+            for value in waveform[n:]:
+                estimator.push(value)
+                estimator.hr()
+
+        t_fft = timeit(full_fft, args.repeat) / (len(waveform) - n)
+        t_sdft = timeit(sliding_dft, args.repeat) / (len(waveform) - n)
+        print("{:>4g} s window at {} Hz: full FFT {:7.2f} us/sample, sliding DFT {:6.2f} us/sample, speedup {:5.1f}x, "
+              "HR {:.2f} / {:.2f} bpm (true {:.0f})"
+              .format(window_seconds, CMS50D_RATE, t_fft * 1e6, t_sdft * 1e6, t_fft / t_sdft,
+                      fft_hr(waveform[-n:], CMS50D_RATE), estimator.hr(), hr))
+
+
+def bench_filter(args):
+    fs = args.fs
+    _, signal = synthetic_ppg(args.duration, fs)
+    # slow drift, like the illumination changes of the webcam
+    signal = signal + np.linspace(0, 20, len(signal))
+    n = int(args.window * fs)
+
+    def refilter():
+        # rppg_live_cam.py before the streaming filter: design and filtfilt of the window once a second
+        for i in range(n, len(signal), int(fs)):
+            b, a = butter(4, [HR_BAND[0] / (0.5 * fs), HR_BAND[1] / (0.5 * fs)], btype="band")
+            filtfilt(b, a, signal[i - n:i])
+
+    def stream(lookahead, chunk):
+        bandpass = StreamingBandpass(fs, lookahead=lookahead)
+        return np.concatenate([bandpass.process(signal[i:i + chunk]) for i in range(0, len(signal), chunk)])
+
+    seconds = (len(signal) - n) / fs
+    t_refilter = timeit(refilter, args.repeat) / seconds
+    print("filtfilt of the {:g} s window once a second: {:7.3f} ms per second of signal"
+          .format(args.window, t_refilter * 1e3))
+
+    sos, zi = design_bandpass(fs)
+    causal, _ = sosfilt(sos, signal, zi=zi * signal[0])
+    zero_phase = sosfiltfilt(sos, signal)
+    for lookahead in [0] + args.lookahead:
+        for chunk in (1, int(fs)):
+            t_stream = timeit(lambda: stream(lookahead, chunk), args.repeat) * fs / len(signal)
+            output = stream(lookahead, chunk)
+            if lookahead == 0:
+                error = np.max(np.abs(output - causal)) / np.std(causal)
+                name = 'causal'
+            else:
+                # the first seconds are left out, filtfilt pads the edges
+                skip = 2 * lookahead
+                error = np.max(np.abs(output[skip:] - zero_phase[skip:len(output)])) / np.std(zero_phase)
+                name = 'lookahead {:.1f} s'.format(lookahead / fs)
+            print("{:>16}, chunks of {:3d}: {:7.3f} ms per second of signal, max error {:.1e} of the std vs {}"
+                  .format(name, chunk, t_stream * 1e3, error, 'sosfilt' if lookahead == 0 else 'sosfiltfilt'))
+
+def synthetic_face_video(image, filename, frames=300, fps=20):
+    """
+    Video of a still image moving around (translation and zoom), a stand-in for a recording
+    of record_video.py
+    """
+    base = cv2.imread(image)
+    height, width = base.shape[:2]
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for i in range(frames):
+        t = i / fps
+        scale = 1 + 0.05 * np.sin(2 * np.pi * 0.1 * t)
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), 0, scale)
+        matrix[:, 2] += (40 * np.sin(2 * np.pi * 0.2 * t), 20 * np.sin(2 * np.pi * 0.3 * t))
+        writer.write(cv2.warpAffine(base, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE))
+    writer.release()
+
+
+def read_video(filename):
+    cap = cv2.VideoCapture(filename)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def bench_tracker(args):
+    video = args.video
+    if not os.path.isfile(video):
+        video = os.path.join(tempfile.mkdtemp(), 'synthetic.avi')
+        synthetic_face_video(args.image, video)
+        print(f"{args.video} not found, using a synthetic video of {args.image}")
+    frames = read_video(video)
+    detect_kwargs = dict(scaleFactor=1.1, minNeighbors=3, minSize=(100, 100))
+
+    # reference: the full resolution cascade on every frame, as rppg_live_cam.py did
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    start = time.perf_counter()
+    reference = [cascade.detectMultiScale(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), **detect_kwargs)
+                 for frame in frames]
+    reference_fps = len(frames) / (time.perf_counter() - start)
+    found = [faces[0] for faces in reference if len(faces)]
+    print(f"{len(frames)} frames, reference detection on every frame: {reference_fps:6.1f} frames/s, "
+          f"face found in {len(found)} frames")
+
+    configurations = [('detect 0.5x every frame', dict(detect_interval=1, method='flow', smoothing=0))]
+    configurations += [(f"{method} every {args.detect_interval}", dict(detect_interval=args.detect_interval,
+                                                                         method=method, smoothing=args.smoothing))
+                       for method in TRACKING_METHODS]
+    for name, kwargs in configurations:
+        tracker = FaceTracker(cascade, detect_scale=args.detect_scale, **kwargs, **detect_kwargs)
+        start = time.perf_counter()
+        boxes = [tracker.update(frame) for frame in frames]
+        fps = len(frames) / (time.perf_counter() - start)
+
+        overlaps = [iou(found_boxes[0], faces[0]) if len(found_boxes) else 0.0
+                    for found_boxes, faces in zip(boxes, reference) if len(faces)]
+        print(f"{name:>24}: {fps:6.1f} frames/s ({fps / reference_fps:4.1f}x), IoU with the reference "
+              f"mean {np.mean(overlaps):.3f} min {np.min(overlaps):.3f}, cascade on {tracker.detections} frames")
+
+
+def bench_pulse(args):
+    fps = args.fps
+    rgb, waveform = synthetic_rppg(args.duration, fps)
+    # reference HR from the CMS50D waveform, as ppg_hr.py estimates it
+    reference = hr_every_second(waveform, CMS50D_RATE, args.window)
+    design = design_bandpass(float(fps))
+    print(f"{args.duration} s at {fps} fps, pulse and specular motion in the HR band, "
+          f"CMS50D reference HR {reference.min():.0f}-{reference.max():.0f} bpm")
+
+    for method in METHODS:
+        def stream():
+            extractor = PulseExtractor(fps, method=method)
+            for frame in rgb:
+                extractor.push(frame)
+
+        t_frame = timeit(stream, args.repeat) / len(rgb)
+        pulse = extract_pulse(rgb, fps, method)
+        filtered = sosfiltfilt(design[0], pulse)
+        hr = hr_every_second(filtered, fps, args.window)
+        n = min(len(hr), len(reference))
+        error = np.abs(hr[:n] - reference[:n])
+        print(f"{method:>6}: {t_frame * 1e6:6.1f} us/frame ({t_frame * fps:6.2%} of a core at {fps} fps), "
+              f"HR error vs CMS50D mean {error.mean():5.2f} bpm, within 5 bpm {np.mean(error < 5):4.0%}")
+
+
+def bench_decode(args):
+    import serial
+    from fake_cms50d import FakeCMS50D, synthetic_stream
+
+    stream = synthetic_stream(args.duration)
+    packets = len(stream) // PACKET_SIZE
+
+    def byte_by_byte(connection):
+        # _read_packet and _decode_packet of the driver before the block reads
+        decoded = 0
+        while decoded < packets:
+            datetime.datetime.now()  # send_keepalive, once per byte
+            byte = connection.read()
+            if not (byte[0] & 0x80):
+                packet = list(byte + connection.read(8))
+                high_byte = packet[1]
+                data = packet[2:]
+                for i in range(len(data)):
+                    data[i] = (data[i] & 0x7F) | ((high_byte << (7 - i)) & 0x80)
+                decoded += 1
+
+    def blocks(connection):
+        decoded = 0
+        pending = b''
+        while decoded < packets:
+            datetime.datetime.now()  # send_keepalive, once per block
+            pending += connection.read(min(max(connection.in_waiting, 1), 1024))
+            package_types, _, consumed, _ = decode_packets(pending)
+            pending = pending[consumed:]
+            decoded += len(package_types)
+
+    for name, reader in (('byte by byte', byte_by_byte), ('blocks', blocks)):
+        # the whole stream as fast as the pty takes it, CPU time of the reading thread only
+        device = FakeCMS50D(stream, rate=1e9)
+        connection = serial.Serial(device.port, timeout=1)
+        device.start()
+        start = time.thread_time()
+        wall = time.perf_counter()
+        reader(connection)
+        cpu = (time.thread_time() - start) / packets
+        wall = (time.perf_counter() - wall) / packets
+        connection.close()
+        device.stop()
+        print(f"{name:>12}: {cpu * 1e6:6.2f} us CPU/packet ({cpu * CMS50D_RATE:.3%} of a core at {CMS50D_RATE} Hz), "
+              f"{wall * 1e6:6.2f} us/packet")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the PPG and rPPG code')
+    parser.add_argument('-r', '--repeat', type=int, help='Number of repetitions, the best time is reported',
+                        required=False, default=3)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_window = subparsers.add_parser('window', help='Cost per sample of the signal window, lists vs ring buffer')
+    parser_window.add_argument('-w', '--windows', type=float, nargs='+', help='Window lengths in s', required=False,
+                               default=[10, 60])
+    parser_window.set_defaults(func=bench_window)
+
+    parser_hr = subparsers.add_parser('hr', help='Cost per sample of the HR estimate, full FFT vs sliding DFT')
+    parser_hr.add_argument('-w', '--windows', type=float, nargs='+', help='Window lengths in s', required=False,
+                           default=[10, 60])
+    parser_hr.set_defaults(func=bench_hr)
+
+    parser_filter = subparsers.add_parser('filter', help='Bandpass of the rPPG signal, filtfilt once a second vs '
+                                                         'streaming filter, sample by sample')
+    parser_filter.add_argument('--fs', type=float, help='Sampling rate in Hz', required=False, default=10.0)
+    parser_filter.add_argument('--window', type=float, help='Window refiltered by filtfilt in s', required=False,
+                               default=20.0)
+    parser_filter.add_argument('--duration', type=float, help='Signal length in s', required=False, default=300.0)
+    parser_filter.add_argument('--lookahead', type=int, nargs='*', help='Lookahead of the zero-phase mode in samples',
+                               required=False, default=[50, 100])
+    parser_filter.set_defaults(func=bench_filter)
+
+    parser_decode = subparsers.add_parser('decode', help='CMS50D packets read from a fake device, byte by byte vs '
+                                                         'vectorized decoding of blocks')
+    parser_decode.add_argument('--duration', type=int, help='Seconds of packets', required=False, default=300)
+    parser_decode.set_defaults(func=bench_decode)
+
+    parser_pulse = subparsers.add_parser('pulse', help='Green mean vs CHROM vs POS on synthetic traces, cost per '
+                                                       'frame and HR error against the CMS50D reference')
+    parser_pulse.add_argument('--fps', type=int, help='Camera frame rate', required=False, default=30)
+    parser_pulse.add_argument('--duration', type=int, help='Seconds of signal', required=False, default=120)
+    parser_pulse.add_argument('--window', type=float, help='HR window in seconds', required=False, default=10)
+    parser_pulse.set_defaults(func=bench_pulse)
+
+    parser_tracker = subparsers.add_parser('tracker', help='Face detection on every frame vs detect-then-track, '
+                                                           'frames/s and IoU with the full resolution detection')
+    parser_tracker.add_argument('--video', type=str, help='Video recorded with record_video.py', required=False,
+                                default='output.avi')
+    parser_tracker.add_argument('--image', type=str, help='Image moved around when the video does not exist',
+                                required=False, default=os.path.join('..', '07 - temperature', 'image.jpg'))
+    parser_tracker.add_argument('--detect-interval', type=int, help='Frames between detections', required=False,
+                                default=10)
+    parser_tracker.add_argument('--detect-scale', type=float, help='Downscaling of the detection', required=False,
+                                default=0.5)
+    parser_tracker.add_argument('--smoothing', type=float, help='Weight of the previous box', required=False,
+                                default=0.5)
+    parser_tracker.set_defaults(func=bench_tracker)
+
+    args = parser.parse_args()
+    args.func(args)
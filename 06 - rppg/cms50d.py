@@ -1,11 +1,96 @@
 import threading
-import queue
 import time
 import datetime
+import numpy as np
 import serial
+from sample_queue import SampleQueue, SAMPLE_DTYPE
+
+PACKET_SIZE = 9
+REALTIME_PACKET = 0x01
+# nominal rate of the real-time packets, spaces the arrival stamps of the packets read together
+SAMPLE_RATE = 60
+# largest read from the serial port, about 2 seconds of packets
+READ_SIZE = 1024
+
+
+def encode_packet(package_type, data):
+    """
+    Packet of the CMS50D protocol: the type with the sync bit clear, a byte with the high bits
+    of the 7 data bytes, then the data bytes with the sync bit set
+    """
+    data = list(data) + [0x00] * (7 - len(data))
+    high_byte = 0x80
+    for i in range(len(data)):
+        high_byte |= (data[i] & 0x80) >> (7 - i)
+        data[i] |= 0x80  # Set sync bit
+    package_type &= 0x7F  # Clear sync bit
+    return bytes([package_type, high_byte] + data)
+
+
+def decode_packets(buffer):
+    """
+    Decode all the complete packets of a block of bytes at once. A packet starts on a byte
+    with the high bit clear followed by 8 bytes with the high bit set; a start cut short by
+    the next one, or followed by more than 8 such bytes, is a decode error
+    :return: (packet types (n,), data bytes (n, 7), bytes consumed, decode errors);
+             the bytes after the consumed ones begin an incomplete packet
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    starts = np.flatnonzero((raw & 0x80) == 0)
+    # distance to the next start, the last start is followed by the end of the buffer
+    following = np.append(starts[1:], len(raw)) - starts
+    complete = following >= PACKET_SIZE
+    # packets cut short, and stray bytes after a packet (the rest of a packet that lost its start)
+    errors = int(np.count_nonzero(following[:-1] != PACKET_SIZE)) if len(starts) else 0
+    if len(starts) and following[-1] > PACKET_SIZE:
+        errors += 1
+    if len(starts) and not complete[-1]:
+        # the last packet is still arriving, or is cut short by the end of the buffer
+        consumed = int(starts[-1])
+    else:
+        consumed = len(raw)
+
+    packets = raw[starts[complete][:, None] + np.arange(PACKET_SIZE)]
+    high = packets[:, 1].astype(np.uint16)
+    # bit i of the high byte is the high bit of data byte i
+    high_bits = ((high[:, None] << (7 - np.arange(7))) & 0x80).astype(np.uint8)
+    data = (packets[:, 2:] & 0x7F) | high_bits
+    return packets[:, 0], data, consumed, errors
+
+def realtime_samples(package_types, data, arrival_ns, arrival, previous_ns=None):
+    """
+    SAMPLE_DTYPE samples of the real-time packets among decoded packets read together: they
+    arrived up to one sample period apart, the last one at arrival_ns (monotonic) and arrival (time.time).
+    previous_ns, the monotonic_ns of the last sample of the previous block, keeps the stamps sorted:
+    after a late block, an early one is not back-dated before it (nor stamped after its own arrival)
+    """
+    data = data[package_types == REALTIME_PACKET]
+    samples = np.zeros(len(data), dtype=SAMPLE_DTYPE)
+    period_ns = 10 ** 9 // SAMPLE_RATE
+    first_ns = arrival_ns - (len(data) - 1) * period_ns
+    if previous_ns is not None:
+        first_ns = max(first_ns, previous_ns + period_ns)
+    samples['monotonic_ns'] = np.minimum(first_ns + np.arange(len(data)) * period_ns, arrival_ns)
+    samples['timestamp'] = arrival - (arrival_ns - samples['monotonic_ns']) / 1e9
+    samples['signal_strength'] = data[:, 0] & 0x0F
+    samples['pulse_beep'] = (data[:, 0] & 0x40) >> 6
+    samples['probe_error'] = (data[:, 0] & 0x80) >> 7
+    samples['waveform'] = data[:, 1] & 0x7F
+    samples['pulse_rate'] = data[:, 3]
+    samples['spo2'] = data[:, 4]
+    return samples
+
 
 class CMS50D:
-    def __init__(self, port, baudrate=115200, timeout=1):
+    """
+    Driver of the CMS50D pulse oximeter. The samples are decoded on a background thread into a
+    SampleQueue with a backpressure policy: 'drop-oldest', 'block' or 'spill' (to disk, at spill_path
+    or in a temporary file), see sample_queue.POLICIES. received, dropped and decode_errors count
+    the packets. The serial port is read in blocks and the packets of a block are decoded together
+    """
+
+    def __init__(self, port, baudrate=115200, timeout=1, policy='drop-oldest', capacity=600, spill_path=None,
+                 raw_log=None):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
@@ -13,8 +98,11 @@ class CMS50D:
         self.realtime_streaming = False
         self.keepalive_interval = datetime.timedelta(seconds=5)
         self.keepalive_timestamp = datetime.datetime.now()
-        #self.data_queue = queue.Queue(maxsize=10)  # Limit queue size to avoid memory overload
-        self.data_queue = queue.Queue(maxsize=10)  # Limit queue size to avoid memory overload
+        # 10 seconds of the 60 Hz waveform by default
+        self.data_queue = SampleQueue(capacity=capacity, policy=policy, spill_path=spill_path)
+        self.decode_errors = 0
+        # file (opened in binary mode) receiving every byte read, to replay it with fake_cms50d.py
+        self.raw_log = raw_log
         self.thread = None  # Thread for background data collection
 
     def connect(self):
@@ -33,18 +121,8 @@ class CMS50D:
             self.connection.close()
 
     def send_command(self, command):
-        def encode_package(cmd):
-            package_type = 0x7D
-            data = [cmd] + [0x00] * 6
-            high_byte = 0x80
-            for i in range(len(data)):
-                high_byte |= (data[i] & 0x80) >> (7 - i)
-                data[i] |= 0x80  # Set sync bit
-            package_type &= 0x7F  # Clear sync bit
-            return [package_type, high_byte] + data
-
-        package = encode_package(command)
-        self.connection.write(bytes(package))
+        package = encode_packet(0x7D, [command])
+        self.connection.write(package)
         self.connection.flush()
 
 
@@ -56,6 +134,7 @@ class CMS50D:
     
     def start_live_acquisition(self):
         self.connection.reset_input_buffer()
+        self.data_queue.closed = False  # closed by stop_live_acquisition
         self.send_command(0xA1)  # Start real-time data
         self.realtime_streaming = True
 
@@ -67,68 +146,79 @@ class CMS50D:
     def stop_live_acquisition(self):
         self.send_command(0xA2)  # Stop real-time data
         self.realtime_streaming = False
+        # a producer blocked on a full queue gives up
+        self.data_queue.close()
+        # the reader returns within the serial timeout
+        if self.thread is not None:
+            self.thread.join(timeout=self.timeout + 1)
+
+    @property
+    def received(self):
+        return self.data_queue.received
+
+    @property
+    def dropped(self):
+        return self.data_queue.dropped
 
     def _collect_data(self):
+        pending = b''
+        previous_ns = None  # stamp of the last sample, the next ones are not stamped before it
         while self.realtime_streaming:
-            #print("Collecting data...")
-            packet = self._read_packet()
-            if packet:
-                package_type, data = self._decode_packet(packet)
-                if package_type == 0x01 and len(data) == 7:
-                    # Parse fields and put the data in the queue
-                    signal_strength = data[0] & 0x0F
-                    pulse_beep = (data[0] & 0x40) >> 6
-                    probe_error = (data[0] & 0x80) >> 7
-                    pulse_waveform = data[1] & 0x7F
-                    pulse_rate = data[3]
-                    spO2 = data[4]
-
-                    # Only put the latest data into the queue
-                    if not self.data_queue.full():
-                        self.data_queue.put({
-                            "timestamp": datetime.datetime.now(),
-                            "pulse_rate": None if pulse_rate == 0xFF else pulse_rate,
-                            "spO2": None if spO2 == 0x7F else spO2,
-                            "waveform": pulse_waveform,
-                            "signal_strength": signal_strength,
-                            "pulse_beep": pulse_beep,
-                            "probe_error": probe_error
-                        })
-                    #else:
-                        #print("Queue is full, discarding data.")
-                #else:
-                    #print("No data received. Check device connection or timeouts.")
-            #time.sleep(0.01)  # Add small delay to help stabilize the connection
-
-    def _read_packet(self):
-        while True:
             self.send_keepalive()
-            byte = self.connection.read()
-            if not byte:
+            # everything waiting in the serial buffer, or the next byte (up to timeout)
+            block = self.connection.read(min(max(self.connection.in_waiting, 1), READ_SIZE))
+            # arrival time on the monotonic clock shared with the other sensors (see recorder.py)
+            arrival_ns = time.monotonic_ns()
+            arrival = time.time()
+            if not block:
                 print("Serial timeout or no data received.")
-                return None
-            #print(f"Reading byte: {byte}")
-            if not byte:
-                return None
-            if not (byte[0] & 0x80):
-                packet = byte + self.connection.read(8)
-                if len(packet) == 9:
-                    return list(packet)
-
-    def _decode_packet(self, packet):
-        package_type = packet[0]
-        high_byte = packet[1]
-        data = list(packet[2:])
-        for i in range(len(data)):
-            data[i] = (data[i] & 0x7F) | ((high_byte << (7 - i)) & 0x80)
-        return package_type, data
+                continue
+            if self.raw_log is not None:
+                self.raw_log.write(block)
+
+            pending += block
+            package_types, data, consumed, errors = decode_packets(pending)
+            pending = pending[consumed:]
+            self.decode_errors += errors
+            samples = realtime_samples(package_types, data, arrival_ns, arrival, previous_ns)
+            if len(samples) == 0:
+                continue
+            previous_ns = int(samples['monotonic_ns'][-1])
+
+            # what happens when the consumer falls behind depends on the queue policy
+            self.data_queue.extend(samples)
+
+    @staticmethod
+    def _as_dict(sample):
+        return {
+            "timestamp": datetime.datetime.fromtimestamp(sample['timestamp']),
+            "monotonic_ns": int(sample['monotonic_ns']),
+            "pulse_rate": None if sample['pulse_rate'] == 0xFF else int(sample['pulse_rate']),
+            "spO2": None if sample['spo2'] == 0x7F else int(sample['spo2']),
+            "waveform": int(sample['waveform']),
+            "signal_strength": int(sample['signal_strength']),
+            "pulse_beep": int(sample['pulse_beep']),
+            "probe_error": int(sample['probe_error'])
+        }
 
     def get_latest_data(self):
         """
         Fetch the latest data from the queue.
         Returns None if no data is available.
         """
-        try:
-            return self.data_queue.get_nowait()  # Non-blocking, fetch data from queue
-        except queue.Empty:
-            return None
+        return self.get_data(timeout=0)  # Non-blocking, fetch data from queue
+
+    def get_data(self, timeout=None):
+        """
+        Fetch the next data from the queue, waiting up to timeout seconds.
+        Returns None if no data arrived in time.
+        """
+        sample = self.data_queue.get(timeout=timeout)
+        return None if sample is None else self._as_dict(sample)
+
+    def get_batch(self, timeout=None):
+        """
+        Fetch all the pending samples at once, waiting up to timeout seconds for the first one.
+        Returns a structured array of sample_queue.SAMPLE_DTYPE, empty if no data arrived in time.
+        """
+        return self.data_queue.get_batch(timeout=timeout)
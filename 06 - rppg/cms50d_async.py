@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import serial
+
+from cms50d import READ_SIZE, decode_packets, encode_packet, realtime_samples
+
+
+class AsyncCMS50D:
+    """
+    CMS50D driver for asyncio: no thread per device, the serial port is non-blocking and the
+    event loop calls the reader when bytes arrive (loop.add_reader, so a selector event loop:
+    Linux and macOS). The keepalive is a timer of the loop. The decoded samples come out as
+    batches (SAMPLE_DTYPE structured arrays) of an async iterator:
+
+        async with AsyncCMS50D(port) as monitor:
+            async for batch in monitor:
+                ...
+
+    Up to max_batches batches wait for the consumer, then the oldest are dropped and counted.
+    If the device is unplugged the iteration ends and error keeps the exception of the port
+    """
+
+    def __init__(self, port, baudrate=115200, keepalive_interval=5.0, max_batches=64):
+        self.port = port
+        self.baudrate = baudrate
+        self.keepalive_interval = keepalive_interval
+        self.connection = None
+        self.loop = None
+        self.batches = asyncio.Queue(maxsize=max_batches)
+        self.pending = b''
+        self.previous_ns = None  # stamp of the last sample, the next ones are not stamped before it
+        self.keepalive_handle = None
+        self.realtime_streaming = False
+        self.error = None
+
+        self.received = 0
+        self.dropped = 0
+        self.decode_errors = 0
+
+    def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.connection = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            timeout=0,  # reads return what is there
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            xonxoff=1
+        )
+        self.loop.add_reader(self.connection.fileno(), self._on_readable)
+
+    def disconnect(self):
+        if self.connection and self.connection.is_open:
+            try:
+                self.loop.remove_reader(self.connection.fileno())
+            finally:
+                self.connection.close()
+
+    def send_command(self, command):
+        self.connection.write(encode_packet(0x7D, [command]))
+
+    def _keepalive(self):
+        try:
+            self.send_command(0xaf)  # keepalive
+        except (serial.SerialException, OSError) as e:
+            self._lost(e)
+            return
+        self.keepalive_handle = self.loop.call_later(self.keepalive_interval, self._keepalive)
+
+    def start_live_acquisition(self):
+        self.connection.reset_input_buffer()
+        self.pending = b''
+        self.previous_ns = None
+        self.send_command(0xA1)  # Start real-time data
+        self.realtime_streaming = True
+        self.keepalive_handle = self.loop.call_later(self.keepalive_interval, self._keepalive)
+
+    def stop_live_acquisition(self):
+        try:
+            if self.error is None:
+                self.send_command(0xA2)  # Stop real-time data
+        except (serial.SerialException, OSError) as e:
+            # the device is gone, it stopped sending anyway
+            self.error = e
+        finally:
+            self._end()
+
+    def _end(self):
+        self.realtime_streaming = False
+        if self.keepalive_handle is not None:
+            self.keepalive_handle.cancel()
+        # ends the iteration once the batches already decoded are consumed
+        self._put(None)
+
+    def _lost(self, error):
+        """The port failed (device unplugged): stop reading it and end the iteration"""
+        self.error = error
+        self.loop.remove_reader(self.connection.fileno())
+        self._end()
+
+    def _on_readable(self):
+        try:
+            block = self.connection.read(READ_SIZE)
+        except (serial.SerialException, OSError) as e:
+            # a readable port without data is a hang-up, the reader would be called again forever
+            self._lost(e)
+            return
+        arrival_ns = time.monotonic_ns()
+        arrival = time.time()
+        if not block or not self.realtime_streaming:
+            return
+
+        self.pending += block
+        package_types, data, consumed, errors = decode_packets(self.pending)
+        self.pending = self.pending[consumed:]
+        self.decode_errors += errors
+        samples = realtime_samples(package_types, data, arrival_ns, arrival, self.previous_ns)
+        if len(samples):
+            self.previous_ns = int(samples['monotonic_ns'][-1])
+            self.received += len(samples)
+            self._put(samples)
+
+    def _put(self, batch):
+        while True:
+            try:
+                self.batches.put_nowait(batch)
+                return
+            except asyncio.QueueFull:
+                oldest = self.batches.get_nowait()
+                if oldest is not None:
+                    self.dropped += len(oldest)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await self.batches.get()
+        if batch is None:
+            raise StopAsyncIteration
+        return batch
+
+    async def __aenter__(self):
+        self.connect()
+        self.start_live_acquisition()
+        return self
+
+    async def __aexit__(self, *exc):
+        try:
+            if self.realtime_streaming:
+                self.stop_live_acquisition()
+        finally:
+            self.disconnect()
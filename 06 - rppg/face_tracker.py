@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+
+# trackers of opencv-contrib, created per face
+OPENCV_TRACKERS = {
+    'kcf': lambda: cv2.TrackerKCF_create(),
+    'csrt': lambda: cv2.TrackerCSRT_create(),
+}
+TRACKING_METHODS = ['flow'] + list(OPENCV_TRACKERS)
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(x1 - x0, 0) * max(y1 - y0, 0)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FlowTrack:
+    """
+    Follows a box with Lucas-Kanade optical flow of corners found inside it: the box moves
+    with the median displacement of the points and scales with their median spread.
+    Points failing the forward-backward check are discarded, the track is lost when
+    fewer than min_points are left
+    """
+
+    def __init__(self, gray, box, min_points=10, max_points=60):
+        self.min_points = min_points
+        x, y, w, h = [int(v) for v in box]
+        mask = np.zeros_like(gray)
+        # the centre of the box, the edges often cover background
+        mask[y + h // 8:y + h - h // 8, x + w // 8:x + w - w // 8] = 255
+        self.points = cv2.goodFeaturesToTrack(gray, maxCorners=max_points, qualityLevel=0.01, minDistance=5,
+                                              mask=mask)
+        self.box = np.array(box, dtype=float)
+        self.gray = gray
+
+    def update(self, gray):
+        """:return: the new box, None when the track is lost"""
+        if self.points is None or len(self.points) < self.min_points:
+            return None
+
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, points, None)
+        error = np.linalg.norm((self.points - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+        if good.sum() < self.min_points:
+            return None
+
+        old, new = self.points.reshape(-1, 2)[good], points.reshape(-1, 2)[good]
+        shift = np.median(new - old, axis=0)
+        old_spread = np.linalg.norm(old - np.median(old, axis=0), axis=1)
+        new_spread = np.linalg.norm(new - np.median(new, axis=0), axis=1)
+        valid = old_spread > 1
+        scale = np.median(new_spread[valid] / old_spread[valid]) if valid.sum() >= 2 else 1.0
+
+        x, y, w, h = self.box
+        cx, cy = x + w / 2 + shift[0], y + h / 2 + shift[1]
+        w, h = w * scale, h * scale
+        self.box = np.array([cx - w / 2, cy - h / 2, w, h])
+        self.points = new.reshape(-1, 1, 2)
+        self.gray = gray
+        return self.box
+
+
+class OpenCVTrack:
+    """Follows a box with one of the opencv-contrib trackers (KCF, CSRT)"""
+
+    def __init__(self, frame, box, method):
+        self.tracker = OPENCV_TRACKERS[method]()
+        self.tracker.init(frame, tuple(int(v) for v in box))
+
+    def update(self, frame):
+        ok, box = self.tracker.update(frame)
+        return np.array(box, dtype=float) if ok else None
+
+
+class FaceTracker:
+    """
+    Detect-then-track faces: the Haar cascade runs on a frame downscaled by detect_scale
+    every detect_interval frames, or as soon as a face is lost; in between every face is
+    tracked ('flow': optical flow, 'kcf', 'csrt': opencv-contrib trackers).
+    The boxes are smoothed with an exponential moving average (smoothing is the weight of
+    the previous box, 0 disables it) to steady the ROI of the rPPG signal.
+    The detect_kwargs of detectMultiScale are given at full resolution
+    """
+
+    def __init__(self, face_cascade=None, detect_interval=10, detect_scale=0.5, method='flow', smoothing=0.5,
+                 **detect_kwargs):
+        if method not in TRACKING_METHODS:
+            raise ValueError(f"Unknown tracking method {method}, expected one of {TRACKING_METHODS}")
+        if face_cascade is None:
+            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.face_cascade = face_cascade
+        self.detect_interval = detect_interval
+        self.detect_scale = detect_scale
+        self.method = method
+        self.smoothing = smoothing
+        self.detect_kwargs = detect_kwargs
+
+        self.tracks = []
+        self.boxes = np.zeros((0, 4))
+        self.frames_since_detection = 0
+        self.frames = 0
+        self.detections = 0
+
+    def detect(self, gray):
+        kwargs = dict(self.detect_kwargs)
+        small = gray
+        if self.detect_scale != 1:
+            small = cv2.resize(gray, None, fx=self.detect_scale, fy=self.detect_scale, interpolation=cv2.INTER_AREA)
+            for name in ('minSize', 'maxSize'):
+                if name in kwargs:
+                    kwargs[name] = tuple(int(v * self.detect_scale) for v in kwargs[name])
+        faces = self.face_cascade.detectMultiScale(small, **kwargs)
+        self.detections += 1
+        return np.asarray(faces, dtype=float).reshape(-1, 4) / self.detect_scale
+
+    def smooth(self, boxes, previous):
+        """Blend every box with the previous box of the same face (largest overlap)"""
+        if self.smoothing <= 0 or len(previous) == 0:
+            return boxes
+        smoothed = []
+        for box in boxes:
+            overlaps = [iou(box, old) for old in previous]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] > 0.3:
+                box = self.smoothing * previous[best] + (1 - self.smoothing) * box
+            smoothed.append(box)
+        return np.array(smoothed).reshape(-1, 4)
+
+    def start_tracks(self, frame, gray, boxes):
+        if self.method == 'flow':
+            self.tracks = [FlowTrack(gray, box) for box in boxes]
+        else:
+            self.tracks = [OpenCVTrack(frame, box, self.method) for box in boxes]
+
+    def update(self, frame):
+        """
+        Faces of a new BGR frame, or of its grayscale conversion with the 'flow' method
+        :return: (n, 4) int array of (x, y, w, h) boxes
+        """
+        if frame.ndim == 2 and self.method in OPENCV_TRACKERS:
+            raise ValueError(f"The {self.method} tracker needs the BGR frame")
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        self.frames += 1
+        self.frames_since_detection += 1
+
+        boxes = None
+        if len(self.tracks) and self.frames_since_detection < self.detect_interval:
+            boxes = [track.update(frame if self.method in OPENCV_TRACKERS else gray) for track in self.tracks]
+            if any(box is None for box in boxes):
+                boxes = None
+            else:
+                boxes = np.array(boxes).reshape(-1, 4)
+
+        if boxes is None:
+            boxes = self.detect(gray)
+            self.frames_since_detection = 0
+            self.start_tracks(frame, gray, boxes)
+
+        self.boxes = self.smooth(boxes, self.boxes)
+        # tracked boxes can drift past the borders, the callers slice the frame with them
+        height, width = gray.shape[:2]
+        faces = np.round(self.boxes).astype(int)
+        x0 = np.clip(faces[:, 0], 0, width)
+        y0 = np.clip(faces[:, 1], 0, height)
+        x1 = np.clip(faces[:, 0] + faces[:, 2], 0, width)
+        y1 = np.clip(faces[:, 1] + faces[:, 3], 0, height)
+        faces = np.stack((x0, y0, x1 - x0, y1 - y0), axis=1)
+        return faces[(faces[:, 2] > 0) & (faces[:, 3] > 0)]
@@ -0,0 +1,209 @@
+"""
+Fake CMS50D on a pseudo-terminal, to run the driver without the device (Linux and macOS).
+It replays a byte stream recorded with CMS50D(raw_log=...) at the rate of the device, or
+synthetic real-time packets of a 72 bpm pulse, and discards the commands it receives.
+
+    python fake_cms50d.py --replay raw.bin    # prints the port to give to CMS50D
+    python fake_cms50d.py --check             # runs the driver on the fake device
+    python fake_cms50d.py --check-async 12    # runs AsyncCMS50D on 12 fake devices in one event loop,
+                                              # then unplugs a device while it streams
+"""
+import argparse
+import asyncio
+import os
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+from cms50d import PACKET_SIZE, REALTIME_PACKET, SAMPLE_RATE, encode_packet
+
+
+def synthetic_stream(duration, hr=72.0, rate=SAMPLE_RATE):
+    """Real-time packets of a pulse wave, with pulse rate and SpO2"""
+    t = np.arange(int(duration * rate)) / rate
+    f = hr / 60.0
+    wave = np.sin(2 * np.pi * f * t) + 0.4 * np.sin(4 * np.pi * f * t + 0.8)
+    waveform = (64 + 40 * wave / np.abs(wave).max()).astype(int)
+    return b''.join(encode_packet(REALTIME_PACKET, [0x05, value, 0, int(hr), 98]) for value in waveform)
+
+
+class FakeCMS50D:
+    """
+    Writes stream to the master side of a pty in blocks of packets at rate packets/s,
+    the driver opens port (the slave side) as a serial port
+    """
+
+    def __init__(self, stream, rate=SAMPLE_RATE, block=6):
+        self.stream = stream
+        self.rate = rate
+        self.block = block
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.disconnect()
+        os.close(self.slave)
+
+    def disconnect(self):
+        """Stop writing and hang up the pty, as an unplugged device"""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+    def _run(self):
+        size = self.block * PACKET_SIZE
+        period = self.block / self.rate
+        start = time.perf_counter()
+        for i, offset in enumerate(range(0, len(self.stream), size)):
+            # commands of the driver (start, stop, keepalive) are read and ignored
+            while select.select([self.master], [], [], 0)[0]:
+                os.read(self.master, 1024)
+            delay = start + i * period - time.perf_counter()
+            if self.stop_event.wait(max(delay, 0)):
+                return
+            os.write(self.master, self.stream[offset:offset + size])
+
+
+def check(stream, duration):
+    """Decode the stream with the driver through the fake device, compare with the expected waveform"""
+    from cms50d import CMS50D, decode_packets
+
+    package_types, data, _, _ = decode_packets(stream)
+    expected = data[package_types == REALTIME_PACKET, 1] & 0x7F
+
+    device = FakeCMS50D(stream)
+    monitor = CMS50D(port=device.port, policy='spill')
+    monitor.connect()
+    monitor.start_live_acquisition()
+    device.start()
+    time.sleep(duration)
+    monitor.stop_live_acquisition()
+    batch = monitor.get_batch(timeout=0)
+    monitor.disconnect()
+    device.stop()
+
+    n = min(len(batch), len(expected))
+    matching = np.array_equal(batch['waveform'][:n], expected[:n])
+    intervals = np.diff(batch['monotonic_ns']) / 1e6
+    print(f"{len(batch)} of {len(expected)} samples, waveform {'matches' if matching else 'DIFFERS'}, "
+          f"{monitor.decode_errors} decode errors, {monitor.dropped} dropped, "
+          f"interval {intervals.mean():.2f} +- {intervals.std():.2f} ms")
+
+
+async def check_async(stream, devices):
+    """Read devices fake devices with AsyncCMS50D in one event loop, compare with the expected waveform"""
+    from cms50d import decode_packets
+    from cms50d_async import AsyncCMS50D
+
+    package_types, data, _, _ = decode_packets(stream)
+    expected = data[package_types == REALTIME_PACKET, 1] & 0x7F
+
+    fakes = [FakeCMS50D(stream) for _ in range(devices)]
+    monitors = [AsyncCMS50D(device.port) for device in fakes]
+
+    async def consume(monitor):
+        batches = []
+        async for batch in monitor:
+            batches.append(batch['waveform'])
+            if sum(len(b) for b in batches) >= len(expected):
+                break
+        return np.concatenate(batches) if batches else np.empty(0, dtype=np.uint8)
+
+    start = time.thread_time()
+    wall = time.perf_counter()
+    for monitor in monitors:
+        monitor.connect()
+        monitor.start_live_acquisition()
+    for device in fakes:
+        device.start()
+    try:
+        waveforms = await asyncio.wait_for(asyncio.gather(*(consume(monitor) for monitor in monitors)),
+                                           timeout=len(expected) / SAMPLE_RATE + 2)
+    finally:
+        for monitor in monitors:
+            monitor.stop_live_acquisition()
+            monitor.disconnect()
+        for device in fakes:
+            device.stop()
+    cpu = time.thread_time() - start
+    wall = time.perf_counter() - wall
+
+    for i, (monitor, waveform) in enumerate(zip(monitors, waveforms)):
+        matching = np.array_equal(waveform, expected[:len(waveform)])
+        print(f"device {i}: {len(waveform)} of {len(expected)} samples, waveform {'matches' if matching else 'DIFFERS'}, "
+              f"{monitor.decode_errors} decode errors, {monitor.dropped} dropped")
+    print(f"{devices} devices in one thread: event loop CPU {cpu:.2f} s over {wall:.1f} s, "
+          f"{cpu / wall:.2%} of a core")
+
+    await check_disconnect(stream)
+
+
+async def check_disconnect(stream, after=1.0):
+    """Unplug a fake device after seconds of streaming: the iteration must end, without a busy loop"""
+    from cms50d_async import AsyncCMS50D
+
+    async def consume(monitor):
+        received = 0
+        async for batch in monitor:
+            received += len(batch)
+        return received
+
+    device = FakeCMS50D(stream)
+    received = 0
+    start = time.thread_time()
+    async with AsyncCMS50D(device.port) as monitor:
+        device.start()
+        asyncio.get_running_loop().call_later(after, device.disconnect)
+        try:
+            received = await asyncio.wait_for(consume(monitor), timeout=after + 2)
+            ended = True
+        except asyncio.TimeoutError:
+            ended = False
+    cpu = time.thread_time() - start
+    device.stop()
+    print(f"unplugged after {after:.1f} s: {received} samples, iteration {'ended' if ended else 'HANGS'}, "
+          f"error {monitor.error!r}, event loop CPU {cpu:.2f} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake CMS50D on a pseudo-terminal')
+    parser.add_argument('--replay', type=str, help='Byte stream recorded with CMS50D(raw_log=...)', required=False,
+                        default=None)
+    parser.add_argument('--duration', type=float, help='Seconds of synthetic stream', required=False, default=10)
+    parser.add_argument('--check', action='store_true', help='Run the driver on the fake device')
+    parser.add_argument('--check-async', type=int, help='Run AsyncCMS50D on this many fake devices',
+                        required=False, default=0)
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay, 'rb') as f:
+            stream = f.read()
+    else:
+        stream = synthetic_stream(args.duration)
+
+    if args.check_async:
+        asyncio.run(check_async(stream, args.check_async))
+    elif args.check:
+        check(stream, len(stream) / PACKET_SIZE / SAMPLE_RATE + 0.5)
+    else:
+        device = FakeCMS50D(stream)
+        print(f"Fake CMS50D on {device.port}")
+        device.start()
+        try:
+            device.thread.join()
+        except KeyboardInterrupt:
+            pass
+        device.stop()
@@ -0,0 +1,125 @@
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+# physiological heart rate band, 42-240 bpm
+HR_BAND = (0.7, 4.0)
+
+
+class StreamingHR:
+    """
+    Heart rate from the spectrum of the last window seconds of a signal sampled at fs Hz.
+    Only the DFT bins of the HR band are kept, and they are updated with a sliding DFT
+    as samples arrive: each push costs O(samples x bins) instead of a full FFT of the window.
+
+    The bins are spaced fs / (N * zero_padding) apart, as for an FFT of the window zero-padded
+    to zero_padding times its length N. The mean is removed and a Hann window is applied in
+    the frequency domain, then the peak is refined with a parabolic interpolation
+    """
+
+    def __init__(self, fs, window=10.0, band=HR_BAND, zero_padding=4, hann=True):
+        self.fs = fs
+        self.band = band
+        self.n = int(round(window * fs))
+        self.zero_padding = zero_padding
+        self.hann = hann
+        self.buffer = RingBuffer(self.n)
+
+        # the band, plus the neighbours needed by the Hann window (zero_padding bins away)
+        # and by the interpolation of a peak on the band edges
+        self.resolution = fs / (self.n * zero_padding)
+        margin = (zero_padding if hann else 0) + 1
+        first = max(int(np.floor(band[0] / self.resolution)) - margin, 0)
+        last = min(int(np.ceil(band[1] / self.resolution)) + margin, self.n * zero_padding // 2)
+
+        self.bins = np.arange(first, last + 1)
+        self.freqs = self.bins * self.resolution
+        self.fft_size = self.n * zero_padding
+
+        self.omega = 2 * np.pi * self.freqs / fs
+        # DFT of a constant window, to remove the mean
+        self.dc = np.fft.rfft(np.ones(self.n), self.fft_size)[self.bins]
+        # a sample entering the window is at position N, exp(-j omega N)
+        self.entering = np.exp(-1j * self.omega * self.n)
+        self.rotation = np.exp(1j * self.omega)
+
+        # bins searched for the peak, inside the band and away from the Hann margins
+        freqs = self.freqs[zero_padding:-zero_padding] if hann else self.freqs
+        self.in_band = np.flatnonzero((freqs >= band[0]) & (freqs <= band[1]))
+
+        self.spectrum = np.zeros(len(self.freqs), dtype=complex)
+        self.total = 0.0
+        self.since_sync = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def push(self, samples):
+        """Add new samples (a scalar or an array), oldest first"""
+        samples = np.atleast_1d(np.asarray(samples, dtype=float))
+        m = len(samples)
+        if m == 0:
+            return
+
+        # exact DFT while the window fills up, for large chunks, and every N samples
+        # so that the rounding errors of the sliding updates do not accumulate
+        if len(self.buffer) < self.n or m >= self.n or self.since_sync + m > self.n:
+            self.buffer.extend(samples)
+            self.resync()
+            return
+
+        # X' = exp(j omega m) (X - DFT of the m leaving samples + DFT of the m entering ones)
+        leaving = np.array(self.buffer.window()[:m])
+        if m == 1:
+            update = samples[0] * self.entering - leaving[0]
+            rotation = self.rotation
+        else:
+            basis = np.exp(-1j * np.outer(np.arange(m), self.omega))
+            update = (samples @ basis) * self.entering - leaving @ basis
+            rotation = self.rotation ** m
+        self.spectrum = (self.spectrum + update) * rotation
+        self.total += samples.sum() - leaving.sum()
+        self.buffer.extend(samples)
+        self.since_sync += m
+
+    def resync(self):
+        """Recompute the bins from the samples of the window"""
+        x = self.buffer.window()
+        self.spectrum = np.fft.rfft(x, self.fft_size)[self.bins]
+        self.total = x.sum()
+        self.since_sync = 0
+
+    def power_spectrum(self):
+        """
+        Power of the band bins of the mean-removed (Hann windowed) window
+        :return: (frequencies in Hz, power), None until the window is full
+        """
+        if len(self.buffer) < self.n:
+            return None
+
+        spectrum = self.spectrum - (self.total / self.n) * self.dc
+        freqs = self.freqs
+        if self.hann:
+            # w[m] = 0.5 - 0.5 cos(2 pi m / N) shifts the spectrum by +-1/N, zero_padding bins
+            p = self.zero_padding
+            spectrum = 0.5 * spectrum[p:-p] - 0.25 * (spectrum[:-2 * p] + spectrum[2 * p:])
+            freqs = freqs[p:-p]
+        return freqs, np.abs(spectrum) ** 2
+
+    def hr(self):
+        """Heart rate in bpm, None until the window is full"""
+        result = self.power_spectrum()
+        if result is None:
+            return None
+        freqs, power = result
+
+        k = self.in_band[np.argmax(power[self.in_band])]
+
+        # parabola through the peak and its neighbours
+        offset = 0.0
+        if 0 < k < len(power) - 1:
+            alpha, beta, gamma = power[k - 1], power[k], power[k + 1]
+            denominator = alpha - 2 * beta + gamma
+            if denominator < 0:
+                offset = 0.5 * (alpha - gamma) / denominator
+        return 60.0 * (freqs[k] + offset * self.resolution)
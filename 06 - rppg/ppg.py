@@ -1,8 +1,9 @@
 import time
 import datetime
 import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from matplotlib.ticker import FuncFormatter
 from cms50d import CMS50D
+from ring_buffer import SignalWindow
 
 monitor = CMS50D(port="COM16")  # Replace with your actual COM port
 monitor.connect()
@@ -11,38 +12,37 @@ monitor.start_live_acquisition()
 # Matplotlib live plot
 plt.ion()
 fig, ax = plt.subplots(figsize=(10, 4))
-xdata, ydata = [], []
-line, = ax.plot_date([], [], fmt='-m', label='Pulse Waveform')
+# last 10 seconds of the 60 Hz waveform, with room for rate jitter
+window = SignalWindow(duration=10, max_rate=100)
+line, = ax.plot([], [], '-m', label='Pulse Waveform')
 text_hr = ax.text(0.02, 0.95, '', transform=ax.transAxes, color='red', fontsize=12)
 text_spo2 = ax.text(0.02, 0.90, '', transform=ax.transAxes, color='blue', fontsize=12)
 
 ax.set_ylim(0, 128)
 ax.set_ylabel("Waveform")
 ax.set_xlabel("Time")
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: datetime.datetime.fromtimestamp(x).strftime('%H:%M:%S')))
 plt.title("CMS50D Live Data")
 
 try:
     while True:
-        data = monitor.get_latest_data()  # Get data from the queue
-        #print(data)
-        if not data:
+        # all the samples arrived since the last redraw
+        batch = monitor.get_batch(timeout=0.1)
+        if len(batch) == 0:
             continue
 
-        now = data['timestamp']
-        waveform = data['waveform']
-        xdata.append(now)
-        ydata.append(waveform)
+        now = batch['timestamp'][-1]
+        window.extend(batch['timestamp'], batch['waveform'])
 
-        # Keep last 10 seconds of data
-        cutoff = now - datetime.timedelta(seconds=10)
-        xdata = [t for t in xdata if t >= cutoff]
-        ydata = ydata[-len(xdata):]
+        # views of the last 10 seconds, nothing is copied
+        xdata, ydata = window.window()
+        cutoff = now - window.duration
 
+        pulse_rate, spo2 = batch['pulse_rate'][-1], batch['spo2'][-1]
         line.set_data(xdata, ydata)
         ax.set_xlim(cutoff, now)
-        text_hr.set_text(f"HR: {data['pulse_rate']} bpm")
-        text_spo2.set_text(f"SpO2: {data['spO2']}%")
+        text_hr.set_text(f"HR: {'--' if pulse_rate == 0xFF else pulse_rate} bpm")
+        text_spo2.set_text(f"SpO2: {'--' if spo2 == 0x7F else spo2}%")
 
         fig.canvas.draw()
         fig.canvas.flush_events()
@@ -1,35 +1,16 @@
-import time
 import datetime
 import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from matplotlib.ticker import FuncFormatter
 import numpy as np
 from cms50d import CMS50D 
+from ring_buffer import SignalWindow
+from hr_estimator import StreamingHR
 from scipy.signal import find_peaks
 
-# Function to estimate HR using FFT (Fast Fourier Transform)
-def estimate_hr_with_fft(waveform, sampling_rate):
-    # Zero padding for improved frequency resolution
-    
-    # Apply FFT to the signal
-    fft_result = np.fft.fft(waveform)
-    fft_freqs = np.fft.fftfreq(len(waveform), 1 / sampling_rate)
-    
-    # Get the magnitude of the FFT result
-    fft_magnitude = np.abs(fft_result)
-
-    # Get the index of the maximum peak frequency (ignoring the zero-frequency component)
-    peak_index = np.argmax(fft_magnitude[1:]) + 1
-
-    # Estimate heart rate in beats per minute (bpm)
-    peak_frequency = abs(fft_freqs[peak_index])  # Frequency in Hz
-    hr_bpm = peak_frequency * 60  # Convert Hz to bpm
-
-    return hr_bpm
-
 # Function to estimate HR using peak detection
 def estimate_hr_with_peak_detection(waveform, sampling_rate):
-    # Convert waveform to numpy array
-    waveform = np.array(waveform)
+    # Convert waveform to numpy array (ring buffer windows are used as they are)
+    waveform = np.asarray(waveform)
 
     # Find the peaks in the waveform
     peaks, _ = find_peaks(waveform)
@@ -51,57 +32,59 @@ monitor.start_live_acquisition()
 # Matplotlib live plot
 plt.ion()
 fig, ax = plt.subplots(figsize=(10, 4))
-xdata, ydata = [], []
-line, = ax.plot_date([], [], fmt='-m', label='Pulse Waveform')
+# last 10 seconds of the 60 Hz waveform, with room for rate jitter
+window = SignalWindow(duration=10, max_rate=100)
+# spectrum of the HR band updated with every sample, at the nominal rate of the CMS50D
+hr_estimator = StreamingHR(fs=60, window=10)
+line, = ax.plot([], [], '-m', label='Pulse Waveform')
 text_hr = ax.text(0.02, 0.95, '', transform=ax.transAxes, color='red', fontsize=12)
 text_spo2 = ax.text(0.02, 0.90, '', transform=ax.transAxes, color='blue', fontsize=12)
 
 ax.set_ylim(0, 128)
 ax.set_ylabel("Waveform")
 ax.set_xlabel("Time")
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: datetime.datetime.fromtimestamp(x).strftime('%H:%M:%S')))
 plt.title("CMS50D Live Data")
 
-last_timestamp = None
 sampling_rate = None
 
 try:
     while True:
-        data = monitor.get_latest_data()  # Get data from the queue
-        if not data:
+        # all the samples arrived since the last redraw, waiting at most 0.1 s for the first one
+        batch = monitor.get_batch(timeout=0.1)
+        if len(batch) == 0:
             continue
 
-        now = data['timestamp']
-        waveform = data['waveform']
-        xdata.append(now)
-        ydata.append(waveform)
-
-        # Keep last 10 seconds of data
-        cutoff = now - datetime.timedelta(seconds=10)
-        xdata = [t for t in xdata if t >= cutoff]
-        ydata = ydata[-len(xdata):]
+        now = batch['timestamp'][-1]
+        window.extend(batch['timestamp'], batch['waveform'])
+        hr_estimator.push(batch['waveform'])
 
-        dt = (xdata[-1] - xdata[0]).total_seconds()
+        # views of the last 10 seconds, nothing is copied
+        xdata, ydata = window.window()
+        cutoff = now - window.duration
 
-        if dt > 0:
-            sampling_rate = len(xdata) / dt  # In Hz (samples per second)
-            print(sampling_rate)
+        rate = window.sampling_rate()  # In Hz (samples per second)
+        if rate:
+            sampling_rate = rate
+            print(f"{sampling_rate:.2f} Hz, {monitor.received} received, {monitor.dropped} dropped, "
+                  f"{monitor.decode_errors} decode errors")
 
         # Estimate HR using FFT and Peak Detection
-        if sampling_rate:
-            hr_fft = estimate_hr_with_fft(ydata, sampling_rate)
+        hr_fft = hr_estimator.hr()
+        if sampling_rate and hr_fft is not None:
             hr_peak = estimate_hr_with_peak_detection(ydata, sampling_rate)
+            pulse_rate, spo2 = batch['pulse_rate'][-1], batch['spo2'][-1]
 
             # Display the estimated HR values
-            text_hr.set_text(f"HR (FFT): {hr_fft:.2f} bpm\nHR (Peak): {hr_peak:.2f} bpm\nHR (real): {data['pulse_rate']:.2f} bpm")
-            text_spo2.set_text(f"SpO2: {data['spO2']}%")
+            text_hr.set_text(f"HR (FFT): {hr_fft:.2f} bpm\nHR (Peak): {hr_peak:.2f} bpm\n"
+                             f"HR (real): {'--' if pulse_rate == 0xFF else pulse_rate} bpm")
+            text_spo2.set_text(f"SpO2: {'--' if spo2 == 0x7F else spo2}%")
 
         line.set_data(xdata, ydata)
         ax.set_xlim(cutoff, now)
 
         fig.canvas.draw()
         fig.canvas.flush_events()
-        time.sleep(0.1)  # Reduced sleep for more frequent updates
 
 except KeyboardInterrupt:
     print("Interrupted by user")
@@ -0,0 +1,303 @@
+"""
+Synchronized recording of the webcam and of the CMS50D, to validate the rPPG against the oximeter.
+
+Frames and CMS50D samples are read on dedicated threads and stamped with time.monotonic_ns
+when they arrive, so both streams share one clock. A recording is a directory with:
+    video.avi     the frames, as record_video.py writes them
+    frames.bin    one FRAME_DTYPE record per frame of the video, in order
+    samples.bin   one sample_queue.SAMPLE_DTYPE record per CMS50D sample, in order
+    index.bin     per frame, the index of the first sample arrived at or after it (int64)
+    meta.json     frame rate, size, dtypes and the wall clock time of the monotonic origin
+
+    python recorder.py --port COM16 --duration 60 -o recording
+"""
+import abc
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from sample_queue import SAMPLE_DTYPE
+
+FRAME_DTYPE = np.dtype([('t_ns', '<i8'), ('frame', '<u4')])
+# records buffered by the threads before they are appended to the files
+FLUSH_RECORDS = 256
+
+
+class RecordLog:
+    """Binary log of fixed-size records, appended in blocks"""
+
+    def __init__(self, filename, dtype):
+        self.file = open(filename, 'wb')
+        self.dtype = dtype
+        self.pending = []
+        self.count = 0
+
+    def append(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= FLUSH_RECORDS:
+            self.flush()
+
+    def extend(self, records):
+        """Append a structured array of records, written at once"""
+        self.flush()
+        np.asarray(records, dtype=self.dtype).tofile(self.file)
+        self.count += len(records)
+
+    def flush(self):
+        if self.pending:
+            np.array(self.pending, dtype=self.dtype).tofile(self.file)
+            self.count += len(self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class StreamThread(threading.Thread, abc.ABC):
+    """Thread of one stream, with the CPU time it used; subclasses read the stream in loop"""
+
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.stop_event = threading.Event()
+        self.cpu_time = 0.0
+        self.count = 0
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        start = time.thread_time()
+        try:
+            self.loop()
+        finally:
+            self.cpu_time = time.thread_time() - start
+
+    @abc.abstractmethod
+    def loop(self):
+        """Reads the stream until stop_event is set or the stream ends"""
+
+
+class CameraThread(StreamThread):
+    """Reads the camera, stamps every frame and hands it to the video writer"""
+
+    def __init__(self, cap, frames):
+        super().__init__('camera')
+        self.cap = cap
+        self.frames = frames
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            t_ns = time.monotonic_ns()
+            if not ret:
+                break
+            self.frames.put((t_ns, frame))
+            self.count += 1
+        self.frames.put(None)
+
+
+class VideoWriterThread(StreamThread):
+    """Encodes the frames and logs their timestamps, off the capture thread"""
+
+    def __init__(self, writer, frames, log):
+        super().__init__('video')
+        self.writer = writer
+        self.frames = frames
+        self.log = log
+
+    def loop(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            t_ns, frame = item
+            self.writer.write(frame)
+            self.log.append((t_ns, self.count))
+            self.count += 1
+
+
+class OximeterThread(StreamThread):
+    """Logs the CMS50D samples with the monotonic time of their arrival"""
+
+    def __init__(self, monitor, log):
+        super().__init__('cms50d')
+        self.monitor = monitor
+        self.log = log
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            # the samples are stamped by the CMS50D thread on arrival, they are logged in batches
+            self._log(self.monitor.get_batch(timeout=0.5))
+        # the acquisition is stopped before this thread, the last samples are still queued
+        while self._log(self.monitor.get_batch(timeout=0)):
+            pass
+
+    def _log(self, batch):
+        if len(batch):
+            self.log.extend(batch)
+            self.count += len(batch)
+        return len(batch)
+
+
+class Recorder:
+    """
+    Records a camera (cv2.VideoCapture) and optionally a CMS50D with live acquisition
+    started, into the directory path. stop stops the acquisition of the CMS50D
+    """
+
+    def __init__(self, path, cap, monitor=None, fps=20.0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.monitor = monitor
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.meta = {'fps': fps, 'width': width, 'height': height,
+                     # the same instant on both clocks, to convert the stamps to wall clock time
+                     'origin_monotonic_ns': time.monotonic_ns(), 'origin_time_ns': time.time_ns(),
+                     'frame_dtype': FRAME_DTYPE.descr, 'sample_dtype': SAMPLE_DTYPE.descr}
+
+        self.writer = cv2.VideoWriter(os.path.join(path, 'video.avi'), cv2.VideoWriter_fourcc(*'XVID'), fps,
+                                      (width, height))
+        self.frame_log = RecordLog(os.path.join(path, 'frames.bin'), FRAME_DTYPE)
+        self.sample_log = RecordLog(os.path.join(path, 'samples.bin'), SAMPLE_DTYPE)
+        frames = queue.Queue(maxsize=64)
+        self.threads = [CameraThread(cap, frames), VideoWriterThread(self.writer, frames, self.frame_log)]
+        if monitor is not None:
+            self.threads.append(OximeterThread(monitor, self.sample_log))
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        if self.monitor is not None:
+            # no sample arrives after this, the oximeter thread logs the queued ones and ends
+            self.monitor.stop_live_acquisition()
+        for thread in self.threads:
+            thread.stop()
+        for thread in self.threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.start_time
+        self.writer.release()
+        self.frame_log.close()
+        self.sample_log.close()
+
+        frames = np.fromfile(os.path.join(self.path, 'frames.bin'), dtype=FRAME_DTYPE)
+        samples = np.fromfile(os.path.join(self.path, 'samples.bin'), dtype=SAMPLE_DTYPE)
+        index = np.searchsorted(samples['monotonic_ns'], frames['t_ns']).astype('<i8')
+        index.tofile(os.path.join(self.path, 'index.bin'))
+        self.meta.update(frames=len(frames), samples=len(samples))
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def report(self):
+        """CPU time of every stream thread, as a share of one core over the recording"""
+        for thread in self.threads:
+            print(f"{thread.name:>7}: {thread.count} records, CPU {thread.cpu_time:.2f} s, "
+                  f"{thread.cpu_time / self.elapsed:.1%} of a core")
+
+
+class Recording:
+    """
+    Reads a recording: the logs are memory-mapped, and seeking to a time is a binary search
+    on the timestamps, O(log n)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.frames = self._map('frames.bin', FRAME_DTYPE)
+        self.samples = self._map('samples.bin', SAMPLE_DTYPE)
+        self.index = self._map('index.bin', np.dtype('<i8'))
+        # times are counted from the first frame, or from the start of a recording stopped before it
+        self.start_ns = int(self.frames['t_ns'][0]) if len(self.frames) else self.meta['origin_monotonic_ns']
+        self.cap = None
+
+    def _map(self, name, dtype):
+        filename = os.path.join(self.path, name)
+        if os.path.getsize(filename) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r')
+
+    def to_seconds(self, t_ns):
+        """Seconds since the first frame"""
+        return (np.asarray(t_ns) - self.start_ns) / 1e9
+
+    def seek(self, seconds):
+        """:return: (frame number, sample index) at seconds since the first frame"""
+        if len(self.frames) == 0:
+            raise ValueError(f"No frames in the recording {self.path}")
+        t_ns = self.start_ns + int(seconds * 1e9)
+        frame = max(int(np.searchsorted(self.frames['t_ns'], t_ns, side='right')) - 1, 0)
+        return frame, int(self.index[frame])
+
+    def samples_between(self, start, stop):
+        """CMS50D samples between start and stop seconds since the first frame"""
+        lo, hi = np.searchsorted(self.samples['monotonic_ns'], [self.start_ns + int(start * 1e9),
+                                                                self.start_ns + int(stop * 1e9)])
+        return self.samples[lo:hi]
+
+    def samples_of_frame(self, frame):
+        """CMS50D samples arrived between a frame and the next one"""
+        stop = self.index[frame + 1] if frame + 1 < len(self.index) else len(self.samples)
+        return self.samples[self.index[frame]:stop]
+
+    def read_frame(self, frame):
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(os.path.join(self.path, 'video.avi'))
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ret, image = self.cap.read()
+        return image if ret else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synchronized recording of the webcam and of the CMS50D')
+    parser.add_argument('-o', '--output', type=str, help='Directory of the recording', required=False,
+                        default='recording')
+    parser.add_argument('--port', type=str, help='Serial port of the CMS50D, video only if not given',
+                        required=False, default=None)
+    parser.add_argument('--camera', type=int, help='Camera index', required=False, default=0)
+    parser.add_argument('--fps', type=float, help='Frame rate of the video', required=False, default=20.0)
+    parser.add_argument('--duration', type=float, help='Seconds to record', required=False, default=30)
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(args.camera)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    cap.set(cv2.CAP_PROP_FPS, args.fps)
+
+    monitor = None
+    if args.port:
+        from cms50d import CMS50D
+        # nothing is lost if the logging thread falls behind, the samples wait on disk
+        monitor = CMS50D(port=args.port, policy='spill')
+        monitor.connect()
+        monitor.start_live_acquisition()
+
+    recorder = Recorder(args.output, cap, monitor, fps=args.fps)
+    print(f"Recording {args.duration} s to {args.output}, Ctrl+C to stop")
+    recorder.start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.stop()
+        cap.release()
+        if monitor is not None:
+            monitor.disconnect()
+
+    recorder.report()
+    if monitor is not None:
+        print(f"CMS50D: {monitor.received} received, {monitor.dropped} dropped, "
+              f"{monitor.decode_errors} decode errors")
+    print(f"{recorder.meta['frames']} frames, {recorder.meta['samples']} CMS50D samples in {recorder.elapsed:.1f} s")
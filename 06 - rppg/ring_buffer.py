@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity NumPy ring buffer. Every sample is written twice, at i and i + capacity,
+    so the last n samples are always contiguous and window() returns a view without copying.
+    Appending costs O(1) whatever the capacity. Samples can be arrays of a fixed shape,
+    e.g. shape=(3,) for the RGB means of a frame
+    """
+
+    def __init__(self, capacity, dtype=float, shape=()):
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity,) + tuple(shape), dtype=dtype)
+        self.head = 0  # next write position, in [0, capacity)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.data[self.head + self.capacity] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)[-self.capacity:]
+        n = len(values)
+        if n == 0:
+            return
+        first = min(n, self.capacity - self.head)
+        for offset in (0, self.capacity):
+            self.data[self.head + offset:self.head + offset + first] = values[:first]
+            self.data[offset:offset + n - first] = values[first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def window(self, n=None):
+        """Read-only view of the last n samples (all of them by default), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        end = self.head + self.capacity
+        view = self.data[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def last(self):
+        return self.data[self.head + self.capacity - 1]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class SignalWindow:
+    """
+    Timestamped samples of a signal in two ring buffers (timestamps in seconds, values),
+    sized for max_rate samples/s over duration seconds
+    """
+
+    def __init__(self, duration, max_rate, dtype=float):
+        self.duration = duration
+        capacity = int(np.ceil(duration * max_rate)) + 1
+        self.timestamps = RingBuffer(capacity, dtype=np.float64)
+        self.values = RingBuffer(capacity, dtype=dtype)
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, timestamp, value):
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def extend(self, timestamps, values):
+        self.timestamps.extend(timestamps)
+        self.values.extend(values)
+
+    def window(self, duration=None):
+        """
+        Views of the samples of the last duration seconds (the whole window by default),
+        found with a binary search on the timestamps
+        :return: (timestamps, values)
+        """
+        timestamps = self.timestamps.window()
+        if len(timestamps) == 0:
+            return timestamps, self.values.window()
+        cutoff = timestamps[-1] - (self.duration if duration is None else duration)
+        n = len(timestamps) - int(np.searchsorted(timestamps, cutoff, side='left'))
+        return self.timestamps.window(n), self.values.window(n)
+
+    def sampling_rate(self, duration=None):
+        """Mean sampling rate over the window in samples/s, None with less than 2 samples"""
+        timestamps, _ = self.window(duration)
+        if len(timestamps) < 2 or timestamps[-1] <= timestamps[0]:
+            return None
+        return (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
@@ -0,0 +1,208 @@
+"""
+Offline rPPG of recorded videos (record_video.py), the signal path of rppg_live_cam.py
+run on many videos in parallel: one process per video, or per range of frames with --chunk.
+
+For every video the store (HDF5) keeps the raw traces, mean B, G, R of the forehead ROI
+per frame, the face boxes, the pulse signal extracted with --method and the HR series
+estimated every --step seconds over --window seconds, in a group named by the path of the video
+relative to the common directory of the videos (its file name for a single video).
+
+    python rppg_batch.py output.avi other.avi -o rppg.h5 -j 4
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import h5py
+import numpy as np
+from scipy.signal import sosfiltfilt
+
+from bandpass import design_bandpass
+from face_tracker import FaceTracker
+from hr_estimator import StreamingHR
+from rppg_methods import METHODS, extract_pulse
+from rppg_pipeline import forehead_roi
+
+# record_video.py records at 20 fps, used when the container does not report it
+DEFAULT_FPS = 20.0
+
+
+def video_info(filename):
+    """:return: (frames, fps) of a video"""
+    cap = cv2.VideoCapture(filename)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {filename}")
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    cap.release()
+    return frames, fps
+
+
+def extract_traces(filename, start=0, stop=None, detect_interval=10, tracking='flow'):
+    """
+    Mean B, G, R of the forehead ROI of the largest face for the frames [start, stop) of a video,
+    NaN where no face is found. Runs in the worker processes
+    :return: dict with start, traces (n, 3), boxes (n, 4) and the CPU time spent
+    """
+    cpu_start = time.process_time()
+    cap = cv2.VideoCapture(filename)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    tracker = FaceTracker(detect_interval=detect_interval, method=tracking,
+                          scaleFactor=1.1, minNeighbors=3, minSize=(100, 100))
+
+    traces = []
+    boxes = []
+    index = start
+    while stop is None or index < stop:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        index += 1
+        faces = tracker.update(frame)
+        if len(faces) == 0:
+            traces.append((np.nan, np.nan, np.nan))
+            boxes.append((0, 0, 0, 0))
+            continue
+        face = max(faces, key=lambda f: f[2] * f[3])
+        x, y, w, h = forehead_roi(face)
+        # the three channels in one reduction over the ROI
+        traces.append(frame[y:y + h, x:x + w].reshape(-1, 3).mean(axis=0))
+        boxes.append(face)
+    cap.release()
+
+    return {'filename': filename, 'start': start,
+            'traces': np.array(traces, dtype=np.float32).reshape(-1, 3),
+            'boxes': np.array(boxes, dtype=np.int16).reshape(-1, 4),
+            'cpu_time': time.process_time() - cpu_start}
+
+
+def _extract(task):
+    return extract_traces(*task)
+
+
+def fill_gaps(traces):
+    """Traces (n, channels) with the frames without a face linearly interpolated, None without faces"""
+    valid = np.isfinite(traces).all(axis=1)
+    if valid.sum() < 2:
+        return None
+    frames = np.arange(len(traces))
+    return np.stack([np.interp(frames, frames[valid], channel[valid]) for channel in traces.T], axis=1)
+
+
+def hr_series(pulse, fs, window=10.0, step=1.0):
+    """
+    HR every step seconds over the last window seconds of the bandpassed pulse signal
+    :return: (times in seconds, HR in bpm, NaN while the window fills), filtered pulse
+    """
+    design = design_bandpass(round(fs, 3))
+    filtered = sosfiltfilt(design[0], pulse) if design is not None and len(pulse) > 27 else pulse
+
+    estimator = StreamingHR(fs, window=window)
+    hop = max(int(round(step * fs)), 1)
+    times, hr = [], []
+    for end in range(hop, len(filtered) + 1, hop):
+        estimator.push(filtered[end - hop:end])
+        times.append(end / fs)
+        hr.append(estimator.hr() or np.nan)
+    return np.array(times), np.array(hr), filtered
+
+
+def group_names(filenames):
+    """HDF5 group of every video: its path relative to the common directory of the videos"""
+    paths = [os.path.abspath(filename) for filename in filenames]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return {filename: os.path.relpath(path, root).replace(os.sep, '/') for filename, path in zip(filenames, paths)}
+
+
+def write_video(store, name, filename, fps, traces, boxes, method, window, step):
+    bgr = fill_gaps(traces.astype(float))
+    if bgr is None:
+        pulse = np.full(len(traces), np.nan)
+        times, hr, filtered = np.empty(0), np.empty(0), pulse
+    else:
+        pulse = extract_pulse(bgr[:, ::-1], fps, method)
+        times, hr, filtered = hr_series(pulse, fps, window, step)
+    group = store.require_group(name)
+    for name in list(group):
+        del group[name]
+    group.attrs['filename'] = os.path.abspath(filename)
+    group.attrs['fps'] = fps
+    group.attrs['method'] = method
+    group.attrs['window'] = window
+    options = dict(compression='gzip', shuffle=True)
+    group.create_dataset('bgr', data=traces, **options)
+    group.create_dataset('boxes', data=boxes, **options)
+    group.create_dataset('pulse', data=pulse.astype(np.float32), **options)
+    group.create_dataset('pulse_filtered', data=filtered.astype(np.float32), **options)
+    group.create_dataset('hr_time', data=times.astype(np.float32), **options)
+    group.create_dataset('hr', data=hr.astype(np.float32), **options)
+    return hr
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline rPPG of recorded videos')
+    parser.add_argument('videos', nargs='+', help='Videos recorded with record_video.py')
+    parser.add_argument('-o', '--output', type=str, help='HDF5 store', required=False, default='rppg.h5')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes', required=False,
+                        default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, help='Frames per task, splits long videos across processes '
+                                                  '(0: one task per video)', required=False, default=0)
+    parser.add_argument('--method', type=str, help='Pulse extraction from the RGB traces', required=False,
+                        choices=METHODS, default='pos')
+    parser.add_argument('--window', type=float, help='HR window in seconds', required=False, default=10.0)
+    parser.add_argument('--step', type=float, help='Seconds between HR estimates', required=False, default=1.0)
+    parser.add_argument('--detect-interval', type=int, help='Frames between face detections', required=False,
+                        default=10)
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(filename) for filename in args.videos]
+    duplicates = sorted({filename for filename, path in zip(args.videos, paths) if paths.count(path) > 1})
+    if duplicates:
+        parser.error(f"Videos given more than once: {', '.join(duplicates)}")
+    names = group_names(args.videos)
+
+    tasks = []
+    info = {}
+    for filename in args.videos:
+        frames, fps = video_info(filename)
+        info[filename] = fps
+        if args.chunk > 0 and frames > 0:
+            tasks += [(filename, start, min(start + args.chunk, frames), args.detect_interval)
+                      for start in range(0, frames, args.chunk)]
+        else:
+            tasks.append((filename, 0, None, args.detect_interval))
+
+    start = time.perf_counter()
+    segments = {filename: [] for filename in args.videos}
+    jobs = max(min(args.jobs, len(tasks)), 1)
+    with multiprocessing.Pool(jobs) as pool:
+        for segment in pool.imap_unordered(_extract, tasks):
+            segments[segment['filename']].append(segment)
+            print(f"{segment['filename']} from frame {segment['start']}: {len(segment['traces'])} frames")
+    elapsed = time.perf_counter() - start
+
+    total_frames = 0
+    cpu_time = 0.0
+    with h5py.File(args.output, 'a') as store:
+        for filename, parts in segments.items():
+            parts.sort(key=lambda segment: segment['start'])
+            traces = np.concatenate([segment['traces'] for segment in parts])
+            boxes = np.concatenate([segment['boxes'] for segment in parts])
+            total_frames += len(traces)
+            cpu_time += sum(segment['cpu_time'] for segment in parts)
+            hr = write_video(store, names[filename], filename, info[filename], traces, boxes, args.method,
+                             args.window, args.step)
+            detected = np.isfinite(traces[:, 1]).mean() if len(traces) else 0.0
+            print(f"{filename}: {len(traces)} frames, face in {detected:.0%}, "
+                  f"median HR {np.nanmedian(hr) if np.isfinite(hr).any() else float('nan'):.1f} bpm")
+
+    print(f"{total_frames} frames in {elapsed:.2f} s with {jobs} processes: {total_frames / elapsed:.1f} frames/s, "
+          f"{total_frames / cpu_time if cpu_time else 0:.1f} frames/s per core")
+    print(f"Saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,11 @@
 import cv2
-import numpy as np
-from scipy.signal import butter, filtfilt, find_peaks
+import queue
 import matplotlib.pyplot as plt
-import time
+from rppg_pipeline import CaptureThread, ProcessingThread, RPPGProcessor, StageStats
 
 # Matplotlib live plot
 plt.ion()
 fig, ax = plt.subplots(figsize=(10, 4))
-xdata, ydata, ydata_filtered = [], [], []
 line, = ax.plot([], [], label='Pulse Waveform')
 text_hr = ax.text(0.02, 0.95, '', transform=ax.transAxes, color='red', fontsize=12)
 
@@ -16,124 +14,71 @@ ax.set_ylabel("Waveform")
 ax.set_xlabel("Time")
 plt.title("rPPG")
 
-# Load the pre-trained face detector
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-# Bandpass filter
-def bandpass_filter(signal, fs=30, lowcut=0.7, highcut=4.0):
-    nyquist = 0.5 * fs
-    low = lowcut / nyquist
-    high = highcut / nyquist
-
-    if not (0 < low < high < 1.0):
-        print(f"[WARN] Invalid filter range: low={low:.2f}, high={high:.2f} — skipping filter")
-        return signal  # fallback to raw signal
-
-    try:
-        b, a = butter(4, [low, high], btype="band")
-        padlen = 3 * max(len(a), len(b))
-        if len(signal) > padlen:
-            return filtfilt(b, a, signal)
-        else:
-            return signal  # too short for filter
-    except Exception as e:
-        print(f"[ERROR] Filter failed: {e}")
-        return signal
-
-# HR estimation functions
-def estimate_hr_FFT(waveform, sampling_rate):
-    fft_result = np.fft.fft(waveform)
-    fft_freqs = np.fft.fftfreq(len(waveform), 1/sampling_rate)
-    fft_magnitude = np.abs(fft_result)
-    peak_index = np.argmax(fft_magnitude[1:]) + 1
-    peak_freq = abs(fft_freqs[peak_index])
-    return 60 * peak_freq
-
-def estimate_hr_peak(waveform, sampling_rate):
-    peaks, _ = find_peaks(waveform)
-    if len(peaks) < 2:
-        return 0
-    peak_times = np.diff(peaks) / sampling_rate
-    avg_peak_interval = np.mean(peak_times)
-    return 60 / avg_peak_interval
-
-last_estimation_time = 0
-estimation_interval = 1.0  # seconds
-
-hr_fft = 0
-hr_peak = 0
-
 # Start the webcam
 cap = cv2.VideoCapture(0)
-target_fps = 10.0
-frame_interval = 1.0 / target_fps
-
-while True:
-    loop_start = time.time()
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 3, minSize=(100, 100))
-
-    for (x, y, w, h) in faces:
-        # Face and ROI rectangle
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        x_roi = x + int(0.2 * w)
-        w_roi = int(0.6 * w)
-        y_roi = y
-        h_roi = int(0.25 * h)
-        roi = frame[y_roi:y_roi + h_roi, x_roi:x_roi + w_roi, :]
-        cv2.rectangle(frame, (x_roi, y_roi), (x_roi + w_roi, y_roi + h_roi), (0, 0, 255), 2)
-
-        # Green signal
-        green_channel = roi[:, :, 1]
-        signal = np.mean(green_channel)
-        xdata.append(loop_start)
-        ydata.append(signal)
-
-        # Keep 20 seconds of data
-        cutoff = loop_start - 20
-        xdata = [t for t in xdata if t >= cutoff]
-        ydata = ydata[-len(xdata):]
-
-        if len(ydata) > 20 and (loop_start - last_estimation_time) >= estimation_interval:
-            dt = xdata[-1] - xdata[0]
-            sampling_rate = len(xdata) / dt
-
-            filtered_signal = bandpass_filter(ydata, fs=sampling_rate)
-            ydata_filtered = filtered_signal
-
-            hr_fft = estimate_hr_FFT(filtered_signal, sampling_rate)
-            hr_peak = estimate_hr_peak(filtered_signal, sampling_rate)
-
-            # Update Matplotlib plot
-            text_hr.set_text(f"HR (FFT): {hr_fft:.2f} bpm\nHR (Peak): {hr_peak:.2f} bpm")
-            line.set_data(xdata, ydata_filtered)
-            ax.set_xlim(cutoff, loop_start)
-            ax.set_ylim(min(ydata_filtered), max(ydata_filtered))
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-
-            last_estimation_time = loop_start  # update last estimation timestamp
+camera_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+# Pipeline: capture thread -> frames queue -> processing thread -> display queue -> display (main thread)
+# The frames queue blocks, so the signal never loses a frame; the display queue keeps only the latest frames
+frames = queue.Queue(maxsize=64)
+display = queue.Queue(maxsize=2)
+capture_stats = StageStats("capture")
+processing_stats = StageStats("processing")
+display_stats = StageStats("display")
+
+# 20 seconds of signal, HR estimated once a second, filters designed for the measured frame rate
+processor = RPPGProcessor(fs=camera_fps, window=20, estimation_interval=1.0)
+capture = CaptureThread(cap, frames, capture_stats)
+processing = ProcessingThread(processor, frames, display, processing_stats, display_stats)
+capture.start()
+processing.start()
+
+try:
+    while True:
+        try:
+            item = display.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        if item is None:
+            break
+
+        timestamp, frame, result = item
+        for (x, y, w, h) in result['faces']:
+            # Face rectangle
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        if result['roi'] is not None:
+            x_roi, y_roi, w_roi, h_roi = result['roi']
+            cv2.rectangle(frame, (x_roi, y_roi), (x_roi + w_roi, y_roi + h_roi), (0, 0, 255), 2)
 
         # Overlay HR on frame
-        cv2.putText(frame, f"HR (FFT): {hr_fft:.1f} bpm", (10, 30),
+        cv2.putText(frame, f"HR (FFT): {result['hr_fft']:.1f} bpm", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-        cv2.putText(frame, f"HR (Peak): {hr_peak:.1f} bpm", (10, 60),
+        cv2.putText(frame, f"HR (Peak): {result['hr_peak']:.1f} bpm", (10, 60),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
 
-    # Show the frame
-    cv2.imshow("rPPG", frame)
-
-    # Exit on 'q'
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-    # Enforce frame rate
-    elapsed = time.time() - loop_start
-    time.sleep(max(0, frame_interval - elapsed))
+        # Update Matplotlib plot when the HR was estimated again
+        if result['plot'] is not None:
+            xdata, filtered_signal = result['plot']
+            text_hr.set_text(f"HR (FFT): {result['hr_fft']:.2f} bpm\nHR (Peak): {result['hr_peak']:.2f} bpm")
+            line.set_data(xdata, filtered_signal)
+            ax.set_xlim(xdata[-1] - processor.window, xdata[-1])
+            ax.set_ylim(filtered_signal.min(), filtered_signal.max())
+            fig.canvas.draw()
+            fig.canvas.flush_events()
 
-cap.release()
-cv2.destroyAllWindows()
+        # Show the frame
+        cv2.imshow("rPPG", frame)
+        display_stats.record(timestamp)
+
+        # Exit on 'q'
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+finally:
+    capture.stop()
+    # the processing thread drains the frames already captured
+    processing.join(timeout=2.0)
+    cap.release()
+    cv2.destroyAllWindows()
+    for stats in (capture_stats, processing_stats, display_stats):
+        print(stats)
@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.signal import get_window, sosfiltfilt
+
+from bandpass import design_bandpass
+from ring_buffer import RingBuffer
+
+METHODS = ['green', 'chrom', 'pos']
+
+
+def chrom(windows, fs=None):
+    """
+    CHROM (de Haan and Jeanne, 2013) of a batch of windows of RGB means, shape (windows, L, 3).
+    The chrominance signals are bandpassed per window when fs is given
+    :return: (windows, L) pulse signals
+    """
+    normalized = windows / windows.mean(axis=1, keepdims=True)
+    r, g, b = normalized[..., 0], normalized[..., 1], normalized[..., 2]
+    x = 3 * r - 2 * g
+    y = 1.5 * r + g - 1.5 * b
+    design = design_bandpass(round(fs, 3)) if fs else None
+    if design is not None:
+        sos = design[0]
+        padlen = min(windows.shape[1] - 1, 3 * (2 * len(sos) + 1))
+        x = sosfiltfilt(sos, x, axis=1, padlen=padlen)
+        y = sosfiltfilt(sos, y, axis=1, padlen=padlen)
+    alpha = x.std(axis=1, keepdims=True) / np.maximum(y.std(axis=1, keepdims=True), 1e-12)
+    return x - alpha * y
+
+
+def pos(windows, fs=None):
+    """
+    POS (Wang et al., 2017) of a batch of windows of RGB means, shape (windows, L, 3)
+    :return: (windows, L) pulse signals
+    """
+    normalized = windows / windows.mean(axis=1, keepdims=True)
+    r, g, b = normalized[..., 0], normalized[..., 1], normalized[..., 2]
+    s1 = g - b
+    s2 = -2 * r + g + b
+    alpha = s1.std(axis=1, keepdims=True) / np.maximum(s2.std(axis=1, keepdims=True), 1e-12)
+    h = s1 + alpha * s2
+    return h - h.mean(axis=1, keepdims=True)
+
+
+PROJECTIONS = {'chrom': chrom, 'pos': pos}
+
+
+def overlap_add(pulses, hop):
+    """
+    Sum of the Hann weighted windows, shape (windows, L), placed hop samples apart
+    :return: signal of (windows - 1) * hop + L samples
+    """
+    count, length = pulses.shape
+    weighted = pulses * get_window('hann', length)
+    positions = (np.arange(count)[:, None] * hop + np.arange(length)).ravel()
+    return np.bincount(positions, weights=weighted.ravel(), minlength=(count - 1) * hop + length)
+
+
+def window_size(fs, window):
+    """:return: (window, hop) in samples, windows overlap by half"""
+    length = max(int(round(window * fs)), 2)
+    return length, max(length // 2, 1)
+
+
+def extract_pulse(rgb, fs, method='pos', window=1.6):
+    """
+    Pulse signal of a whole trace of RGB means, shape (n, 3): all the windows are projected
+    in one batch and recombined by overlap-add. The samples after the last full window are zero
+    :return: n samples
+    """
+    rgb = np.asarray(rgb, dtype=float)
+    if method == 'green':
+        return rgb[:, 1].copy()
+    length, hop = window_size(fs, window)
+    pulse = np.zeros(len(rgb))
+    if len(rgb) < length:
+        return pulse
+    windows = np.lib.stride_tricks.sliding_window_view(rgb, length, axis=0)[::hop].transpose(0, 2, 1)
+    added = overlap_add(PROJECTIONS[method](windows, fs), hop)
+    pulse[:len(added)] = added
+    return pulse
+
+
+class PulseExtractor:
+    """
+    Streaming CHROM/POS: the RGB means of the frames are kept in a ring buffer, every hop
+    frames the complete windows are projected in one batch and overlap-added.
+    push returns the samples of the pulse that no future window changes any more,
+    window - hop samples behind the input; 'green' returns the green mean without delay
+    """
+
+    def __init__(self, fs, method='pos', window=1.6):
+        if method not in METHODS:
+            raise ValueError(f"Unknown method {method}, expected one of {METHODS}")
+        self.fs = fs
+        self.method = method
+        self.length, self.hop = window_size(fs, window)
+        # room for the windows of chunks up to 3 windows long, larger chunks are split
+        self.max_chunk = 3 * self.length
+        self.buffer = RingBuffer(self.length + self.max_chunk, shape=(3,))
+        self.tail = np.zeros(self.length - self.hop)
+        self.since_window = 0
+
+    @property
+    def delay(self):
+        """Samples between the last frame pushed and the last pulse sample returned"""
+        return 0 if self.method == 'green' else self.length - self.hop
+
+    def push(self, rgb):
+        """
+        Add the RGB means of one frame, shape (3,), or of a chunk of frames, shape (n, 3)
+        :return: the new pulse samples
+        """
+        rgb = np.asarray(rgb, dtype=float).reshape(-1, 3)
+        if self.method == 'green':
+            return rgb[:, 1].copy()
+        if len(rgb) > self.max_chunk:
+            return np.concatenate([self.push(rgb[i:i + self.max_chunk])
+                                   for i in range(0, len(rgb), self.max_chunk)])
+
+        filling = len(self.buffer) < self.length
+        self.buffer.extend(rgb)
+        self.since_window += len(rgb)
+        if len(self.buffer) < self.length:
+            return np.empty(0)
+        if filling:
+            # the first window ends on the sample that filled the buffer
+            self.since_window = len(self.buffer) - self.length + self.hop
+
+        count = self.since_window // self.hop
+        if count == 0:
+            return np.empty(0)
+        # the count windows ending on the last hop boundaries, oldest first
+        history = self.buffer.window(self.length + (count - 1) * self.hop + self.since_window % self.hop)
+        history = history[:len(history) - self.since_window % self.hop]
+        windows = np.lib.stride_tricks.sliding_window_view(history, self.length, axis=0)[::self.hop]
+        added = overlap_add(PROJECTIONS[self.method](windows.transpose(0, 2, 1), self.fs), self.hop)
+        self.since_window %= self.hop
+
+        added[:len(self.tail)] += self.tail
+        ready = count * self.hop
+        self.tail = added[ready:]
+        return added[:ready]
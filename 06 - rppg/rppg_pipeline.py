@@ -0,0 +1,211 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from scipy.signal import find_peaks
+
+from bandpass import StreamingBandpass
+from face_tracker import FaceTracker
+from hr_estimator import StreamingHR
+from ring_buffer import SignalWindow
+from rppg_methods import PulseExtractor
+
+# highest frame rate expected from a webcam, sizes the signal buffers
+MAX_FPS = 60
+
+
+class StageStats:
+    """Frames, drops and latency since the acquisition of the frame, for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, timestamp):
+        latency = time.time() - timestamp
+        with self.lock:
+            self.count += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def __str__(self):
+        mean = self.latency_total / self.count if self.count else 0.0
+        return (f"{self.name}: {self.count} frames, {self.dropped} dropped, "
+                f"latency mean {mean * 1e3:.1f} ms, max {self.latency_max * 1e3:.1f} ms")
+
+
+def put_latest(q, item, stats):
+    """Put item in q, dropping the oldest items while it is full"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+                stats.drop()
+            except queue.Empty:
+                pass
+
+
+class CaptureThread(threading.Thread):
+    """
+    Reads the camera and timestamps every frame at acquisition. The frames queue is bounded
+    and blocking: when processing falls behind, capture waits instead of dropping frames
+    of the signal path. None is queued when the camera stops
+    """
+
+    def __init__(self, cap, frames, stats):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.frames = frames
+        self.stats = stats
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            timestamp = time.time()
+            if not ret:
+                break
+            while not self.stop_event.is_set():
+                try:
+                    self.frames.put((timestamp, frame), timeout=0.1)
+                    self.stats.record(timestamp)
+                    break
+                except queue.Full:
+                    continue
+        self.frames.put(None)
+
+
+def forehead_roi(face):
+    """Forehead region (x, y, w, h) of a face box, upper quarter of the central 60%"""
+    x, y, w, h = face
+    return x + int(0.2 * w), y, int(0.6 * w), int(0.25 * h)
+
+
+def estimate_hr_peak(waveform, sampling_rate):
+    peaks, _ = find_peaks(waveform)
+    if len(peaks) < 2:
+        return 0
+    peak_times = np.diff(peaks) / sampling_rate
+    avg_peak_interval = np.mean(peak_times)
+    return 60 / avg_peak_interval
+
+
+class RPPGProcessor:
+    """
+    Signal path of the rPPG: face detection, RGB means of the forehead, pulse extraction
+    (method: 'pos', 'chrom' or 'green', see rppg_methods), streaming bandpass and HR estimation
+    once every estimation_interval seconds over the last window seconds
+    """
+
+    def __init__(self, fs, window=20, estimation_interval=1.0, detect_interval=10, tracking='flow', method='pos'):
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # the cascade runs every detect_interval frames, faces are tracked and smoothed in between
+        self.tracker = FaceTracker(self.face_cascade, detect_interval=detect_interval, method=tracking,
+                                   scaleFactor=1.1, minNeighbors=3, minSize=(100, 100))
+        self.window = window
+        self.estimation_interval = estimation_interval
+        self.extractor = PulseExtractor(fs, method=method)
+        # timestamps of the frames whose pulse samples are not out of the extractor yet
+        self.pending_times = deque()
+        self.raw = SignalWindow(duration=window, max_rate=MAX_FPS)
+        self.filtered = SignalWindow(duration=window, max_rate=MAX_FPS)
+        self.bandpass = StreamingBandpass(fs)
+        self.hr_estimator = StreamingHR(fs, window=window)
+        self.last_estimation_time = 0
+        self.hr_fft = 0
+        self.hr_peak = 0
+
+    def detect_faces(self, frame):
+        return self.tracker.update(frame)
+
+    def process(self, timestamp, frame):
+        """
+        Add a frame to the signal
+        :return: dict with the faces, the forehead roi of the measured face (None without faces),
+                 the HR estimates and, when they were updated, copies of the filtered signal to plot
+        """
+        faces = self.detect_faces(frame)
+        result = {'faces': faces, 'roi': None, 'hr_fft': self.hr_fft, 'hr_peak': self.hr_peak, 'plot': None}
+        if len(faces) == 0:
+            return result
+
+        # the largest face is measured
+        x_roi, y_roi, w_roi, h_roi = forehead_roi(max(faces, key=lambda face: face[2] * face[3]))
+        result['roi'] = (x_roi, y_roi, w_roi, h_roi)
+        # BGR means of the roi in one reduction, the extractor takes RGB
+        rgb = frame[y_roi:y_roi + h_roi, x_roi:x_roi + w_roi].reshape(-1, 3).mean(axis=0)[::-1]
+
+        self.pending_times.append(timestamp)
+        pulse = self.extractor.push(rgb)
+        if len(pulse) == 0:
+            return result
+        timestamps = [self.pending_times.popleft() for _ in range(len(pulse))]
+        self.raw.extend(timestamps, pulse)
+        self.filtered.extend(timestamps, self.bandpass.process(pulse))
+        self.hr_estimator.push(pulse)
+
+        if len(self.raw) > 20 and (timestamp - self.last_estimation_time) >= self.estimation_interval:
+            self.estimate()
+            self.last_estimation_time = timestamp
+            result['hr_fft'] = self.hr_fft
+            result['hr_peak'] = self.hr_peak
+            timestamps, filtered = self.filtered.window()
+            result['plot'] = (timestamps.copy(), filtered.copy())
+
+        return result
+
+    def estimate(self):
+        sampling_rate = self.raw.sampling_rate()
+        if not sampling_rate:
+            return
+
+        # filter and spectrum are designed again only if the frame rate drifted
+        if self.bandpass.set_rate(sampling_rate):
+            self.hr_estimator = StreamingHR(sampling_rate, window=self.window)
+            self.hr_estimator.push(self.raw.window()[1])
+
+        self.hr_fft = self.hr_estimator.hr() or 0
+        self.hr_peak = estimate_hr_peak(self.filtered.window()[1], sampling_rate)
+
+
+class ProcessingThread(threading.Thread):
+    """
+    Runs the processor on every captured frame, in order, and hands the annotated results
+    to the display through a small queue that drops the oldest frames when display is slow
+    """
+
+    def __init__(self, processor, frames, display, stats, display_stats):
+        super().__init__(daemon=True)
+        self.processor = processor
+        self.frames = frames
+        self.display = display
+        self.stats = stats
+        self.display_stats = display_stats
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            timestamp, frame = item
+            result = self.processor.process(timestamp, frame)
+            self.stats.record(timestamp)
+            put_latest(self.display, (timestamp, frame, result), self.display_stats)
+        put_latest(self.display, None, self.display_stats)
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+# one decoded CMS50D sample: wall clock time (s) and monotonic_ns at arrival, then the packet fields;
+# pulse_rate is 0xFF and spo2 0x7F when the device has no value
+SAMPLE_DTYPE = np.dtype([('timestamp', '<f8'), ('monotonic_ns', '<i8'), ('waveform', 'u1'), ('pulse_rate', 'u1'),
+                         ('spo2', 'u1'), ('signal_strength', 'u1'), ('pulse_beep', 'u1'), ('probe_error', 'u1')])
+
+# what put does when the queue is full
+#   drop-oldest: the oldest sample is overwritten and counted as dropped
+#   block:       the producer waits for the consumer (the serial port buffers meanwhile)
+#   spill:       the samples go to a file on disk until the consumer drains them
+POLICIES = ['drop-oldest', 'block', 'spill']
+
+
+class SampleQueue:
+    """
+    Thread-safe FIFO of SAMPLE_DTYPE records in a preallocated NumPy ring of capacity samples,
+    with a backpressure policy (see POLICIES) and counters of the samples put, dropped and spilled.
+    get_batch drains all the pending samples at once as a structured array
+    """
+
+    def __init__(self, capacity=600, policy='drop-oldest', spill_path=None, dtype=SAMPLE_DTYPE):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}, expected one of {POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self.dtype = dtype
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.head = 0  # oldest sample
+        self.count = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_count = 0  # samples in the spill file not read yet
+        self.spill_file = None
+        if policy == 'spill':
+            if spill_path is None:
+                self.spill_file = tempfile.TemporaryFile()
+            else:
+                self.spill_file = open(spill_path, 'w+b')
+
+    def __len__(self):
+        with self.condition:
+            return self.count + self.spill_count
+
+    def put(self, record):
+        """Add one sample, a tuple of the SAMPLE_DTYPE fields"""
+        with self.condition:
+            self.received += 1
+            if self.spill_count:
+                # older samples are on disk already, keep the order
+                self._spill(record)
+            elif self.count == self.capacity:
+                if self.policy == 'drop-oldest':
+                    self.head = (self.head + 1) % self.capacity
+                    self.count -= 1
+                    self.dropped += 1
+                elif self.policy == 'block':
+                    while self.count == self.capacity and not self.closed:
+                        self.condition.wait(timeout=0.1)
+                    if self.closed:
+                        self.dropped += 1
+                        return
+                else:
+                    self._spill(record)
+            if not self.spill_count:
+                self.data[(self.head + self.count) % self.capacity] = record
+                self.count += 1
+            self.condition.notify_all()
+
+    def extend(self, records):
+        """Add many samples (a structured array) under one lock, each with the policy of put"""
+        with self.condition:
+            for record in records:
+                self.put(record)
+
+    def _spill(self, record):
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(np.array([record], dtype=self.dtype).tobytes())
+        self.spill_count += 1
+        self.spilled += 1
+
+    def get_batch(self, timeout=None, max_samples=None):
+        """
+        All the pending samples (at most max_samples), oldest first, waiting up to timeout
+        seconds for the first one (forever with None, not at all with 0)
+        :return: structured array of SAMPLE_DTYPE, empty if nothing arrived
+        """
+        with self.condition:
+            if timeout != 0:
+                self.condition.wait_for(lambda: self.count or self.spill_count or self.closed, timeout=timeout)
+            n = self.count if max_samples is None else min(self.count, max_samples)
+            indices = (self.head + np.arange(n)) % self.capacity
+            batch = self.data[indices]
+            self.head = (self.head + n) % self.capacity
+            self.count -= n
+            if self.count == 0 and self.spill_count and (max_samples is None or n < max_samples):
+                batch = np.concatenate((batch, self._unspill(None if max_samples is None else max_samples - n)))
+            self.condition.notify_all()
+            return batch
+
+    def _unspill(self, limit):
+        """Read the spilled samples back, oldest first"""
+        self.spill_file.seek(0)
+        spilled = np.frombuffer(self.spill_file.read(), dtype=self.dtype)
+        if limit is not None and limit < len(spilled):
+            # the rest goes back to the start of the file
+            rest = spilled[limit:].tobytes()
+            spilled = spilled[:limit].copy()
+            self.spill_file.seek(0)
+            self.spill_file.write(rest)
+        else:
+            spilled = spilled.copy()
+            rest = b''
+        self.spill_file.truncate(len(rest))
+        self.spill_count = len(rest) // self.dtype.itemsize
+        return spilled
+
+    def get(self, timeout=None):
+        """The oldest sample (a numpy record), None if nothing arrived within timeout seconds"""
+        batch = self.get_batch(timeout=timeout, max_samples=1)
+        return batch[0] if len(batch) else None
+
+    def close(self):
+        """Wake up the waiting producers and consumers, a blocked put drops its sample"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
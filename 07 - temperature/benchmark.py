@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Micro-benchmarks for the thermal processing code of this lab
+
+import argparse
+import io
+import shutil
+import time
+
+import numpy as np
+from PIL import Image
+
+from flir_image_extractor import FlirImageExtractor, TemperatureLUTCache, EXTRACTION_MODES
+
+# frame sizes (height, width) of the cameras used in the lab
+FRAME_SIZES = {
+    'AX8 80x60': (60, 80),
+    '640x512': (512, 640),
+}
+
+# calibration of a typical AX8 snapshot
+CALIBRATION = dict(E=0.95, OD=1.0, RTemp=20.0, ATemp=20.0, IRWTemp=20.0, IRT=1.0, RH=50.0,
+                   PR1=17096.453, PB=1428.0, PF=1.0, PO=-114.0, PR2=0.046952017)
+
+
+def timeit(func, repeat):
+    """
+    Run func repeat times and return the best time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_raw_frame(shape, seed=0):
+    """
+    Random 16-bit raw frame covering roughly 0-60 C with the reference calibration
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(12000, 20000, size=shape, dtype=np.uint16)
+
+
+def bench_raw2temp(args):
+    scalar = np.vectorize(lambda x: FlirImageExtractor.raw2temp(x, **CALIBRATION))
+
+    for name, shape in FRAME_SIZES.items():
+        raw = random_raw_frame(shape)
+
+        reference = scalar(raw)
+        result = FlirImageExtractor.raw2temp_array(raw, **CALIBRATION)
+        max_err = np.max(np.abs(result - reference))
+
+        t_scalar = timeit(lambda: scalar(raw), args.repeat)
+        t_array = timeit(lambda: FlirImageExtractor.raw2temp_array(raw, **CALIBRATION), args.repeat)
+
+        print("{:>10}: np.vectorize {:9.3f} ms/frame, array {:7.3f} ms/frame, speedup {:6.1f}x, max err {:.2e} C"
+              .format(name, t_scalar * 1e3, t_array * 1e3, t_scalar / t_array, max_err))
+
+
+def bench_lut(args):
+    cache = TemperatureLUTCache()
+    t_build = timeit(lambda: (cache.clear(), cache.get(CALIBRATION)), args.repeat)
+    print("table build: {:.3f} ms".format(t_build * 1e3))
+
+    for name, shape in FRAME_SIZES.items():
+        raw = random_raw_frame(shape)
+
+        result = np.take(cache.get(CALIBRATION), raw)
+        max_err = np.max(np.abs(result - FlirImageExtractor.raw2temp_array(raw, **CALIBRATION)))
+
+        t_array = timeit(lambda: FlirImageExtractor.raw2temp_array(raw, **CALIBRATION), args.repeat)
+        t_lut = timeit(lambda: np.take(cache.get(CALIBRATION), raw), args.repeat)
+
+        print("{:>10}: array {:7.3f} ms/frame, cached table {:7.3f} ms/frame, speedup {:5.1f}x, max err {:.2e} C"
+              .format(name, t_array * 1e3, t_lut * 1e3, t_array / t_lut, max_err))
+    print(cache)
+
+
+def process_and_decode(fie, filename):
+    """
+    process_image decodes lazily, access both images to time the whole extraction
+    """
+    frame = fie.process_image(filename)
+    return frame.rgb, frame.celsius
+
+
+def bench_endian(args):
+    lambda_swap = np.vectorize(lambda x: (x >> 8) + ((x & 0x00ff) << 8))
+
+    for name, shape in FRAME_SIZES.items():
+        # a raw frame stored in a 16-bit png with the wrong byte order, like the FLIR png payloads
+        raw = random_raw_frame(shape)
+        png_stream = io.BytesIO()
+        Image.fromarray(raw.byteswap()).save(png_stream, format='PNG')
+        png_np = np.asarray(Image.open(io.BytesIO(png_stream.getvalue())))
+
+        reference = lambda_swap(png_np)
+        result = FlirImageExtractor.swap_endian(png_np)
+        if not (np.array_equal(result, reference) and np.array_equal(result, raw)):
+            raise AssertionError("swap_endian differs from the np.vectorize byte swap on {}".format(name))
+
+        t_lambda = timeit(lambda: lambda_swap(png_np), args.repeat)
+        t_view = timeit(lambda: FlirImageExtractor.swap_endian(png_np), args.repeat)
+        t_convert = timeit(lambda: np.take(FlirImageExtractor.lut_cache.get(CALIBRATION),
+                                           FlirImageExtractor.swap_endian(png_np)), args.repeat)
+
+        print("{:>10}: np.vectorize {:8.3f} ms/frame, byte order view {:7.4f} ms/frame, "
+              "view + table lookup {:7.3f} ms/frame, same values".format(name, t_lambda * 1e3, t_view * 1e3,
+                                                                         t_convert * 1e3))
+
+
+def bench_exiftool(args):
+    for mode in EXTRACTION_MODES:
+        fie = FlirImageExtractor(exiftool_path=args.exiftool, extraction_mode=mode)
+        # the first image also starts the stay_open worker
+        process_and_decode(fie, args.input)
+
+        start = time.perf_counter()
+        for _ in range(args.count):
+            process_and_decode(fie, args.input)
+        elapsed = time.perf_counter() - start
+
+        print("{:>10}: {:7.2f} images/s, {:8.2f} ms/image".format(mode, args.count / elapsed,
+                                                                elapsed / args.count * 1e3))
+
+
+def bench_native(args):
+    fie = FlirImageExtractor(extraction_mode='native')
+    t_native = timeit(lambda: process_and_decode(fie, args.input), args.repeat)
+    thermal_np = fie.get_thermal_np()
+    print("native: {:8.2f} ms/image, thermal {} {:.2f}..{:.2f} C, rgb {}".format(
+        t_native * 1e3, thermal_np.shape, thermal_np.min(), thermal_np.max(), fie.get_rgb_np().shape))
+
+    if shutil.which(args.exiftool) is None:
+        print("exiftool not found, skipping the comparison with the exiftool backend")
+        return
+
+    reference = FlirImageExtractor(exiftool_path=args.exiftool, extraction_mode='single')
+    t_reference = timeit(lambda: process_and_decode(reference, args.input), args.repeat)
+    max_err = np.max(np.abs(thermal_np - reference.get_thermal_np()))
+    print("single: {:8.2f} ms/image, max temperature difference {:.3f} C, same rgb: {}".format(
+        t_reference * 1e3, max_err, np.array_equal(fie.get_rgb_np(), reference.get_rgb_np())))
+
+
+def bench_faces(args):
+    # OpenCV is only needed by this benchmark
+    import cv2
+    from face_temperature import ForeheadTemperature, forehead_rois
+
+    vis_img = cv2.imread(args.image)
+    thermal_data = np.load(args.thermal)
+
+    # the per-face loop of the lab notebook, on the same detection but without the vectorized stats
+    reference = ForeheadTemperature()
+
+    def loop_statistics():
+        stats = []
+        foreheads = forehead_rois(reference.detect_faces(vis_img)) // reference.scale_factor
+        for (fx, fy, fw, fh) in foreheads:
+            forehead_region = thermal_data[fy:fy + fh, fx:fx + fw]
+            stats.append((np.median(forehead_region), np.percentile(forehead_region, 90), np.max(forehead_region)))
+        return stats
+
+    expected = np.array(loop_statistics()).reshape(-1, 3)
+    stats = reference.measure(vis_img, thermal_data)
+    result = np.column_stack((stats['median'], stats['p90'], stats['max']))
+    if not np.allclose(result, expected):
+        raise AssertionError("vectorized forehead stats differ from the per-face loop")
+    print("{} faces, median {} C".format(len(result), np.round(result[:, 0], 2)))
+
+    tracking = ForeheadTemperature(track=True, detect_interval=args.detect_interval)
+    for name, func in [('detect + loop', loop_statistics),
+                       ('detect + vectorized', lambda: reference.measure(vis_img, thermal_data)),
+                       ('tracking + vectorized', lambda: tracking.measure(vis_img, thermal_data))]:
+        start = time.perf_counter()
+        for _ in range(args.count):
+            func()
+        elapsed = time.perf_counter() - start
+        print("{:>22}: {:7.1f} frames/s".format(name, args.count / elapsed))
+    print("tracking mode ran the cascade on {} of {} frames".format(tracking.tracker.detections, args.count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the thermal processing code')
+    parser.add_argument('-r', '--repeat', type=int, help='Number of repetitions, the best time is reported',
+                        required=False, default=5)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    subparsers.add_parser('raw2temp', help='Raw to temperature conversion, np.vectorize vs array version') \
+        .set_defaults(func=bench_raw2temp)
+
+    subparsers.add_parser('lut', help='Raw to temperature conversion, array version vs cached lookup table') \
+        .set_defaults(func=bench_lut)
+
+    subparsers.add_parser('endian', help='Byte swap of png payloads, np.vectorize vs byte order view') \
+        .set_defaults(func=bench_endian)
+
+    parser_exiftool = subparsers.add_parser('exiftool', help='process_image throughput for each exiftool mode')
+    parser_exiftool.add_argument('-i', '--input', type=str, help='Input image', required=False, default='image.jpg')
+    parser_exiftool.add_argument('-n', '--count', type=int, help='Number of images to process', required=False,
+                                 default=20)
+    parser_exiftool.add_argument('-exif', '--exiftool', type=str, help='Custom path to exiftool', required=False,
+                                 default='exiftool')
+    parser_exiftool.set_defaults(func=bench_exiftool)
+
+    parser_native = subparsers.add_parser('native', help='Native FLIR parser, compared to exiftool if available')
+    parser_native.add_argument('-i', '--input', type=str, help='Input image', required=False, default='image.jpg')
+    parser_native.add_argument('-exif', '--exiftool', type=str, help='Custom path to exiftool', required=False,
+                               default='exiftool')
+    parser_native.set_defaults(func=bench_native)
+
+    parser_faces = subparsers.add_parser('faces', help='Forehead temperature frames/s, with and without tracking')
+    parser_faces.add_argument('--image', type=str, help='Visible image', required=False, default='image.jpg')
+    parser_faces.add_argument('--thermal', type=str, help='Thermal map (.npy)', required=False,
+                              default='thermal_map.npy')
+    parser_faces.add_argument('-n', '--count', type=int, help='Number of frames', required=False, default=50)
+    parser_faces.add_argument('--detect-interval', type=int, help='Frames between detections when tracking',
+                              required=False, default=10)
+    parser_faces.set_defaults(func=bench_faces)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+import argparse
+import cv2
+import numpy as np
+from main import FlirThermalProcessor
+
+# pixels of the visible image (640x480) per pixel of the thermal image (80x60) on the AX8
+SCALE_FACTOR = 8
+
+
+def forehead_rois(faces):
+    """Forehead region (upper middle part of the face) of each (x, y, w, h) face box"""
+    faces = np.asarray(faces, dtype=int).reshape(-1, 4)
+    x, y, w, h = faces.T
+    return np.column_stack((x + (w * 0.1).astype(int), y + (h * 0.05).astype(int),
+                            (w * 0.8).astype(int), (h * 0.2).astype(int)))
+
+
+def roi_statistics(thermal_data, rois, percentiles=(50, 90)):
+    """
+    Temperature stats of many (x, y, w, h) regions in one vectorized pass:
+    the pixels of all the regions are gathered and sorted together, then the
+    percentiles are read at each region's offsets (linear interpolation, like np.percentile)
+    """
+    height, width = thermal_data.shape
+    rois = np.asarray(rois, dtype=int).reshape(-1, 4)
+
+    # clip the regions to the thermal image
+    x0 = np.clip(rois[:, 0], 0, width)
+    y0 = np.clip(rois[:, 1], 0, height)
+    w = np.clip(rois[:, 0] + rois[:, 2], 0, width) - x0
+    h = np.clip(rois[:, 1] + rois[:, 3], 0, height) - y0
+    w = np.maximum(w, 0)
+    h = np.maximum(h, 0)
+    counts = w * h
+
+    # row and column of every pixel of every region
+    ids = np.repeat(np.arange(len(rois)), counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    local = np.arange(counts.sum()) - np.repeat(starts, counts)
+    rows = y0[ids] + local // w[ids]
+    cols = x0[ids] + local % w[ids]
+    values = thermal_data[rows, cols]
+
+    # sorted by region, then by temperature
+    values = values[np.lexsort((values, ids))]
+
+    names = ['mean', 'min', 'max'] + ['median' if q == 50 else 'p%d' % q for q in percentiles]
+    stats = {name: np.full(len(rois), np.nan) for name in names}
+    stats['count'] = counts
+
+    # empty regions have no pixels, the others are contiguous in values
+    valid = counts > 0
+    if not valid.any():
+        return stats
+    starts, counts = starts[valid], counts[valid]
+
+    stats['mean'][valid] = np.add.reduceat(values, starts) / counts
+    stats['min'][valid] = values[starts]
+    stats['max'][valid] = values[starts + counts - 1]
+    for q, name in zip(percentiles, names[3:]):
+        position = starts + (counts - 1) * (q / 100.0)
+        lo = np.floor(position).astype(int)
+        hi = np.ceil(position).astype(int)
+        stats[name][valid] = values[lo] + (values[hi] - values[lo]) * (position - lo)
+
+    return stats
+
+
+class TemplateFaceTracker:
+    """
+    Keeps the faces found by the Haar cascade between frames: in between detections
+    each face is followed by template matching in a window around its last position.
+    The cascade runs again every detect_interval frames or when a match is lost
+    """
+
+    def __init__(self, face_cascade, detect_interval=10, min_score=0.6, search_margin=0.25, **detect_kwargs):
+        self.face_cascade = face_cascade
+        self.detect_interval = detect_interval
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.detect_kwargs = detect_kwargs
+
+        self.faces = np.zeros((0, 4), dtype=int)
+        self.templates = []
+        self.frames_since_detection = 0
+        self.detections = 0
+
+    def detect(self, gray):
+        faces = self.face_cascade.detectMultiScale(gray, **self.detect_kwargs)
+        self.faces = np.asarray(faces, dtype=int).reshape(-1, 4)
+        self.templates = [gray[y:y + h, x:x + w].copy() for (x, y, w, h) in self.faces]
+        self.frames_since_detection = 0
+        self.detections += 1
+        return self.faces
+
+    def track(self, gray):
+        """Follow every face, returns None when a face is lost"""
+        height, width = gray.shape
+        tracked = []
+        for (x, y, w, h), template in zip(self.faces, self.templates):
+            mx = int(w * self.search_margin)
+            my = int(h * self.search_margin)
+            sx, sy = max(x - mx, 0), max(y - my, 0)
+            window = gray[sy:min(y + h + my, height), sx:min(x + w + mx, width)]
+            if window.shape[0] < h or window.shape[1] < w:
+                return None
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                return None
+            tracked.append((sx + dx, sy + dy, w, h))
+
+        return np.asarray(tracked, dtype=int).reshape(-1, 4)
+
+    def update(self, gray):
+        """Faces in the new frame, detected or tracked"""
+        self.frames_since_detection += 1
+        if len(self.faces) == 0 or self.frames_since_detection >= self.detect_interval:
+            return self.detect(gray)
+
+        faces = self.track(gray)
+        if faces is None:
+            return self.detect(gray)
+
+        self.faces = faces
+        return faces
+
+
+class ForeheadTemperature:
+    """
+    Forehead temperature of every face from aligned visible and thermal frames.
+    Faces are found in the visible image, the forehead boxes are scaled to the thermal image
+    """
+
+    def __init__(self, scale_factor=SCALE_FACTOR, track=False, detect_interval=10, min_score=0.6):
+        self.scale_factor = scale_factor
+        self.detect_kwargs = dict(scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        self.face_cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.tracker = None
+        if track:
+            self.tracker = TemplateFaceTracker(self.face_cascade, detect_interval=detect_interval,
+                                               min_score=min_score, **self.detect_kwargs)
+
+    def detect_faces(self, vis_img):
+        """Face boxes in the visible (BGR) image"""
+        gray = cv2.cvtColor(vis_img, cv2.COLOR_BGR2GRAY)
+        if self.tracker is not None:
+            return self.tracker.update(gray)
+        faces = self.face_cascade.detectMultiScale(gray, **self.detect_kwargs)
+        return np.asarray(faces, dtype=int).reshape(-1, 4)
+
+    def measure(self, vis_img, thermal_data):
+        """
+        Forehead stats of all the faces, as arrays with one entry per face:
+        median, p90, max, mean, min and pixel count, plus the face and forehead boxes
+        in visible ('face_roi_image', 'forehead_roi_image') and thermal coordinates
+        """
+        faces_image = self.detect_faces(vis_img)
+        foreheads_image = forehead_rois(faces_image)
+        foreheads = foreheads_image // self.scale_factor
+
+        stats = roi_statistics(thermal_data, foreheads)
+        stats['face_roi_image'] = faces_image
+        stats['forehead_roi_image'] = foreheads_image
+        stats['face_roi'] = faces_image // self.scale_factor
+        stats['forehead_roi'] = foreheads
+        return stats
+
+
+class FlirFaceThermalProcessor(FlirThermalProcessor):
+    """FlirThermalProcessor that also measures the forehead temperature of the captured faces"""
+
+    def __init__(self, camera_url, exiftool_path="exiftool", track=False):
+        super().__init__(camera_url, exiftool_path=exiftool_path)
+        self.forehead = ForeheadTemperature(track=track)
+
+    def capture_face_temperatures(self, output_dir="output"):
+        """Capture a visible and a thermal image, return the thermal data and the forehead stats"""
+        vis_filename, thermal_filename = self.capture_images(output_dir)
+        thermal_data = self.process_images(thermal_filename)
+        stats = self.forehead.measure(cv2.imread(vis_filename), thermal_data)
+        return thermal_data, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Forehead temperature of the faces in a visible/thermal pair')
+    parser.add_argument('--image', type=str, default='image.jpg', help="visible image")
+    parser.add_argument('--thermal', type=str, default='thermal_map.npy', help="thermal map in C (.npy)")
+    args = parser.parse_args()
+
+    forehead = ForeheadTemperature()
+    stats = forehead.measure(cv2.imread(args.image), np.load(args.thermal))
+    for i in range(len(stats['count'])):
+        print(f"Face {i+1}: median {stats['median'][i]:.2f}°C, p90 {stats['p90'][i]:.2f}°C, "
+              f"max {stats['max'][i]:.2f}°C over {stats['count'][i]} pixels")
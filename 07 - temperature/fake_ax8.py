@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Local stand-in for the HTTP interface of a FLIR AX8 camera, to try flir.py without the camera:
+#   python fake_ax8.py --port 8080 --image image.jpg
+#   python flir.py --url localhost:8080 --snap snap.jpg --interval 1
+
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+parser = argparse.ArgumentParser(description='Fake FLIR AX8 camera serving the same snapshot.')
+parser.add_argument('--port', action="store", type=int, default=8080, help="port to listen on")
+parser.add_argument('--image', action="store", default="image.jpg", help="the jpg returned for every snapshot")
+parser.add_argument('--delay', action="store", type=float, default=0.5, help="time to store a snapshot in s")
+parser.add_argument('--latency', action="store", type=float, default=0.0, help="latency added to every request in s")
+
+
+class FakeAX8:
+    def __init__(self, image, delay=0.5, latency=0.0):
+        self.image = image
+        self.delay = delay
+        self.latency = latency
+        self.resources = {}
+        self.images = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def setResource(self, resource, value):
+        with self.lock:
+            self.resources[resource] = value
+
+        if resource == '.image.services.store.commit' and value == 'true':
+            filename = os.path.basename(self.resources.get('.image.services.store.fileNameW', 'snapshot.jpg'))
+            # the snapshot becomes available after the store delay
+            timer = threading.Timer(self.delay, self.storeImage, args=(filename,))
+            timer.daemon = True
+            timer.start()
+
+    def getResource(self, resource):
+        with self.lock:
+            return self.resources.get(resource, '')
+
+    def storeImage(self, filename):
+        with self.lock:
+            self.images[filename] = self.image
+
+    def getImage(self, filename):
+        with self.lock:
+            return self.images.get(filename)
+
+    def deleteImage(self, filename):
+        with self.lock:
+            self.images.pop(filename, None)
+
+
+class FakeAX8Handler(BaseHTTPRequestHandler):
+    # keep-alive connections, like the camera
+    protocol_version = 'HTTP/1.1'
+    camera = None
+
+    def reply(self, body, status=200, contentType='text/plain'):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def readForm(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        return {key: values[0] for key, values in form.items()}
+
+    def handle_one_request(self):
+        self.camera.requests += 1
+        if self.camera.latency > 0:
+            time.sleep(self.camera.latency)
+        super().handle_one_request()
+
+    def do_GET(self):
+        # the body of GET requests (download.php) is ignored but must be consumed
+        self.readForm()
+
+        if self.path.startswith('/storage/download/image/'):
+            image = self.camera.getImage(self.path[len('/storage/download/image/'):])
+            if image is None:
+                self.reply('Not found', status=404)
+            else:
+                self.reply(image, contentType='image/jpeg')
+        else:
+            self.reply('')
+
+    def do_POST(self):
+        form = self.readForm()
+
+        if self.path == '/login/dologin':
+            self.reply('{"success": true}')
+        elif self.path == '/res.php':
+            if form.get('action') == 'set':
+                self.camera.setResource(form.get('resource'), form.get('value'))
+                self.reply('""')
+            else:
+                self.reply('"' + str(self.camera.getResource(form.get('resource'))) + '"')
+        elif self.path.startswith('/storage/delete/image/'):
+            self.camera.deleteImage(self.path[len('/storage/delete/image/'):])
+            self.reply('')
+        else:
+            self.reply('Not found', status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8080, image=None, delay=0.5, latency=0.0):
+    # starts the fake camera in a background thread, returns the server (call shutdown() to stop it)
+    FakeAX8Handler.camera = FakeAX8(image, delay=delay, latency=latency)
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeAX8Handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as fh:
+        image = fh.read()
+
+    server = serve(args.port, image, args.delay, args.latency)
+    print("Fake AX8 listening on http://127.0.0.1:" + str(server.server_address[1]) + "/")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -4,11 +4,17 @@
 
 import requests
 import argparse
+import itertools
+import os
+import threading
 import time
 import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from time import strftime
 
 import flir_image_extractor
+from thermal_archive import ThermalArchive
 
 parser = argparse.ArgumentParser(description='Functionality to control/read data from the FLIR AX8 camera.')
 
@@ -16,7 +22,9 @@ parser.add_argument('--url', action="store", help="the url of the camera, includ
 parser.add_argument('--type', action="store", help="the type of image", choices = ['msx','ir','visual'])
 parser.add_argument('--snap', action="store", help="take a snapshot with the given filename")
 parser.add_argument('--interval', action="store", type=float, help="tries to take snapshots at given interval")
-parser.add_argument('--csv', action="store", help="take a snapshot and export to csv-file")
+parser.add_argument('--csv', action="store", help="take a snapshot and export the thermal data, the format is chosen by the extension: .csv, .npy, .h5 or .parquet")
+parser.add_argument('--archive', action="store", help="with --interval, append the thermal data to this archive directory instead of keeping the snapshots")
+parser.add_argument('--archivetype', action="store", help="data stored in the archive", choices = ['celsius','raw'], default='celsius')
 parser.add_argument('--plot', action="store_true", help="shows the images")
 parser.add_argument('--range', action="store", type=float, nargs=2, help="temperature range")
 parser.add_argument('--autorange', action="store_true", help="use auto scale")
@@ -25,18 +33,45 @@ parser.add_argument('--light', action="store", help="activate the torchlight", c
 parser.add_argument('--debug', action="store_true", help="prints extra debug information")
 
 debug = False
-session = requests.Session()
+
+# polling of the stored snapshot: first wait, growth factor, longest wait, give up after (s)
+POLL_INITIAL = 0.05
+POLL_FACTOR = 2
+POLL_MAX = 1.0
+POLL_TIMEOUT = 30.0
+
+# chunk size when streaming a snapshot to disk
+DOWNLOAD_CHUNK = 64 * 1024
+
+snapshotCounter = itertools.count()
 
 
 def CtoK(temp):
     return temp+273.15
 
+def newSession(cookies):
+    # session with a keep-alive connection, sharing the login cookies (the cookie jar is thread-safe)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    session.cookies = cookies
+    return session
+
 class Flir:
     def __init__(self, baseURL='http://192.168.11.47/'):
         self.baseURL = baseURL
+        self.archive = None
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.sessions = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session is not thread-safe: the main thread and the capture worker have one each
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = newSession(self.cookies)
+        return self.sessions.session
 
     def setResource(self,resource,value):
-        message = session.post(self.baseURL + 'res.php', data={'action':'set','resource':resource,'value':value})
+        message = self.session.post(self.baseURL + 'res.php', data={'action':'set','resource':resource,'value':value})
 
         if (debug and message != "\"\""):
             print(" Return message when setting " + resource + " to " + str(value) + ":\r\n" +message)
@@ -44,7 +79,7 @@ class Flir:
         return (message)
 
     def getResource(self,resource):
-        return session.post(self.baseURL + 'res.php', data={'action':'get','resource':resource})
+        return self.session.post(self.baseURL + 'res.php', data={'action':'get','resource':resource})
 
     def setVisualMode(self):
         self.setResource('.image.sysimg.fusion.fusionData.fusionMode',1)
@@ -103,56 +138,134 @@ class Flir:
 
     def login(self):
         print("Logging in")
-        message = session.post(self.baseURL + 'login/dologin', data={'user_name':'admin','user_password':'admin'})
+        message = self.session.post(self.baseURL + 'login/dologin', data={'user_name':'admin','user_password':'admin'})
 
         if (not('success' in message.text)):
             print("Could not log in.")
 
-    def getSnapshot(self, jpgfile):
+    def storeSnapshot(self):
+        # asks the camera to store a snapshot, returns its name on the camera and the time of the commit
 
         start = time.time()
 
         dt = datetime.datetime.now()
-        filename = 'img-' + str(dt.year) + str(dt.month) + str(dt.day) + "-" + str(dt.hour) + str(dt.minute) + str(dt.second) + ".jpg"
+        # the counter keeps the names unique when snapshots are pipelined within the same second
+        filename = 'img-' + str(dt.year) + str(dt.month) + str(dt.day) + "-" + str(dt.hour) + str(dt.minute) + str(dt.second) + "-" + str(next(snapshotCounter)) + ".jpg"
 
         self.setResource('.image.services.store.format','JPEG')
         self.setResource('.image.services.store.overlay','true')
         self.setResource('.image.services.store.owerwrite','true')
         self.setResource('.image.services.store.fileNameW','/FLIR/images/' + filename)
         self.setResource('.image.services.store.commit','true')
-        fh = open(jpgfile, "wb")
 
-        ready = False
+        return filename, time.time() - start
 
-        print("Getting image from camera")
-        while not(ready):
-            response = session.get(self.baseURL + 'storage/download/image/' + filename, allow_redirects=True)
+    def downloadSnapshot(self, filename, jpgfile):
+        # polls the camera with exponential backoff until the snapshot is stored, then streams it to disk
+        # returns the time spent waiting and downloading
+
+        start = time.time()
+        wait = POLL_INITIAL
+
+        while True:
+            response = self.session.get(self.baseURL + 'storage/download/image/' + filename, allow_redirects=True, stream=True)
 
-            #if response.status_code == 404:
-            #    print(response.text)
-            #    #self.login()
-            #el
             if response.status_code == requests.codes.ok:
-                ready = True
-                fh.write(response.content)
-            else:
-                time.sleep(0.3)
-                response = session.get(self.baseURL + 'download.php', data={'file':'/FLIR/images/' + filename}, allow_redirects=True)
+                break
+
+            # release the connection before waiting
+            response.close()
+            if time.time() - start > POLL_TIMEOUT:
+                raise TimeoutError("Snapshot " + filename + " not available after " + str(POLL_TIMEOUT) + " s")
+
+            time.sleep(wait)
+            wait = min(wait * POLL_FACTOR, POLL_MAX)
+            self.session.get(self.baseURL + 'download.php', data={'file':'/FLIR/images/' + filename}, allow_redirects=True)
 
-        fh.close()
+        ready = time.time()
+
+        with response, open(jpgfile, "wb") as fh:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                fh.write(chunk)
+
+        return ready - start, time.time() - ready
+
+    def deleteSnapshot(self, filename):
+        # deletes the snapshot from the camera, returns the time spent
+
+        start = time.time()
 
         print("Deleting picture: " + filename)
-        message = session.post(self.baseURL + 'storage/delete/image/' + filename)
+        message = self.session.post(self.baseURL + 'storage/delete/image/' + filename)
 
         if ('login' in message.text):
             print("Need to log in first")
             self.login()
 
-            message = session.post(self.baseURL + 'storage/delete/image/' + filename)
+            message = self.session.post(self.baseURL + 'storage/delete/image/' + filename)
 
-        end = time.time()
+        return time.time() - start
 
-        print("Downloaded image " + jpgfile + " from camera in " + str(end-start) + " s.")
+    def fetchSnapshot(self, filename, jpgfile, storeTime):
+        # downloads and deletes a stored snapshot, returns the file and the latency of each phase
+
+        waitTime, downloadTime = self.downloadSnapshot(filename, jpgfile)
+        deleteTime = self.deleteSnapshot(filename)
+
+        timings = {'store': storeTime, 'wait': waitTime, 'download': downloadTime, 'delete': deleteTime}
+        return jpgfile, timings
+
+    @staticmethod
+    def printTimings(jpgfile, timings):
+        print("Downloaded image " + jpgfile + " from camera in " + str(sum(timings.values())) + " s (" +
+              ", ".join(phase + " " + str(round(t, 3)) + " s" for phase, t in timings.items()) + ").")
+
+    def getSnapshot(self, jpgfile):
+
+        print("Getting image from camera")
+        filename, storeTime = self.storeSnapshot()
+        jpgfile, timings = self.fetchSnapshot(filename, jpgfile, storeTime)
+
+        self.printTimings(jpgfile, timings)
+        return timings
+
+    def captureSnapshots(self, jpgfiles, interval=0):
+        # takes a snapshot for each file name, one every interval seconds. The snapshots are
+        # downloaded and deleted in a background thread; when the next one is due before the
+        # previous one is on disk, it is committed meanwhile (at most one download waits).
+        # Yields (jpgfile, timings, captureTime) as soon as each snapshot is on disk, captureTime
+        # being when the camera acknowledged the commit (seconds since the epoch)
+
+        jpgfiles = iter(jpgfiles)
+        pending = deque()
+        nextTime = time.time()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                while pending:
+                    # until the next snapshot is due, or for as long as it takes with two in flight
+                    timeout = None if len(pending) > 1 else max(nextTime - time.time(), 0)
+                    if not wait([pending[0][0]], timeout=timeout).done:
+                        break
+                    future, captureTime = pending.popleft()
+                    yield future.result() + (captureTime,)
+
+                delay = nextTime - time.time()
+                if (delay > 0):
+                    time.sleep(delay)
+
+                jpgfile = next(jpgfiles, None)
+                if jpgfile is None:
+                    break
+
+                nextTime = time.time() + interval
+                filename, storeTime = self.storeSnapshot()
+                captureTime = time.time()
+                pending.append((executor.submit(self.fetchSnapshot, filename, jpgfile, storeTime), captureTime))
+
+            while pending:
+                future, captureTime = pending.popleft()
+                yield future.result() + (captureTime,)
 
     def getCsvData(self, jpgfile, csvfile, plot = False):
 
@@ -161,15 +274,36 @@ class Flir:
         fie = flir_image_extractor.FlirImageExtractor()
         fie.process_image(jpgfile)
 
-        fie.export_thermal_to_csv(csvfile)
+        fie.export_thermal(csvfile)
 
         end = time.time()
 
         print("Thermal data in picture " + jpgfile + " written to " + csvfile + " in " + str(end-start) + " s.")
 
+        if (debug):
+            print(flir_image_extractor.FlirImageExtractor.lut_cache)
+
         if (plot):
             fie.plot()
 
+    def archiveSnapshot(self, jpgfile, archivePath, raw = False, timestamp = None):
+        # timestamp: capture time of the snapshot (seconds since the epoch), default now
+
+        start = time.time()
+
+        fie = flir_image_extractor.FlirImageExtractor()
+        frame = fie.process_image(jpgfile)
+        data = frame.raw if raw else frame.celsius
+
+        if (self.archive is None):
+            self.archive = ThermalArchive(archivePath, frame_shape=data.shape, dtype='uint16' if raw else 'float32', mode='a')
+
+        index = self.archive.append(data, timestamp=timestamp, calibration=frame.calibration)
+
+        end = time.time()
+
+        print("Thermal data in picture " + jpgfile + " archived as frame " + str(index) + " in " + str(end-start) + " s.")
+
     #def getBox(self,boxNumber):
     #    ret = {}
     #    bns = str(boxNumber)
@@ -242,18 +376,23 @@ if __name__ == '__main__':
     if (args.interval):
         if (args.snap):
 
-            while True:
-                timestamp = strftime("%H%M%S")
-                filename = args.snap.strip('.jpg') + '_' + timestamp + '.jpg'
-                f.getSnapshot(filename)
+            def intervalFilenames():
+                while True:
+                    timestamp = strftime("%H%M%S")
+                    yield args.snap.strip('.jpg') + '_' + timestamp + '.jpg'
+
+            for filename, timings, captureTime in f.captureSnapshots(intervalFilenames(), max(args.interval, 0)):
+                f.printTimings(filename, timings)
+
+                if (args.archive):
+                    f.archiveSnapshot(filename, args.archive, args.archivetype == 'raw', captureTime)
+                    os.remove(filename)
+                    continue
 
                 if (args.csv):
-                    filenamecsv = filename.strip('.jpg') + '.csv'
+                    filenamecsv = filename.strip('.jpg') + (os.path.splitext(args.csv)[1] or '.csv')
                     f.getCsvData(filename, filenamecsv, False)
 
-                if (args.interval > 0):
-                    time.sleep(args.interval)
-
     elif (args.snap):
         f.getSnapshot(args.snap)
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+# Asyncio interface to FLIR AX8 cameras, to drive several cameras from one process.
+# Requires aiohttp (pip install aiohttp). Try it without cameras against fake_ax8.py:
+#   python fake_ax8.py --port 8080 &
+#   python fake_ax8.py --port 8081 &
+#   python flir_async.py --url localhost:8080 --url localhost:8081 --snap snap.jpg --count 5
+
+import argparse
+import asyncio
+import datetime
+import os
+import time
+
+import aiohttp
+
+from flir import CtoK, POLL_INITIAL, POLL_FACTOR, POLL_MAX, POLL_TIMEOUT, DOWNLOAD_CHUNK, snapshotCounter
+
+parser = argparse.ArgumentParser(description='Take snapshots from several FLIR AX8 cameras at the same time.')
+
+parser.add_argument('--url', action="append", help="the url of a camera, can be given more than once", required=True)
+parser.add_argument('--snap', action="store", help="snapshot filename, the camera index is appended", required=True)
+parser.add_argument('--count', action="store", type=int, default=1, help="number of snapshots per camera")
+parser.add_argument('--type', action="store", help="the type of image", choices = ['msx','ir','visual'])
+parser.add_argument('--debug', action="store_true", help="prints extra debug information")
+
+debug = False
+
+# concurrent requests to the same camera
+MAX_CONCURRENCY = 4
+
+
+class AsyncFlir:
+    def __init__(self, baseURL='http://192.168.11.47/', session=None, maxConcurrency=MAX_CONCURRENCY):
+        self.baseURL = baseURL
+        self.session = session
+        self.ownSession = session is None
+        # bounds the requests in flight, the embedded web server of the camera is small
+        self.semaphore = asyncio.Semaphore(maxConcurrency)
+
+    async def __aenter__(self):
+        if self.session is None:
+            self.session = newSession()
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.ownSession:
+            await self.session.close()
+            self.session = None
+
+    async def post(self, path, data=None):
+        async with self.semaphore:
+            async with self.session.post(self.baseURL + path, data=data) as response:
+                return await response.text()
+
+    async def setResource(self,resource,value):
+        message = await self.post('res.php', data={'action':'set','resource':resource,'value':str(value)})
+
+        if (debug and message != "\"\""):
+            print(" Return message when setting " + resource + " to " + str(value) + ":\r\n" + message)
+
+        return (message)
+
+    async def getResource(self,resource):
+        return await self.post('res.php', data={'action':'get','resource':resource})
+
+    async def setResources(self, resources):
+        # sets independent resources concurrently, resources is a list of (resource, value)
+        return await asyncio.gather(*(self.setResource(resource, value) for resource, value in resources))
+
+    async def setVisualMode(self):
+        await self.setResources([('.image.sysimg.fusion.fusionData.fusionMode',1),
+                                 ('.image.sysimg.fusion.fusionData.useLevelSpan',0)])
+
+    async def setIRMode(self):
+        await self.setResources([('.image.sysimg.fusion.fusionData.fusionMode',1),
+                                 ('.image.sysimg.fusion.fusionData.useLevelSpan',1)])
+
+    async def setMSXMode(self):
+        await self.setResource('.image.sysimg.fusion.fusionData.fusionMode',3)
+
+    async def setPeriodicMode(self):
+        await self.setResources([('.resmon.schedule.active','true'),
+                                 ('.resmon.schedule.config.ftp', '192.168.11.18'),
+                                 ('.resmon.schedule.config.imageFormat', 'JPEG'),
+                                 ('.resmon.schedule.actions.sendImage', 'true'),
+                                 ('.resmon.schedule.results.1.active', 'true'),
+                                 ('.resmon.schedule.wednesday.active', 'true'),
+                                 ('.resmon.schedule.wednesday.mode', 'repeat'),
+                                 ('.resmon.schedule.wednesday.start', '10:00'),
+                                 ('.resmon.schedule.wednesday.stop', '22:00'),
+                                 ('.resmon.schedule.wednesday.interval', '00:01')])
+        # applies the settings above
+        await self.setResource('.resmon.schedule.reinit','true')
+
+    async def getTemperatureValue(self, x, y):
+        await self.setResources([('.image.sysimg.measureFuncs.spot.1.active','true'),
+                                 ('.image.sysimg.measureFuncs.spot.1.x',x),
+                                 ('.image.sysimg.measureFuncs.spot.1.y',y)])
+        value = await self.getResource('.image.sysimg.measureFuncs.spot.1.valueT')
+        return float(value[1:-2])
+
+    async def setTemperatureRange(self,minTemp, maxTemp):
+        await self.setResources([('.image.contadj.adjMode', 'manual'),
+                                 ('.image.sysimg.basicImgData.extraInfo.lowT',CtoK(minTemp)),
+                                 ('.image.sysimg.basicImgData.extraInfo.highT',CtoK(maxTemp))])
+
+    async def setAutoTemperatureRange(self):
+        await self.setResource('.image.contadj.adjMode', 'auto')
+
+    async def showOverlay(self,show=True):
+        await self.setResource('.resmon.config.hideGraphics','false' if show else 'true')
+
+    async def light(self,on=True):
+        await self.setResource('.system.vcam.torch','true' if on else 'false')
+
+    async def setPalette(self, palette):
+        # iron.pal, bw.pal, rainbow.pal
+        await self.setResource('.image.sysimage.palette.readFile',palette)
+
+    async def login(self):
+        print("Logging in " + self.baseURL)
+        message = await self.post('login/dologin', data={'user_name':'admin','user_password':'admin'})
+
+        if (not('success' in message)):
+            print("Could not log in.")
+
+    async def storeSnapshot(self):
+        # asks the camera to store a snapshot, returns its name on the camera and the time of the commit
+
+        start = time.time()
+
+        dt = datetime.datetime.now()
+        filename = 'img-' + str(dt.year) + str(dt.month) + str(dt.day) + "-" + str(dt.hour) + str(dt.minute) + str(dt.second) + "-" + str(next(snapshotCounter)) + ".jpg"
+
+        await self.setResources([('.image.services.store.format','JPEG'),
+                                 ('.image.services.store.overlay','true'),
+                                 ('.image.services.store.owerwrite','true'),
+                                 ('.image.services.store.fileNameW','/FLIR/images/' + filename)])
+        await self.setResource('.image.services.store.commit','true')
+
+        return filename, time.time() - start
+
+    async def downloadSnapshot(self, filename, jpgfile):
+        # polls the camera with exponential backoff until the snapshot is stored, then streams it to disk
+        # returns the time spent waiting and downloading
+
+        start = time.time()
+        wait = POLL_INITIAL
+
+        while True:
+            async with self.semaphore:
+                async with self.session.get(self.baseURL + 'storage/download/image/' + filename) as response:
+                    if response.status == 200:
+                        ready = time.time()
+                        with open(jpgfile, "wb") as fh:
+                            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                                fh.write(chunk)
+                        return ready - start, time.time() - ready
+
+                    await response.read()
+
+            if time.time() - start > POLL_TIMEOUT:
+                raise TimeoutError("Snapshot " + filename + " not available after " + str(POLL_TIMEOUT) + " s")
+
+            await asyncio.sleep(wait)
+            wait = min(wait * POLL_FACTOR, POLL_MAX)
+
+    async def deleteSnapshot(self, filename):
+        # deletes the snapshot from the camera, returns the time spent
+
+        start = time.time()
+
+        message = await self.post('storage/delete/image/' + filename)
+
+        if ('login' in message):
+            print("Need to log in first")
+            await self.login()
+
+            await self.post('storage/delete/image/' + filename)
+
+        return time.time() - start
+
+    async def getSnapshot(self, jpgfile):
+        # takes a snapshot and saves it to jpgfile, returns the latency of each phase
+
+        filename, storeTime = await self.storeSnapshot()
+        waitTime, downloadTime = await self.downloadSnapshot(filename, jpgfile)
+        deleteTime = await self.deleteSnapshot(filename)
+
+        return {'store': storeTime, 'wait': waitTime, 'download': downloadTime, 'delete': deleteTime}
+
+
+def newSession(connections=MAX_CONCURRENCY):
+    # client session with keep-alive connections, cookies are accepted from ip addresses (needed for the login)
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=connections),
+                                 cookie_jar=aiohttp.CookieJar(unsafe=True))
+
+
+def normalizeURL(url):
+    if (not(url.startswith('http://'))):
+        url = 'http://' + url
+
+    if (not(url.endswith('/'))):
+        url = url + '/'
+
+    return url
+
+
+async def captureAll(urls, snap, count=1, imageType=None):
+    # logs in to every camera and takes count snapshots from all of them at the same time
+
+    async with newSession(MAX_CONCURRENCY * len(urls)) as session:
+        cameras = [AsyncFlir(baseURL=normalizeURL(url), session=session) for url in urls]
+        await asyncio.gather(*(camera.login() for camera in cameras))
+
+        if (imageType == 'visual'):
+            await asyncio.gather(*(camera.setVisualMode() for camera in cameras))
+        elif (imageType == 'ir'):
+            await asyncio.gather(*(camera.setIRMode() for camera in cameras))
+        elif (imageType == 'msx'):
+            await asyncio.gather(*(camera.setMSXMode() for camera in cameras))
+
+        prefix, ext = os.path.splitext(snap)
+        for n in range(count):
+            start = time.time()
+            jpgfiles = [prefix + '_' + str(i) + '_' + str(n) + (ext or '.jpg') for i in range(len(cameras))]
+            results = await asyncio.gather(*(camera.getSnapshot(jpgfile)
+                                             for camera, jpgfile in zip(cameras, jpgfiles)),
+                                           return_exceptions=True)
+
+            for camera, jpgfile, result in zip(cameras, jpgfiles, results):
+                if isinstance(result, Exception):
+                    print("Snapshot from " + camera.baseURL + " failed: " + str(result))
+                else:
+                    print("Downloaded image " + jpgfile + " from " + camera.baseURL + " (" +
+                          ", ".join(phase + " " + str(round(t, 3)) + " s" for phase, t in result.items()) + ").")
+
+            print(str(len(cameras)) + " cameras captured in " + str(time.time() - start) + " s.")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if (args.debug):
+        debug = True
+
+    asyncio.run(captureAll(args.url, args.snap, args.count, args.type))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Native reader for FLIR radiometric JPEGs, an alternative to exiftool.
+# The record layout follows the FLIR tables of exiftool:
+# https://exiftool.org/TagNames/FLIR.html
+
+from __future__ import print_function
+
+import argparse
+import struct
+
+# FFF record types
+RECORD_RAW_DATA = 0x01
+RECORD_EMBEDDED_IMAGE = 0x0e
+RECORD_CAMERA_INFO = 0x20
+
+# CameraInfo fields: name -> (offset, struct format)
+CAMERA_INFO_FIELDS = {
+    'Emissivity': (0x20, 'f'),
+    'ObjectDistance': (0x24, 'f'),
+    'ReflectedApparentTemperature': (0x28, 'f'),
+    'AtmosphericTemperature': (0x2c, 'f'),
+    'IRWindowTemperature': (0x30, 'f'),
+    'IRWindowTransmission': (0x34, 'f'),
+    'RelativeHumidity': (0x3c, 'f'),
+    'PlanckR1': (0x58, 'f'),
+    'PlanckB': (0x5c, 'f'),
+    'PlanckF': (0x60, 'f'),
+    'PlanckO': (0x308, 'i'),
+    'PlanckR2': (0x30c, 'f'),
+}
+
+# temperatures are stored in Kelvin
+KELVIN_FIELDS = ['ReflectedApparentTemperature', 'AtmosphericTemperature', 'IRWindowTemperature']
+
+
+class FlirJpegParser:
+    """
+    Parse the FFF record embedded in the APP1 "FLIR" segments of a FLIR JPEG.
+    get_metadata returns the same tags FlirImageExtractor reads with exiftool
+    """
+
+    def __init__(self, jpeg_bytes):
+        self.jpeg_bytes = jpeg_bytes
+        self.exif = None
+        self.fff = self.extract_fff()
+        self.records = self.read_record_directory()
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, 'rb') as fh:
+            return cls(fh.read())
+
+    def extract_fff(self):
+        """
+        Walk the JPEG segments up to the image data and reassemble the FFF record
+        from the APP1 "FLIR" segments, also keep the Exif segment for the thumbnail
+        :return:
+        """
+        data = self.jpeg_bytes
+        if data[:2] != b'\xff\xd8':
+            raise ValueError("Not a JPEG file")
+
+        chunks = {}
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xff:
+                raise ValueError("Corrupted JPEG segment at offset {}".format(pos))
+            marker = data[pos + 1]
+            if marker == 0xda:
+                # start of scan, no more metadata segments
+                break
+            length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            segment = data[pos + 4:pos + 2 + length]
+
+            if marker == 0xe1 and segment[:4] == b'FLIR':
+                # header: "FLIR", 0x00, 0x01, chunk index, index of the last chunk
+                chunks[segment[6]] = segment[8:]
+            elif marker == 0xe1 and segment[:6] == b'Exif\x00\x00':
+                self.exif = segment[6:]
+
+            pos += 2 + length
+
+        if not chunks:
+            raise ValueError("No FLIR segment found, this is not a radiometric FLIR image")
+
+        fff = b''.join(chunks[i] for i in sorted(chunks))
+        if fff[:4] not in (b'FFF\x00', b'AFF\x00'):
+            raise ValueError("Unknown FLIR record format {}".format(fff[:4]))
+        return fff
+
+    def read_record_directory(self):
+        """
+        Read the FFF record directory
+        :return: dict record type -> record bytes
+        """
+        # the header version is 100 in the right byte order
+        byte_order = '>' if 100 <= struct.unpack('>I', self.fff[0x14:0x18])[0] < 200 else '<'
+        dir_offset, dir_count = struct.unpack(byte_order + 'II', self.fff[0x18:0x20])
+
+        records = {}
+        for i in range(dir_count):
+            entry = self.fff[dir_offset + 32 * i:dir_offset + 32 * (i + 1)]
+            record_type, _, _, _, offset, length = struct.unpack(byte_order + 'HHIIII', entry[:20])
+            if record_type and record_type not in records:
+                records[record_type] = self.fff[offset:offset + length]
+
+        return records
+
+    @staticmethod
+    def record_byte_order(record):
+        """
+        Byte order of a record, the first word of the record is 2
+        :return:
+        """
+        return '<' if struct.unpack('<H', record[:2])[0] == 2 else '>'
+
+    def get_camera_info(self):
+        """
+        Calibration values from the CameraInfo record, in the units printed by exiftool
+        (temperatures in C, relative humidity in %)
+        :return:
+        """
+        record = self.records.get(RECORD_CAMERA_INFO)
+        if record is None:
+            raise ValueError("No CameraInfo record found")
+
+        byte_order = FlirJpegParser.record_byte_order(record)
+        info = {}
+        for name, (offset, fmt) in CAMERA_INFO_FIELDS.items():
+            info[name] = struct.unpack(byte_order + fmt, record[offset:offset + 4])[0]
+
+        for name in KELVIN_FIELDS:
+            info[name] -= 273.15
+        if info['RelativeHumidity'] <= 2:
+            # stored as a fraction by most cameras
+            info['RelativeHumidity'] *= 100
+
+        return info
+
+    def get_image_record(self, record_type):
+        """
+        Payload of a RawData/EmbeddedImage record: a PNG, TIFF or JPEG image, or raw 16-bit values
+        :return: (width, height, byte order, payload)
+        """
+        record = self.records[record_type]
+        byte_order = FlirJpegParser.record_byte_order(record)
+        width, height = struct.unpack(byte_order + 'HH', record[2:6])
+        return width, height, byte_order, record[0x20:]
+
+    def get_raw_thermal_image(self):
+        """
+        The raw thermal image, like exiftool raw values are wrapped in a TIFF container
+        :return: (image type, image bytes)
+        """
+        width, height, byte_order, payload = self.get_image_record(RECORD_RAW_DATA)
+
+        if payload[:4] == b'\x89PNG':
+            return 'PNG', payload
+        if payload[:4] in (b'II*\x00', b'MM\x00*'):
+            return 'TIFF', payload
+        return 'TIFF', FlirJpegParser.make_tiff(width, height, byte_order, payload[:width * height * 2])
+
+    @staticmethod
+    def make_tiff(width, height, byte_order, pixels):
+        """
+        Minimal uncompressed 16-bit grayscale TIFF around the given pixel data
+        :return:
+        """
+        entries = [
+            (0x100, 4, width),  # ImageWidth
+            (0x101, 4, height),  # ImageLength
+            (0x102, 3, 16),  # BitsPerSample
+            (0x103, 3, 1),  # Compression: none
+            (0x106, 3, 1),  # PhotometricInterpretation: BlackIsZero
+            (0x111, 4, 0),  # StripOffsets, filled below
+            (0x115, 3, 1),  # SamplesPerPixel
+            (0x116, 4, height),  # RowsPerStrip
+            (0x117, 4, len(pixels)),  # StripByteCounts
+        ]
+        ifd_size = 2 + 12 * len(entries) + 4
+        data_offset = 8 + ifd_size
+
+        header = (b'II' if byte_order == '<' else b'MM') + struct.pack(byte_order + 'HI', 42, 8)
+        ifd = struct.pack(byte_order + 'H', len(entries))
+        for tag, value_type, value in entries:
+            if tag == 0x111:
+                value = data_offset
+            if value_type == 3:
+                ifd += struct.pack(byte_order + 'HHIHH', tag, value_type, 1, value, 0)
+            else:
+                ifd += struct.pack(byte_order + 'HHII', tag, value_type, 1, value)
+        ifd += struct.pack(byte_order + 'I', 0)
+
+        return header + ifd + pixels
+
+    def get_embedded_image(self):
+        """
+        The visual image stored in the FFF record, if any
+        :return:
+        """
+        if RECORD_EMBEDDED_IMAGE not in self.records:
+            return None
+        return self.get_image_record(RECORD_EMBEDDED_IMAGE)[3]
+
+    def get_thumbnail_image(self):
+        """
+        The JPEG thumbnail of the Exif segment (IFD1), if any
+        :return:
+        """
+        tiff = self.exif
+        if tiff is None or tiff[:2] not in (b'II', b'MM'):
+            return None
+        byte_order = '<' if tiff[:2] == b'II' else '>'
+
+        ifd0 = struct.unpack(byte_order + 'I', tiff[4:8])[0]
+        count = struct.unpack(byte_order + 'H', tiff[ifd0:ifd0 + 2])[0]
+        ifd1 = struct.unpack(byte_order + 'I', tiff[ifd0 + 2 + 12 * count:ifd0 + 6 + 12 * count])[0]
+        if not ifd1:
+            return None
+
+        count = struct.unpack(byte_order + 'H', tiff[ifd1:ifd1 + 2])[0]
+        tags = {}
+        for i in range(count):
+            entry = tiff[ifd1 + 2 + 12 * i:ifd1 + 14 + 12 * i]
+            tag, _, _, value = struct.unpack(byte_order + 'HHII', entry)
+            tags[tag] = value
+
+        # JPEGInterchangeFormat, JPEGInterchangeFormatLength
+        if 0x201 not in tags or 0x202 not in tags:
+            return None
+        return tiff[tags[0x201]:tags[0x201] + tags[0x202]]
+
+    def get_metadata(self):
+        """
+        The tags FlirImageExtractor needs, with the names used by exiftool.
+        The distance is the ObjectDistance set on the camera, binary tags are bytes
+        :return:
+        """
+        info = self.get_camera_info()
+        image_type, thermal_img_bytes = self.get_raw_thermal_image()
+
+        meta = dict(info)
+        meta['SubjectDistance'] = info['ObjectDistance']
+        meta['RawThermalImageType'] = image_type
+        meta['RawThermalImage'] = thermal_img_bytes
+
+        embedded_image = self.get_embedded_image()
+        thumbnail_image = self.get_thumbnail_image()
+        # the AX8 does not store a separate visual image, the JPEG itself is the visual one
+        meta['EmbeddedImage'] = embedded_image if embedded_image is not None else self.jpeg_bytes
+        meta['ThumbnailImage'] = thumbnail_image if thumbnail_image is not None else meta['EmbeddedImage']
+
+        return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the calibration of a FLIR radiometric JPEG')
+    parser.add_argument('-i', '--input', type=str, help='Input image. Ex. img.jpg', required=True)
+    args = parser.parse_args()
+
+    flir_meta = FlirJpegParser.from_file(args.input).get_metadata()
+    for key, value in flir_meta.items():
+        if isinstance(value, bytes):
+            value = "({} bytes)".format(len(value))
+        print("{:30}: {}".format(key, value))
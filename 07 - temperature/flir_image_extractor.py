@@ -4,13 +4,20 @@
 from __future__ import print_function
 
 import argparse
+import atexit
+import base64
+import glob
 import io
 import json
 import os
 import os.path
 import re
-import csv
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from math import sqrt, exp, log
 from matplotlib import cm
@@ -18,33 +25,189 @@ from matplotlib import pyplot as plt
 
 import numpy as np
 
+from flir_fff import FlirJpegParser
+
+# tags needed for the conversion of the raw sensor values
+# E=1,SD=1,RTemp=20,ATemp=RTemp,IRWTemp=RTemp,IRT=1,RH=50,PR1=21106.77,PB=1501,PF=1,PO=-7340,PR2=0.012545258
+CALIBRATION_TAGS = ['-Emissivity', '-SubjectDistance', '-AtmosphericTemperature', '-ReflectedApparentTemperature',
+                    '-IRWindowTemperature', '-IRWindowTransmission', '-RelativeHumidity', '-PlanckR1', '-PlanckB',
+                    '-PlanckF', '-PlanckO', '-PlanckR2']
+
+# everything process_image needs, read by a single exiftool call
+SINGLE_PASS_TAGS = ['-RawThermalImageType', '-EmbeddedImage', '-ThumbnailImage',
+                    '-RawThermalImage'] + CALIBRATION_TAGS
+
+BINARY_TAGS = ['EmbeddedImage', 'ThumbnailImage', 'RawThermalImage']
+
+EXTRACTION_MODES = ['spawn', 'single', 'stay_open', 'native']
+
+# thermal export formats, chosen by the file extension
+EXPORT_FORMATS = {'.csv': 'csv', '.npy': 'npy', '.h5': 'hdf5', '.hdf5': 'hdf5', '.parquet': 'parquet'}
+
+
+class ExifTool:
+    """
+    A long-lived `exiftool -stay_open` process: the Perl interpreter is started once
+    and every request is sent through its stdin, avoiding a process start per call
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, exiftool_path="exiftool"):
+        self.exiftool_path = exiftool_path
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen([exiftool_path, '-stay_open', 'True', '-@', '-'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def shared(cls, exiftool_path="exiftool"):
+        """
+        Return the worker for the given exiftool path, shared by all the FlirImageExtractor instances
+        :return:
+        """
+        with cls._shared_lock:
+            exiftool = cls._shared.get(exiftool_path)
+            if exiftool is None or exiftool.process.poll() is not None:
+                exiftool = cls(exiftool_path)
+                cls._shared[exiftool_path] = exiftool
+            return exiftool
+
+    def execute(self, *args):
+        """
+        Run exiftool with the given arguments and return its stdout, like subprocess.check_output
+        :return:
+        """
+        command = '\n'.join(('-charset', 'filename=utf8') + args) + '\n-execute\n'
+        fd = self.process.stdout.fileno()
+        with self.lock:
+            self.process.stdin.write(command.encode('utf-8'))
+            self.process.stdin.flush()
+
+            output = b''
+            while not output[-32:].rstrip().endswith(b'{ready}'):
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise RuntimeError("exiftool terminated unexpectedly")
+                output += chunk
+
+        return output[:output.rstrip().rindex(b'{ready}')]
+
+    def close(self):
+        """
+        Ask the exiftool process to terminate and wait for it
+        :return:
+        """
+        if self.process.poll() is None:
+            with self.lock:
+                self.process.stdin.write(b'-stay_open\nFalse\n')
+                self.process.stdin.flush()
+                self.process.wait()
+
+    @classmethod
+    def close_shared(cls):
+        with cls._shared_lock:
+            for exiftool in cls._shared.values():
+                exiftool.close()
+            cls._shared.clear()
+
+
+atexit.register(ExifTool.close_shared)
+
+
+class TemperatureLUTCache:
+    """
+    Bounded LRU cache of raw -> temperature tables, one 65536-entry table per calibration.
+    The calibration of a camera rarely changes, so after the first frame the conversion is a lookup
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, calibration):
+        """
+        Return the table for the given raw2temp keyword arguments, building it if needed
+        :return: float32 array, table[raw] is the temperature in C
+        """
+        key = tuple(sorted((name, float(value)) for name, value in calibration.items()))
+
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None:
+                self.hits += 1
+                self.tables.move_to_end(key)
+                return table
+            self.misses += 1
+
+        # values out of the calibrated range give nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table = FlirImageExtractor.raw2temp_array(np.arange(65536), **calibration)
+
+        with self.lock:
+            self.tables[key] = table
+            while len(self.tables) > self.maxsize:
+                self.tables.popitem(last=False)
+        return table
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return "lut cache: {} tables, {} hits, {} misses".format(len(self.tables), self.hits, self.misses)
+
 
 class FlirImageExtractor:
 
-    def __init__(self, exiftool_path="exiftool", is_debug=False):
+    # shared by all the instances, flir.py creates a new extractor for every snapshot
+    lut_cache = TemperatureLUTCache()
+
+    def __init__(self, exiftool_path="exiftool", is_debug=False, extraction_mode="single"):
+        """
+        :param extraction_mode: how exiftool is called by process_image:
+            'spawn' runs one exiftool process per extracted item,
+            'single' reads everything with one exiftool process per image,
+            'stay_open' sends the same single request to an exiftool worker shared by all instances,
+            'native' parses the FLIR records in Python (see flir_fff.py), exiftool is not needed
+        """
+        if extraction_mode not in EXTRACTION_MODES:
+            raise ValueError("Unknown extraction mode {}, expected one of {}".format(extraction_mode,
+                                                                                  EXTRACTION_MODES))
+
         self.exiftool_path = exiftool_path
         self.is_debug = is_debug
+        self.extraction_mode = extraction_mode
         self.flir_img_filename = ""
         self.image_suffix = "_rgb_image.jpg"
         self.thumbnail_suffix = "_rgb_thumb.jpg"
         self.thermal_suffix = "_thermal.png"
         self.default_distance = 1.0
 
+        # convert raw values with the cached lookup tables instead of raw2temp_array
+        self.use_lut = True
+
         # valid for PNG thermal images
         self.use_thumbnail = False
         self.fix_endian = True
 
-        self.rgb_image_np = None
-        self.thermal_image_np = None
+        # result of the last process_image
+        self.frame = None
 
     pass
 
     def process_image(self, flir_img_filename):
         """
-        Given a valid image path, process the file: extract real thermal values
-        and a thumbnail for comparison (generally thumbnail is on the visible spectre)
+        Given a valid image path, process the file: read the raw thermal values, the calibration
+        and a thumbnail for comparison (generally thumbnail is on the visible spectre).
+        The images are decoded by the returned frame on first access
         :param flir_img_filename:
-        :return:
+        :return: ThermalFrame
         """
         if self.is_debug:
             print("INFO Flir image filepath:{}".format(flir_img_filename))
@@ -54,98 +217,127 @@ class FlirImageExtractor:
 
         self.flir_img_filename = flir_img_filename
 
-        if self.get_image_type().upper().strip() == "TIFF":
+        if self.extraction_mode == 'spawn':
+            meta = None
+            image_type = self.get_image_type()
+        else:
+            meta = self.extract_metadata()
+            image_type = meta['RawThermalImageType']
+
+        if image_type.upper().strip() == "TIFF":
             # valid for tiff images from Zenmuse XTR
             self.use_thumbnail = True
             self.fix_endian = False
 
-        self.rgb_image_np = self.extract_embedded_image()
-        self.thermal_image_np = self.extract_thermal_image()
+        image_tag = "ThumbnailImage" if self.use_thumbnail else "EmbeddedImage"
+        if meta is None:
+            visual_img_bytes = self.run_exiftool("-" + image_tag, "-b", flir_img_filename)
+
+            # read image metadata needed for conversion of the raw sensor values
+            meta_json = self.run_exiftool(flir_img_filename, *(CALIBRATION_TAGS + ['-j']))
+            meta = json.loads(meta_json.decode())[0]
+
+            # exifread can't extract the embedded thermal image, use exiftool instead
+            thermal_img_bytes = self.run_exiftool("-RawThermalImage", "-b", flir_img_filename)
+        else:
+            visual_img_bytes = FlirImageExtractor.decode_binary(meta[image_tag])
+            thermal_img_bytes = FlirImageExtractor.decode_binary(meta['RawThermalImage'])
+
+        self.frame = ThermalFrame(flir_img_filename, meta, visual_img_bytes, thermal_img_bytes,
+                                  fix_endian=self.fix_endian, use_lut=self.use_lut,
+                                  default_distance=self.default_distance)
+        return self.frame
+
+    def run_exiftool(self, *args):
+        """
+        Run exiftool with the given arguments and return its stdout,
+        through the shared worker when in 'stay_open' mode
+        :return:
+        """
+        if self.extraction_mode == 'stay_open':
+            return ExifTool.shared(self.exiftool_path).execute(*args)
+        return subprocess.check_output([self.exiftool_path] + list(args))
+
+    def extract_metadata(self):
+        """
+        Read the image type, the calibration tags and the embedded images with a single exiftool call,
+        binary tags are returned base64 encoded (see decode_binary)
+        :return:
+        """
+        if self.extraction_mode == 'native':
+            return FlirJpegParser.from_file(self.flir_img_filename).get_metadata()
+
+        meta_json = self.run_exiftool(*(SINGLE_PASS_TAGS + ['-b', '-j', self.flir_img_filename]))
+        return json.loads(meta_json.decode())[0]
+
+    @staticmethod
+    def decode_binary(value):
+        """
+        Decode a binary tag from the exiftool json output, encoded as "base64:..."
+        :return:
+        """
+        if isinstance(value, bytes):
+            return value
+        if value.startswith('base64:'):
+            return base64.b64decode(value[len('base64:'):])
+        return value.encode()
 
     def get_image_type(self):
         """
         Get the embedded thermal image type, generally can be TIFF or PNG
         :return:
         """
-        meta_json = subprocess.check_output(
-            [self.exiftool_path, '-RawThermalImageType', '-j', self.flir_img_filename])
+        meta_json = self.run_exiftool('-RawThermalImageType', '-j', self.flir_img_filename)
         meta = json.loads(meta_json.decode())[0]
 
         return meta['RawThermalImageType']
 
+    def get_frame(self):
+        """
+        Return the last processed frame
+        :return:
+        """
+        return self.frame
+
     def get_rgb_np(self):
         """
         Return the last extracted rgb image
         :return:
         """
-        return self.rgb_image_np
+        return None if self.frame is None else self.frame.rgb
 
     def get_thermal_np(self):
         """
         Return the last extracted thermal image
         :return:
         """
-        return self.thermal_image_np
+        return None if self.frame is None else self.frame.celsius
+
+    # the decoded images of the last frame, read-only
+    rgb_image_np = property(get_rgb_np)
+    thermal_image_np = property(get_thermal_np)
 
     def extract_embedded_image(self):
         """
-        extracts the visual image as 2D numpy array of RGB values
+        extracts the visual image as 2D numpy array of RGB values, decoded once per processed image
         """
-        image_tag = "-EmbeddedImage"
-        if self.use_thumbnail:
-            image_tag = "-ThumbnailImage"
-
-        visual_img_bytes = subprocess.check_output([self.exiftool_path, image_tag, "-b", self.flir_img_filename])
-        visual_img_stream = io.BytesIO(visual_img_bytes)
-
-        visual_img = Image.open(visual_img_stream)
-        visual_np = np.array(visual_img)
-
-        return visual_np
+        return self.frame.rgb
 
     def extract_thermal_image(self):
         """
-        extracts the thermal image as 2D numpy array with temperatures in oC
+        extracts the thermal image as 2D numpy array with temperatures in oC, converted once per processed image
         """
-        # read image metadata needed for conversion of the raw sensor values
-        # E=1,SD=1,RTemp=20,ATemp=RTemp,IRWTemp=RTemp,IRT=1,RH=50,PR1=21106.77,PB=1501,PF=1,PO=-7340,PR2=0.012545258
-        meta_json = subprocess.check_output(
-            [self.exiftool_path, self.flir_img_filename, '-Emissivity', '-SubjectDistance', '-AtmosphericTemperature',
-             '-ReflectedApparentTemperature', '-IRWindowTemperature', '-IRWindowTransmission', '-RelativeHumidity',
-             '-PlanckR1', '-PlanckB', '-PlanckF', '-PlanckO', '-PlanckR2', '-j'])
-        meta = json.loads(meta_json.decode())[0]
+        return self.frame.celsius
 
-        # exifread can't extract the embedded thermal image, use exiftool instead
-        thermal_img_bytes = subprocess.check_output([self.exiftool_path, "-RawThermalImage", "-b", self.flir_img_filename])
-        thermal_img_stream = io.BytesIO(thermal_img_bytes)
-
-        thermal_img = Image.open(thermal_img_stream)
-        thermal_np = np.array(thermal_img)
-
-        # raw values -> temperature
-        subject_distance = self.default_distance
-        if 'SubjectDistance' in meta:
-            subject_distance = FlirImageExtractor.extract_float(meta['SubjectDistance'])
-
-        if self.fix_endian:
-            # fix endianness, the bytes in the embedded png are in the wrong order
-            thermal_np = np.vectorize(lambda x: (x >> 8) + ((x & 0x00ff) << 8))(thermal_np)
-
-        raw2tempfunc = np.vectorize(lambda x: FlirImageExtractor.raw2temp(x, E=meta['Emissivity'], OD=subject_distance,
-                                                                          RTemp=FlirImageExtractor.extract_float(
-                                                                              meta['ReflectedApparentTemperature']),
-                                                                          ATemp=FlirImageExtractor.extract_float(
-                                                                              meta['AtmosphericTemperature']),
-                                                                          IRWTemp=FlirImageExtractor.extract_float(
-                                                                              meta['IRWindowTemperature']),
-                                                                          IRT=meta['IRWindowTransmission'],
-                                                                          RH=FlirImageExtractor.extract_float(
-                                                                              meta['RelativeHumidity']),
-                                                                          PR1=meta['PlanckR1'], PB=meta['PlanckB'],
-                                                                          PF=meta['PlanckF'],
-                                                                          PO=meta['PlanckO'], PR2=meta['PlanckR2']))
-        thermal_np = raw2tempfunc(thermal_np)
-        return thermal_np
+    @staticmethod
+    def swap_endian(raw):
+        """
+        Swap the two bytes of each 16-bit raw value. The buffer is reinterpreted with the opposite
+        byte order, so 16-bit input is not copied
+        :return: uint16 array with swapped byte order
+        """
+        raw = np.asarray(raw).astype(np.uint16, copy=False)
+        return raw.view(raw.dtype.newbyteorder())
 
     @staticmethod
     def raw2temp(raw, E=1, OD=1, RTemp=20, ATemp=20, IRWTemp=20, IRT=1, RH=50, PR1=21106.77, PB=1501, PF=1, PO=-7340,
@@ -193,12 +385,76 @@ class FlirImageExtractor:
         temp_celcius = PB / log(PR1 / (PR2 * (raw_obj + PO)) + PF) - 273.15
         return temp_celcius
 
+    @staticmethod
+    def raw2temp_coefficients(E=1, OD=1, RTemp=20, ATemp=20, IRWTemp=20, IRT=1, RH=50, PR1=21106.77, PB=1501, PF=1,
+                              PO=-7340, PR2=0.012545258):
+        """
+        Compute the per-image terms of raw2temp, which do not depend on the pixel value.
+        The object radiance is linear in the raw value: raw_obj = raw * gain - offset
+        :return: (gain, offset)
+        """
+
+        # constants
+        ATA1 = 0.006569
+        ATA2 = 0.01262
+        ATB1 = -0.002276
+        ATB2 = -0.00667
+        ATX = 1.9
+
+        # transmission through window (calibrated)
+        emiss_wind = 1 - IRT
+        refl_wind = 0
+
+        # transmission through the air
+        h2o = (RH / 100) * exp(1.5587 + 0.06939 * (ATemp) - 0.00027816 * (ATemp) ** 2 + 0.00000068455 * (ATemp) ** 3)
+        tau1 = ATX * exp(-sqrt(OD / 2) * (ATA1 + ATB1 * sqrt(h2o))) + (1 - ATX) * exp(
+            -sqrt(OD / 2) * (ATA2 + ATB2 * sqrt(h2o)))
+        tau2 = tau1
+
+        # radiance from the environment
+        raw_refl = PR1 / (PR2 * (exp(PB / (RTemp + 273.15)) - PF)) - PO
+        raw_atm = PR1 / (PR2 * (exp(PB / (ATemp + 273.15)) - PF)) - PO
+        raw_wind = PR1 / (PR2 * (exp(PB / (IRWTemp + 273.15)) - PF)) - PO
+        raw_refl1_attn = (1 - E) / E * raw_refl
+        raw_atm1_attn = (1 - tau1) / E / tau1 * raw_atm
+        raw_wind_attn = emiss_wind / E / tau1 / IRT * raw_wind
+        raw_refl2_attn = refl_wind / E / tau1 / IRT * raw_refl
+        raw_atm2_attn = (1 - tau2) / E / tau1 / IRT / tau2 * raw_atm
+
+        gain = 1 / E / tau1 / IRT / tau2
+        offset = raw_atm1_attn + raw_atm2_attn + raw_wind_attn + raw_refl1_attn + raw_refl2_attn
+        return gain, offset
+
+    @staticmethod
+    def raw2temp_array(raw, E=1, OD=1, RTemp=20, ATemp=20, IRWTemp=20, IRT=1, RH=50, PR1=21106.77, PB=1501, PF=1,
+                       PO=-7340, PR2=0.012545258):
+        """
+        Array version of raw2temp: the atmospheric and window terms are computed once per image,
+        then the Planck inversion is applied to the whole raw frame at once
+        :return: temperatures in C as a float32 array with the shape of raw
+        """
+        gain, offset = FlirImageExtractor.raw2temp_coefficients(E=E, OD=OD, RTemp=RTemp, ATemp=ATemp,
+                                                                 IRWTemp=IRWTemp, IRT=IRT, RH=RH, PR1=PR1, PB=PB,
+                                                                 PF=PF, PO=PO, PR2=PR2)
+
+        # PB / log(PR1 / (PR2 * (raw_obj + PO)) + PF) - 273.15, evaluated in place on one float64 buffer
+        temp = np.asarray(raw, dtype=np.float64) * (PR2 * gain)
+        temp += PR2 * (PO - offset)
+        np.divide(PR1, temp, out=temp)
+        temp += PF
+        np.log(temp, out=temp)
+        np.divide(PB, temp, out=temp)
+        temp -= 273.15
+        return temp.astype(np.float32)
+
     @staticmethod
     def extract_float(dirtystr):
         """
         Extract the float value of a string, helpful for parsing the exiftool data
         :return:
         """
+        if isinstance(dirtystr, (int, float)):
+            return float(dirtystr)
         digits = re.findall(r"[-+]?\d*\.\d+|\d+", dirtystr)
         return float(digits[0])
 
@@ -222,7 +478,7 @@ class FlirImageExtractor:
         :return:
         """
         rgb_np = self.get_rgb_np()
-        thermal_np = self.extract_thermal_image()
+        thermal_np = self.get_thermal_np()
 
         img_visual = Image.fromarray(rgb_np)
         thermal_normalized = (thermal_np - np.amin(thermal_np)) / (np.amax(thermal_np) - np.amin(thermal_np))
@@ -241,44 +497,314 @@ class FlirImageExtractor:
         img_visual.save(image_filename)
         img_thermal.save(thermal_filename)
 
+    def export_thermal(self, filename, export_format=None):
+        """
+        Export the thermal data in one of the EXPORT_FORMATS, by default chosen by the file extension
+        :return:
+        """
+        if export_format is None:
+            export_format = EXPORT_FORMATS.get(os.path.splitext(filename)[1].lower(), 'csv')
+
+        if export_format == 'csv':
+            self.export_thermal_to_csv(filename)
+        elif export_format == 'npy':
+            self.export_thermal_to_npy(filename)
+        elif export_format == 'hdf5':
+            self.export_thermal_to_hdf5(filename)
+        elif export_format == 'parquet':
+            self.export_thermal_to_parquet(filename)
+        else:
+            raise ValueError("Unknown export format {}, expected one of {}".format(
+                export_format, sorted(set(EXPORT_FORMATS.values()))))
+
+    def get_thermal_table(self):
+        """
+        The thermal data as columns, one row per pixel: x (row index), y (column index), temperature
+        :return: (x, y, temp)
+        """
+        thermal_np = np.asarray(self.thermal_image_np, dtype=np.float32)
+        x, y = np.indices(thermal_np.shape, dtype=np.int32)
+        return x.ravel(), y.ravel(), thermal_np.ravel()
+
     def export_thermal_to_csv(self, csv_filename):
         """
-        Convert thermal data in numpy to json
+        Export the thermal data per pixel as csv, one x, y, temp (c) row per pixel
         :return:
         """
+        thermal_np = np.asarray(self.thermal_image_np, dtype=np.float32)
+
+        # the x, y columns of a row are constant text, only the temperatures are formatted
+        row_format = ''.join('{x},%d,%%.4f\n' % y for y in range(thermal_np.shape[1]))
 
         with open(csv_filename, 'w') as fh:
-            writer = csv.writer(fh, delimiter=',')
-            writer.writerow(['x', 'y', 'temp (c)'])
+            fh.write('x,y,temp (c)\n')
+            for x, row in enumerate(thermal_np):
+                fh.write(row_format.replace('{x}', str(x)) % tuple(row.tolist()))
 
-            pixel_values = []
-            for e in np.ndenumerate(self.thermal_image_np):
-                x, y = e[0]
-                c = e[1]
-                pixel_values.append([x, y, c])
+    def export_thermal_to_npy(self, npy_filename):
+        """
+        Save the thermal data as a float32 array, it can be memory mapped with np.load(mmap_mode='r')
+        :return:
+        """
+        np.save(npy_filename, np.asarray(self.thermal_image_np, dtype=np.float32))
 
-            writer.writerows(pixel_values)
+    def export_thermal_to_hdf5(self, h5_filename):
+        """
+        Save the thermal data compressed in a HDF5 file, with the calibration as attributes.
+        Requires h5py
+        :return:
+        """
+        import h5py
+
+        with h5py.File(h5_filename, 'w') as fh:
+            dataset = fh.create_dataset('thermal', data=np.asarray(self.thermal_image_np, dtype=np.float32),
+                                        compression='gzip', shuffle=True)
+            dataset.attrs['source'] = self.frame.filename
+            for name, value in self.frame.calibration.items():
+                dataset.attrs[name] = value
+
+    def export_thermal_to_parquet(self, parquet_filename):
+        """
+        Save the thermal data per pixel in a compressed Parquet file, with the calibration in the file metadata.
+        Requires pandas and pyarrow
+        :return:
+        """
+        import pandas as pd
+
+        x, y, temp = self.get_thermal_table()
+        df = pd.DataFrame({'x': x, 'y': y, 'temp (c)': temp})
+        df.attrs['source'] = self.frame.filename
+        df.attrs.update(self.frame.calibration)
+        df.to_parquet(parquet_filename, compression='zstd', index=False)
+
+
+class ThermalFrame:
+    """
+    The images and metadata of one FLIR file, returned by FlirImageExtractor.process_image.
+    rgb, raw and celsius are decoded on first access and then reused, the arrays are read-only
+    """
+
+    def __init__(self, filename, meta, visual_img_bytes, thermal_img_bytes, fix_endian=True, use_lut=True,
+                 default_distance=1.0):
+        self._filename = filename
+        # the binary tags are kept only until decoded
+        self._meta = MappingProxyType({name: value for name, value in meta.items() if name not in BINARY_TAGS})
+        self._visual_img_bytes = visual_img_bytes
+        self._thermal_img_bytes = thermal_img_bytes
+        self._fix_endian = fix_endian
+        self._use_lut = use_lut
+        self._default_distance = default_distance
+
+        self._rgb = None
+        self._raw = None
+        self._celsius = None
+        self._calibration = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def meta(self):
+        """
+        The tags read from the file, without the embedded images
+        """
+        return self._meta
+
+    @property
+    def rgb(self):
+        """
+        The visual image as 2D numpy array of RGB values
+        """
+        if self._rgb is None:
+            self._rgb = ThermalFrame.read_only(np.array(Image.open(io.BytesIO(self._visual_img_bytes))))
+            self._visual_img_bytes = None
+        return self._rgb
+
+    @property
+    def raw(self):
+        """
+        The raw 16-bit sensor values
+        """
+        if self._raw is None:
+            raw = np.asarray(Image.open(io.BytesIO(self._thermal_img_bytes)))
+            if self._fix_endian:
+                # fix endianness, the bytes in the embedded png are in the wrong order
+                raw = FlirImageExtractor.swap_endian(raw)
+            self._raw = ThermalFrame.read_only(raw)
+            self._thermal_img_bytes = None
+        return self._raw
+
+    @property
+    def calibration(self):
+        """
+        The raw2temp arguments for this frame
+        """
+        if self._calibration is None:
+            meta = self._meta
+            subject_distance = self._default_distance
+            if 'SubjectDistance' in meta:
+                subject_distance = FlirImageExtractor.extract_float(meta['SubjectDistance'])
+
+            self._calibration = MappingProxyType(dict(
+                E=meta['Emissivity'], OD=subject_distance,
+                RTemp=FlirImageExtractor.extract_float(meta['ReflectedApparentTemperature']),
+                ATemp=FlirImageExtractor.extract_float(meta['AtmosphericTemperature']),
+                IRWTemp=FlirImageExtractor.extract_float(meta['IRWindowTemperature']),
+                IRT=meta['IRWindowTransmission'],
+                RH=FlirImageExtractor.extract_float(meta['RelativeHumidity']),
+                PR1=meta['PlanckR1'], PB=meta['PlanckB'], PF=meta['PlanckF'],
+                PO=meta['PlanckO'], PR2=meta['PlanckR2']))
+        return self._calibration
+
+    @property
+    def celsius(self):
+        """
+        The thermal image as 2D numpy array with temperatures in oC
+        """
+        if self._celsius is None:
+            raw = self.raw
+            calibration = dict(self.calibration)
+            if self._use_lut and np.issubdtype(raw.dtype, np.integer):
+                # 16-bit raw values: one gather in the table of this calibration
+                celsius = np.take(FlirImageExtractor.lut_cache.get(calibration), raw)
+            else:
+                celsius = FlirImageExtractor.raw2temp_array(raw, **calibration)
+            self._celsius = ThermalFrame.read_only(celsius)
+        return self._celsius
+
+    @staticmethod
+    def read_only(array):
+        array.flags.writeable = False
+        return array
+
+
+def find_images(pattern):
+    """
+    List the images of a directory, or matching a glob pattern
+    :return:
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.jpg')
+    return sorted(filename for filename in glob.glob(pattern)
+                  if os.path.isfile(filename) and not filename.endswith(('_rgb_image.jpg', '_rgb_thumb.jpg')))
+
+
+def extract_to_files(flir_img_filename, output_dir=None, exiftool_path="exiftool", extraction_mode="single"):
+    """
+    Batch worker: save the temperatures as .npy and the rgb image of one file,
+    files with both outputs already saved are skipped
+    :return: the stage timings, None if the file was skipped
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(flir_img_filename)
+    fie = FlirImageExtractor(exiftool_path=exiftool_path, extraction_mode=extraction_mode)
+
+    fn_prefix = os.path.join(output_dir, os.path.splitext(os.path.basename(flir_img_filename))[0])
+    thermal_filename = fn_prefix + "_thermal.npy"
+    if os.path.isfile(thermal_filename) and (os.path.isfile(fn_prefix + fie.image_suffix) or
+                                             os.path.isfile(fn_prefix + fie.thumbnail_suffix)):
+        return None
+
+    timings = {}
+    start = time.perf_counter()
+    frame = fie.process_image(flir_img_filename)
+    rgb_np, raw_np = frame.rgb, frame.raw
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    thermal_np = frame.celsius
+    timings['convert'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_filename = fn_prefix + (fie.thumbnail_suffix if fie.use_thumbnail else fie.image_suffix)
+    Image.fromarray(rgb_np).save(image_filename)
+    np.save(thermal_filename, thermal_np)
+    timings['save'] = time.perf_counter() - start
+
+    return timings
+
+
+def process_batch(pattern, output_dir=None, workers=None, exiftool_path="exiftool", extraction_mode="single"):
+    """
+    Extract all the images of a directory or glob pattern on a pool of processes,
+    print the throughput and the mean time of each stage
+    :return:
+    """
+    filenames = find_images(pattern)
+    if not filenames:
+        raise ValueError("No input image found for {}".format(pattern))
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    processed, skipped, failed = 0, 0, 0
+    totals = {'decode': 0.0, 'convert': 0.0, 'save': 0.0}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extract_to_files, filename, output_dir, exiftool_path, extraction_mode): filename
+                   for filename in filenames}
+        for future, filename in futures.items():
+            try:
+                timings = future.result()
+            except Exception as e:
+                print("ERROR {}: {}".format(filename, e))
+                failed += 1
+                continue
+
+            if timings is None:
+                skipped += 1
+                continue
+            processed += 1
+            for stage in totals:
+                totals[stage] += timings[stage]
+
+    elapsed = time.perf_counter() - start
+    print("{} images processed, {} skipped, {} failed in {:.2f} s: {:.2f} images/s".format(
+        processed, skipped, failed, elapsed, processed / elapsed if elapsed > 0 else 0))
+    if processed:
+        print("mean time per image: " + ", ".join("{} {:.2f} ms".format(stage, total / processed * 1e3)
+                                                  for stage, total in totals.items()))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Extract and visualize Flir Image data')
-    parser.add_argument('-i', '--input', type=str, help='Input image. Ex. img.jpg', required=True)
+    parser.add_argument('-i', '--input', type=str, required=True,
+                        help='Input image, or a directory or glob pattern for batch processing. Ex. img.jpg, "imgs/*.jpg"')
+    parser.add_argument('-o', '--output', type=str, help='Output directory for batch processing, default next to '
+                                                         'the input images', required=False)
+    parser.add_argument('-w', '--workers', type=int, help='Number of processes for batch processing, default one '
+                                                          'per cpu', required=False)
     parser.add_argument('-p', '--plot', help='Generate a plot using matplotlib', required=False, action='store_true')
     parser.add_argument('-exif', '--exiftool', type=str, help='Custom path to exiftool', required=False,
                         default='exiftool')
-    parser.add_argument('-csv', '--extractcsv', help='Export the thermal data per pixel encoded as csv file',
-                        required=False)
+    parser.add_argument('-m', '--mode', type=str, help='How exiftool is called', required=False,
+                        choices=EXTRACTION_MODES, default='single')
+    parser.add_argument('-csv', '--extractcsv', required=False,
+                        help='Export the thermal data per pixel, the format is chosen by the extension: '
+                             '.csv, .npy, .h5 or .parquet')
     parser.add_argument('-d', '--debug', help='Set the debug flag', required=False,
                         action='store_true')
     args = parser.parse_args()
 
-    fie = FlirImageExtractor(exiftool_path=args.exiftool, is_debug=args.debug)
-    fie.process_image(args.input)
+    # a directory or a glob pattern is a batch, anything else must be an existing image
+    batch = os.path.isdir(args.input) or glob.escape(args.input) != args.input
+    if not batch and not os.path.isfile(args.input):
+        parser.error("file not found: {}".format(args.input))
+    if batch and (args.plot or args.extractcsv):
+        parser.error("-p/--plot and -csv/--extractcsv need a single input image, not a directory or pattern")
+
+    if batch:
+        process_batch(args.input, output_dir=args.output, workers=args.workers, exiftool_path=args.exiftool,
+                      extraction_mode=args.mode)
+    else:
+        fie = FlirImageExtractor(exiftool_path=args.exiftool, is_debug=args.debug, extraction_mode=args.mode)
+        fie.process_image(args.input)
 
-    if args.plot:
-        fie.plot()
+        if args.plot:
+            fie.plot()
 
-    if args.extractcsv:
-        fie.export_thermal_to_csv(args.extractcsv)
+        if args.extractcsv:
+            fie.export_thermal(args.extractcsv)
 
-    fie.save_images()
\ No newline at end of file
+        fie.save_images()
@@ -5,13 +5,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 from flir_image_extractor import FlirImageExtractor  # Assuming both files are in same directory
 from flir import Flir
+from thermal_archive import ThermalArchive
 
 class FlirThermalProcessor:
-    def __init__(self, camera_url, exiftool_path="exiftool"):
+    def __init__(self, camera_url, exiftool_path="exiftool", archive_path=None):
         self.camera_url = camera_url
         self.exiftool_path = exiftool_path
         self.fie = FlirImageExtractor(exiftool_path=exiftool_path)
         
+        # if given, temperature data is appended to a thermal archive instead of one file per capture
+        self.archive_path = archive_path
+        self.archive = None
+        
         # Initialize FLIR camera connection
         self.flir = Flir(baseURL=camera_url)
         self.flir.login()
@@ -41,10 +46,10 @@ class FlirThermalProcessor:
     
     def process_images(self, thermal_filename):
         """Process thermal image to extract temperature data"""
-        self.fie.process_image(thermal_filename)
+        frame = self.fie.process_image(thermal_filename)
         
-        # Get the thermal data in Celsius
-        thermal_data = self.fie.get_thermal_np()
+        # Get the thermal data in Celsius, decoded once and shared with the extractor
+        thermal_data = frame.celsius
         
         return thermal_data
     
@@ -71,7 +76,15 @@ class FlirThermalProcessor:
         plt.show()
     
     def save_temperature_data(self, thermal_data, output_dir="output"):
-        """Save temperature data as numpy array"""
+        """Save temperature data as numpy array, or append it to the thermal archive"""
+        if self.archive_path is not None:
+            if self.archive is None:
+                self.archive = ThermalArchive(self.archive_path, frame_shape=thermal_data.shape, mode='a')
+            frame = self.fie.get_frame()
+            index = self.archive.append(thermal_data, calibration=frame.calibration if frame else None)
+            print(f"Temperature data appended to {self.archive_path} as frame {index}")
+            return self.archive_path
+
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         temp_filename = os.path.join(output_dir, f"temperature_{timestamp}.npy")
         np.save(temp_filename, thermal_data)
@@ -1,48 +1,110 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import gradio as gr
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from patch_analytics import PatchAnalytics, SERIES_COLUMNS, lttb_indices
+
+CACHE_SIZE = 8  # analytics of the last uploaded files kept in memory
+PIXEL_BUDGET = 800  # points per plot, about one per pixel of the 8 inch figure
+MARKER_POINTS = 100  # markers are drawn only on short series
+
+class AnalyticsCache:
+    """
+    LRU cache of the analytics of the uploaded files, shared by the sessions and keyed by
+    the hash of the file content: each session only keeps its key, and a file uploaded
+    by several users is analyzed once
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, filename):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
 
-df_cache = None  # global cache to store the uploaded dataframe
+        # analyzed outside the lock, the other sessions keep plotting meanwhile
+        analytics = PatchAnalytics.from_csv(filename)
+
+        with self.lock:
+            self.entries[key] = analytics
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return analytics
+
+analytics_cache = AnalyticsCache()
+
+def file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def patch_label(key):
+    return " / ".join(str(value) for value in key)
 
 def read_csv(file):
-    global df_cache
     if file is None:
-        return "No file uploaded.", None, None
+        return "No file uploaded.", None, None, None, None
     try:
-        df_cache = pd.read_csv(file.name)
-        # adding one entry for each temperature reading
-        df_cache['readings'] = np.arange(1, len(df_cache) + 1) 
-        columns = list(df_cache.columns)
-        return df_cache.head().to_string(index=False), gr.update(choices=columns), gr.update(choices=columns)
+        # the session keeps the key of its upload, the file is read again only if it was evicted
+        upload = (file_hash(file.name), file.name)
+        analytics = analytics_cache.get(*upload)
+        # (label, index in analytics.keys()) choices, the ids are never parsed back from the label
+        patches = [(patch_label(key), index) for index, key in enumerate(analytics.keys())]
+        columns = ['time', 'readings'] + SERIES_COLUMNS + ['valid', 'steady']
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            summary = analytics.summary().to_string(index=False)
+        return (summary, upload, gr.update(choices=patches, value=0 if patches else None),
+                gr.update(choices=columns), gr.update(choices=columns))
     except Exception as e:
-        return f"Error reading CSV file: {str(e)}", None, None
+        return f"Error reading CSV file: {str(e)}", None, None, None, None
 
-def plot_columns(x_col, y_col):
-    global df_cache
-    if df_cache is None or x_col is None or y_col is None:
+def plot_columns(upload, patch, x_col, y_col):
+    if upload is None or patch is None or x_col is None or y_col is None:
         return None
     try:
-        plt.figure(figsize=(8, 5))
-        plt.plot(df_cache[x_col], df_cache[y_col], marker='o')
-        plt.xlabel(x_col)
-        plt.ylabel(y_col)
-        plt.title(f"Plot of {y_col} vs {x_col}")
-        plt.grid(True)
-        return plt
+        analytics = analytics_cache.get(*upload)
+        series = analytics.series(*analytics.keys()[patch]).dropna(subset=[x_col, y_col])
+        # downsampled to the pixel budget, the shape of the line is kept
+        series = series.iloc[lttb_indices(series[x_col], series[y_col], PIXEL_BUDGET)]
+
+        # a new Figure per call, pyplot's global state is not shared by concurrent sessions
+        fig = Figure(figsize=(8, 5))
+        ax = fig.subplots()
+        ax.plot(series[x_col], series[y_col], marker='o' if len(series) <= MARKER_POINTS else None)
+        ax.set_xlabel(x_col)
+        ax.set_ylabel(y_col)
+        ax.set_title(f"Plot of {y_col} vs {x_col} ({analytics.bucket} means of the valid readings)")
+        ax.grid(True)
+        fig.autofmt_xdate()
+        return fig
     except Exception as e:
         return f"Error generating plot: {str(e)}"
 
 with gr.Blocks() as demo:
     gr.Markdown("## CSV Reader and Plotter")
+    upload_state = gr.State(None)  # (hash, filename) of the file uploaded in this session
     csv_input = gr.File(label="Upload CSV File", file_types=[".csv"])
-    output_text = gr.Textbox(label="CSV Preview", lines=10)
+    output_text = gr.Textbox(label="Steady-state summary", lines=10)
+    patch_dropdown = gr.Dropdown(label="Patient / patch")
     x_dropdown = gr.Dropdown(label="X-axis column")
     y_dropdown = gr.Dropdown(label="Y-axis column")
     plot_output = gr.Plot(label="Data Plot")
 
-    csv_input.change(fn=read_csv, inputs=csv_input, outputs=[output_text, x_dropdown, y_dropdown])
-    x_dropdown.change(fn=plot_columns, inputs=[x_dropdown, y_dropdown], outputs=plot_output)
-    y_dropdown.change(fn=plot_columns, inputs=[x_dropdown, y_dropdown], outputs=plot_output)
+    plot_inputs = [upload_state, patch_dropdown, x_dropdown, y_dropdown]
+    csv_input.change(fn=read_csv, inputs=csv_input,
+                     outputs=[output_text, upload_state, patch_dropdown, x_dropdown, y_dropdown])
+    patch_dropdown.change(fn=plot_columns, inputs=plot_inputs, outputs=plot_output)
+    x_dropdown.change(fn=plot_columns, inputs=plot_inputs, outputs=plot_output)
+    y_dropdown.change(fn=plot_columns, inputs=plot_inputs, outputs=plot_output)
 
 demo.launch()
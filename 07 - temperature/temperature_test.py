@@ -5,7 +5,8 @@ def read_csv(file):
     if file is None:
         return "No file uploaded."
     try:
-        df = pd.read_csv(file.name)
+        # only the preview rows are read, large exports are summarized by patch_analytics.py
+        df = pd.read_csv(file.name, nrows=5)
         #df = pd.read_csv(file.name)["temperatureProcessed"]
         return df.head().to_string(index=False)  # show first five rows
     except Exception as e:
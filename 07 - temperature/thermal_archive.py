@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Append-only archive of thermal frames for long interval captures.
+# All the frames live in one preallocated memory-mapped cube that grows when full,
+# with a timestamp and a calibration index per frame. Readers can open the archive
+# while the capture loop is writing and slice time ranges without copying.
+#
+# Layout of the archive directory:
+#   header.json        frame shape and dtype
+#   frames.dat         (capacity, height, width) frames
+#   timestamps.dat     (capacity,) float64 seconds since the epoch
+#   calibrations.dat   (capacity,) int32 index into calibrations.json
+#   calibrations.json  list of raw2temp calibrations
+#   count.dat          number of committed frames, written after the frame itself
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+class ThermalArchive:
+
+    def __init__(self, path, frame_shape=None, dtype='float32', mode='r', initial_capacity=1024):
+        """
+        :param path: archive directory
+        :param frame_shape: (height, width), needed only to create a new archive
+        :param dtype: float32 for temperatures in C, uint16 for raw values
+        :param mode: 'r' to read, 'a' to append (the archive is created if needed)
+        """
+        if mode not in ('r', 'a'):
+            raise ValueError("Unknown mode {}, expected 'r' or 'a'".format(mode))
+
+        self.path = path
+        self.mode = mode
+        header_filename = os.path.join(path, 'header.json')
+
+        if not os.path.isfile(header_filename):
+            if mode == 'r' or frame_shape is None:
+                raise ValueError("No thermal archive in {}".format(path))
+            os.makedirs(path, exist_ok=True)
+            with open(header_filename, 'w') as fh:
+                json.dump({'frame_shape': list(frame_shape), 'dtype': np.dtype(dtype).name}, fh)
+            self._write_calibrations([])
+            np.zeros(1, dtype=np.int64).tofile(os.path.join(path, 'count.dat'))
+            self._resize(initial_capacity)
+
+        with open(header_filename) as fh:
+            header = json.load(fh)
+        self.frame_shape = tuple(header['frame_shape'])
+        self.dtype = np.dtype(header['dtype'])
+
+        self._count = np.memmap(os.path.join(path, 'count.dat'), dtype=np.int64, mode='r+' if mode == 'a' else 'r',
+                                shape=(1,))
+        self.calibrations = []
+        self._map()
+
+    def _resize(self, capacity):
+        """
+        Grow the data files to the given number of frames, existing data is kept
+        :return:
+        """
+        header_filename = os.path.join(self.path, 'header.json')
+        with open(header_filename) as fh:
+            header = json.load(fh)
+        frame_size = int(np.prod(header['frame_shape'])) * np.dtype(header['dtype']).itemsize
+
+        for filename, item_size in [('frames.dat', frame_size), ('timestamps.dat', 8), ('calibrations.dat', 4)]:
+            with open(os.path.join(self.path, filename), 'ab') as fh:
+                fh.truncate(capacity * item_size)
+
+    def _map(self):
+        """
+        Map the data files with their current size
+        :return:
+        """
+        memmap_mode = 'r+' if self.mode == 'a' else 'r'
+        frame_size = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.capacity = os.path.getsize(os.path.join(self.path, 'frames.dat')) // frame_size
+
+        self._frames = np.memmap(os.path.join(self.path, 'frames.dat'), dtype=self.dtype, mode=memmap_mode,
+                                 shape=(self.capacity,) + self.frame_shape)
+        self._timestamps = np.memmap(os.path.join(self.path, 'timestamps.dat'), dtype=np.float64,
+                                     mode=memmap_mode, shape=(self.capacity,))
+        self._calibration_ids = np.memmap(os.path.join(self.path, 'calibrations.dat'), dtype=np.int32,
+                                          mode=memmap_mode, shape=(self.capacity,))
+        self._load_calibrations()
+
+    def _load_calibrations(self):
+        with open(os.path.join(self.path, 'calibrations.json')) as fh:
+            self.calibrations = json.load(fh)
+
+    def _write_calibrations(self, calibrations):
+        """
+        Replace calibrations.json at once, readers never see it half written
+        :return:
+        """
+        fd, temp_filename = tempfile.mkstemp(suffix='.json', dir=self.path)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(calibrations, fh)
+            os.replace(temp_filename, os.path.join(self.path, 'calibrations.json'))
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    def refresh(self):
+        """
+        Readers: pick up the frames appended since the archive was opened
+        :return: the number of frames
+        """
+        count = len(self)
+        if count > self.capacity:
+            self._map()
+        elif count and self._calibration_ids[count - 1] >= len(self.calibrations):
+            self._load_calibrations()
+        return count
+
+    def __len__(self):
+        return int(self._count[0])
+
+    def append(self, frame, timestamp=None, calibration=None):
+        """
+        Append a frame, the readers see it once it is completely written
+        :param timestamp: seconds since the epoch, default now
+        :param calibration: raw2temp arguments of the frame
+        :return: index of the frame
+        """
+        if self.mode != 'a':
+            raise ValueError("Archive opened read-only")
+
+        frame = np.asarray(frame)
+        if frame.shape != self.frame_shape:
+            raise ValueError("Frame shape {} differs from the archive {}".format(frame.shape, self.frame_shape))
+
+        index = len(self)
+        if index >= self.capacity:
+            # grow by doubling, the memmaps of the readers stay valid until they refresh
+            self._frames.flush()
+            self._resize(self.capacity * 2)
+            self._map()
+
+        calibration_id = -1
+        if calibration is not None:
+            calibration = {name: float(value) for name, value in dict(calibration).items()}
+            if calibration not in self.calibrations:
+                self.calibrations.append(calibration)
+                self._write_calibrations(self.calibrations)
+            calibration_id = self.calibrations.index(calibration)
+
+        self._frames[index] = frame
+        self._timestamps[index] = time.time() if timestamp is None else timestamp
+        self._calibration_ids[index] = calibration_id
+
+        # commit: the count is written last
+        self._count[0] = index + 1
+        return index
+
+    @property
+    def frames(self):
+        """
+        All the committed frames, a view of the memory map
+        """
+        # refresh first, it maps the files again if the archive grew
+        count = self.refresh()
+        return self._frames[:count]
+
+    @property
+    def timestamps(self):
+        count = self.refresh()
+        return self._timestamps[:count]
+
+    def time_range(self, start=None, stop=None):
+        """
+        Frames with start <= timestamp < stop, without copying
+        :return: (frames, timestamps) views
+        """
+        count = self.refresh()
+        timestamps = self._timestamps[:count]
+        first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        last = count if stop is None else int(np.searchsorted(timestamps, stop, side='left'))
+        return self._frames[first:last], timestamps[first:last]
+
+    def get_calibration(self, index):
+        """
+        The calibration of a frame, None if it was not given
+        :return:
+        """
+        calibration_id = int(self._calibration_ids[index])
+        if calibration_id >= len(self.calibrations):
+            self._load_calibrations()
+        return None if calibration_id < 0 else self.calibrations[calibration_id]
+
+    def flush(self):
+        if self.mode == 'a':
+            self._frames.flush()
+            self._timestamps.flush()
+            self._calibration_ids.flush()
+            self._count.flush()
+
+    def close(self):
+        self.flush()
+        self._frames = self._timestamps = self._calibration_ids = self._count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check():
+    """
+    A reader opened before the writer grows the archive sees all the frames, with their calibrations
+    :return:
+    """
+    with tempfile.TemporaryDirectory() as path:
+        writer = ThermalArchive(path, frame_shape=(60, 80), mode='a', initial_capacity=2)
+        writer.append(np.zeros((60, 80)), timestamp=0.0, calibration={'R1': 1.0})
+        reader = ThermalArchive(path)
+
+        for i in range(1, 5):
+            writer.append(np.full((60, 80), i), timestamp=float(i), calibration={'R1': float(i % 2)})
+
+        assert writer.capacity > reader.capacity, "the archive did not grow"
+        frames, timestamps = reader.frames, reader.timestamps
+        assert frames.shape == (5, 60, 80), frames.shape
+        assert timestamps.shape == (5,), timestamps.shape
+        assert np.array_equal(frames[:, 0, 0], np.arange(5)), frames[:, 0, 0]
+        assert [reader.get_calibration(i)['R1'] for i in range(5)] == [1.0, 1.0, 0.0, 1.0, 0.0]
+        # no temporary file left behind by the replacements of calibrations.json
+        assert sorted(name for name in os.listdir(path) if name.endswith('.json')) == ['calibrations.json',
+                                                                                      'header.json']
+        reader.close()
+        writer.close()
+    print("Reader after growth: 5 frames (60, 80), calibrations OK")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summary of a thermal archive')
+    parser.add_argument('-i', '--input', type=str, help='Archive directory', required=False, default=None)
+    parser.add_argument('--check', action='store_true', help='Check a reader while the archive grows')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        raise SystemExit
+    if args.input is None:
+        parser.error("the following arguments are required: -i/--input")
+
+    with ThermalArchive(args.input) as archive:
+        timestamps = archive.timestamps
+        print("{} frames {} {}, {} calibrations".format(len(timestamps), archive.frame_shape, archive.dtype,
+                                                         len(archive.calibrations)))
+        if len(timestamps):
+            print("from {} to {}".format(time.ctime(timestamps[0]), time.ctime(timestamps[-1])))